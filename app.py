@@ -1,24 +1,87 @@
 from fasthtml.common import *
-from utils import get_file_types, get_directory_structure
+from utils import directory_children, scan_archive, scan_files, scan_repo, scan_tree, count_tokens
+from export import COMPRESSIONS, FORMATS, compress_stream, is_excluded, iter_files, iter_part, render_text
+from packer import POLICIES, pack, parse_weights, plan_parts
+from combine_cache import CombineCache, etag_matches, selection_key
+from clone_jobs import CloneJob, CloneOptions, checkout_path, git_clone, mirror_path, refresh_checkout, update_mirror
+from git_objects import CatFile, TreeSource, resolve_revision
+from archives import ARCHIVE_SUFFIXES, ArchiveReader, ArchiveSource, ArchiveTooLarge, archive_suffix
+from repo_registry import RepoEntry, RepoRegistry, repo_id
+from single_flight import SingleFlight
+from shared_scans import SharedScans
+from part_plans import PartPlans
+from tokenizer import ENCODINGS, DEFAULT_ENCODING, get_tokenizer, resolve_encoding
+import asyncio
 import os
-import subprocess
+import threading
 import logging
+import uuid
 from typing import Optional
-from starlette.responses import RedirectResponse
+from starlette.responses import FileResponse, RedirectResponse, Response, StreamingResponse
 from starlette.requests import Request
-from starlette.datastructures import State, FormData
+from starlette.datastructures import State, FormData, UploadFile
 from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from collections import OrderedDict
+import hashlib
 import json
+import shutil
+import tempfile
+from pathlib import Path
 
 logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
 SUBDIRECTORY = 'cloned_repos'
+INDEX_SUBDIRECTORY = os.path.join(SUBDIRECTORY, '.index')
+CALIBRATION_PATH = os.path.join(SUBDIRECTORY, '.calibration.db')
+# Token counts by content hash, shared by every repo, fork and revision
+TOKEN_CACHE_PATH = os.path.join(SUBDIRECTORY, '.token_cache.db')
+# Open repos per session, scan leases and part plans, shared by every worker process
+STATE_PATH = os.environ.get('STATE_PATH', os.path.join(SUBDIRECTORY, '.state.db'))
+# The latest scans, also shared, kept apart so that writing one never holds up the state
+SCANS_PATH = os.environ.get('SCANS_PATH', os.path.join(SUBDIRECTORY, '.scans.db'))
+# Bare mirrors of cloned remotes. Working copies borrow objects from them,
+# so they are kept when a repo is deleted and make the next clone a fetch.
+MIRROR_SUBDIRECTORY = os.path.join(SUBDIRECTORY, '.mirrors')
+# Uploaded archives, kept as uploaded and read without extracting them
+ARCHIVE_SUBDIRECTORY = os.path.join(SUBDIRECTORY, '.archives')
+# Largest accepted upload, and the most its members may add up to once decompressed
+MAX_ARCHIVE_BYTES = int(os.environ.get('MAX_ARCHIVE_BYTES', 1 << 30))
+MAX_ARCHIVE_MEMBER_BYTES = int(os.environ.get('MAX_ARCHIVE_MEMBER_BYTES', 4 << 30))
+# Room for the multipart headers and the other form fields around an upload
+UPLOAD_FORM_OVERHEAD = 64 << 10
+
+COMBINE_CACHE_DIRECTORY = os.path.join(SUBDIRECTORY, '.combine_cache')
+COMBINE_CACHE_BYTES = int(os.environ.get('COMBINE_CACHE_BYTES', 256 << 20))
+MAX_CLONE_JOBS = 50
+# Scans kept in memory per worker; older ones are loaded from the shared store again when needed
+MAX_KEPT_SCANS = int(os.environ.get('MAX_KEPT_SCANS', 8))
+
+background_executor = ThreadPoolExecutor(max_workers=2)
+# Blocking work never runs on the event loop. Page-load scans and file
+# I/O (clone, delete, combine) get separate bounded pools so that a slow
+# clone cannot hold up scans of other repos, and exact scans stay on
+# background_executor.
+scan_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('SCAN_THREADS', 2)), thread_name_prefix='scan')
+io_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('IO_THREADS', 8)), thread_name_prefix='io')
+clone_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('CLONE_THREADS', 2)), thread_name_prefix='clone')
+exact_scans_lock = threading.Lock()
+combine_cache = CombineCache(COMBINE_CACHE_DIRECTORY, COMBINE_CACHE_BYTES)
 
 @dataclass
 class Repo:
     name: str
     path: str
+    encoding: str = DEFAULT_ENCODING
+    url: Optional[str] = None
+    mirror: Optional[str] = None
+    # Set for repos read from the object database: path is then the bare
+    # mirror and files come from this revision's tree, with no checkout
+    revision: Optional[str] = None
+    # Set for uploaded archives: path is then the archive file
+    archive: bool = False
 
     def to_dict(self):
         return asdict(self)
@@ -36,8 +99,27 @@ class Repo:
     
     def __str__(self):
         return self.path + '/' + self.name
+
+    @property
+    def index_path(self):
+        # Checkouts are named apart per URL, so forks that share a name get indexes of their own
+        return os.path.join(INDEX_SUBDIRECTORY, f"{os.path.basename(self.path)}.db")
     
+def open_state():
+    """
+    Open the databases shared by every worker when the app starts, not on
+    import, so importing the app creates no files. State that is already
+    open, as in tests, is kept.
+    """
+    if getattr(app.state, 'repos', None) is None:
+        app.state.repos = RepoRegistry(STATE_PATH, Repo)
+    if getattr(app.state, 'shared_scans', None) is None:
+        app.state.shared_scans = SharedScans(STATE_PATH, SCANS_PATH)
+    if getattr(app.state, 'part_plans', None) is None:
+        app.state.part_plans = PartPlans(STATE_PATH)
+
 app, rt = fast_app(
+    on_startup=[open_state],
     hdrs=(
         picolink,
         Style(':root { --pico-font-size: 100%; }'),
@@ -66,85 +148,538 @@ app, rt = fast_app(
                     });
                 }
             });
+
+            function setAllSelected(checked) {
+                document.querySelectorAll('#directory-structure input[type="checkbox"]').forEach(function(checkbox) {
+                    checkbox.checked = checked;
+                });
+            }
+
+            // Encode the tree as the nodes whose state differs from their parent's
+            function selectionDelta() {
+                var tokens = [];
+                function walk(li, parentChecked) {
+                    var checkbox = li.querySelector(':scope > input[type="checkbox"]');
+                    if (!checkbox) return;
+                    if (checkbox.checked !== parentChecked) {
+                        tokens.push((checkbox.checked ? '' : '-') + checkbox.dataset.id);
+                    }
+                    li.querySelectorAll(':scope > ul > li').forEach(function(child) {
+                        walk(child, checkbox.checked);
+                    });
+                }
+                document.querySelectorAll('#directory-structure > li').forEach(function(li) {
+                    walk(li, false);
+                });
+                return tokens.join(' ');
+            }
+
+            document.addEventListener('htmx:configRequest', function(e) {
+                if (e.detail.path === '/totals') {
+                    e.detail.parameters['selection'] = selectionDelta();
+                }
+            });
         """)
     )
 )
 
-app.state.current_repo = None
+app.state.exact_scans = {}
+app.state.scans = SingleFlight(max_results=MAX_KEPT_SCANS)
+app.state.clone_jobs = OrderedDict()
+app.state.readers = {}
+readers_lock = threading.Lock()
 
-def get_current_repo(request: Request) -> Optional[Repo]:
-    repo = request.app.state.current_repo
+async def run_blocking(executor, func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(func, *args, **kwargs))
+
+def session_id(request: Request) -> str:
+    sid = request.session.get('sid')
+    if sid is None:
+        sid = request.session['sid'] = uuid.uuid4().hex
+    return sid
+
+async def get_repo_entry(request: Request, repo_id: Optional[str] = None) -> Optional[RepoEntry]:
+    """The session's entry for repo_id, or the repo it used last."""
+    return await run_blocking(io_executor, request.app.state.repos.get, session_id(request), repo_id or None)
+
+async def get_current_repo(request: Request, repo_id: Optional[str] = None) -> Optional[Repo]:
+    entry = await get_repo_entry(request, repo_id)
+    repo = entry.repo if entry is not None else None
     logging.debug(f"Current repo: {repo}")
     return repo
 
-def render_directory_structure(structure, checked=True):
+def load_scan(repo: Repo, encoding: str, rescan: bool = True):
+    """
+    Scan using the repo's index, estimating token counts for files it does
+    not cover yet and computing their exact counts in the background.
+    Revisions are scanned exactly, since blobs counted before are cached.
+    Scans of one repo run one at a time, under the repo's lock.
+
+    Worker processes share scans: unless rescan is set, the scan another
+    worker stored is used as is, and while one worker scans the repo the
+    others wait for its result. Returns (version, scan).
+    """
+    with app.state.repos.repo_lock(repo_id(repo.path, repo.revision)):
+        return app.state.shared_scans.scan_once(scan_key(repo, encoding), repo.path,
+                                                partial(scan_locked, repo, encoding), fresh=rescan)
+
+def scan_locked(repo: Repo, encoding: str):
+    if repo.revision:
+        return scan_tree(repo.path, repo.revision, encoding=encoding, cache_path=TOKEN_CACHE_PATH,
+                         cat_file=reader_for(repo))
+    if repo.archive:
+        return scan_archive(repo.path, encoding=encoding, cache_path=TOKEN_CACHE_PATH,
+                            max_member_bytes=MAX_ARCHIVE_MEMBER_BYTES)
+    scan = scan_repo(repo.path, index_path=repo.index_path, encoding=encoding,
+                     mode='estimate', calibration_path=CALIBRATION_PATH)
+    if scan.file_data.has_estimates():
+        start_exact_scan(repo, encoding)
+    return scan
+
+def scan_key(repo: Repo, encoding: str):
+    return (repo.path, repo.revision, encoding)
+
+async def get_scan(repo: Repo, encoding: str, rescan: bool = False):
+    """
+    Return the scan the page was rendered from, so that the ids posted by
+    the page refer to the same files. Only a page load rescans the repo
+    (rescan=True). Concurrent requests for the same scan, whether page
+    loads or posts, share one run of load_scan.
+    """
+    key = scan_key(repo, encoding)
+    kept = app.state.scans.get(key)
+    if not rescan and kept is not None and kept[0] != await run_blocking(io_executor, app.state.shared_scans.version,
+                                                                          key):
+        # Another worker has rescanned the repo, and its page refers to that scan
+        app.state.scans.forget(key.__eq__)
+    future = app.state.scans.submit(key, scan_executor, load_scan, repo, encoding, rescan, fresh=rescan)
+    _, scan = await asyncio.wrap_future(future)
+    return scan
+
+def reader_for(repo: Repo):
+    """
+    The long-lived reader of a revision's blobs (a cat-file process) or of
+    an archive's members, opened on first use.
+    """
+    with readers_lock:
+        reader = app.state.readers.get(repo.path)
+        if reader is None:
+            reader = CatFile(repo.path) if repo.revision else ArchiveReader(repo.path)
+            app.state.readers[repo.path] = reader
+        return reader
+
+def close_reader(repo: Repo):
+    with readers_lock:
+        reader = app.state.readers.pop(repo.path, None)
+    if reader is not None:
+        reader.close()
+
+async def file_source(repo: Repo):
+    """
+    Where exports read the repo's files from: None for the working tree,
+    or the blobs of the scanned revision or archive.
+    """
+    if not repo.revision and not repo.archive:
+        return None
+    scan = await get_scan(repo, repo.encoding)
+    if repo.archive:
+        return ArchiveSource(reader_for(repo), scan.member_prefix, scan.blobs)
+    return TreeSource(reader_for(repo), scan.blobs)
+
+def source_stamps(source):
+    return source.blobs if source is not None else None
+
+def forget_scans(repo: Repo):
+    app.state.scans.forget(lambda key: key[0] == repo.path)
+    app.state.shared_scans.forget(repo.path)
+
+def start_exact_scan(repo: Repo, encoding: str):
+    key = (repo.path, encoding)
+    with exact_scans_lock:
+        scan = app.state.exact_scans.get(key)
+        if scan is not None and not scan.done():
+            return
+        lease = app.state.shared_scans.acquire(('exact', *key))
+        if lease is None:
+            return  # another worker is counting the repo
+        scan = background_executor.submit(
+            scan_repo, repo.path, index_path=repo.index_path, encoding=encoding,
+            calibration_path=CALIBRATION_PATH, cache_path=TOKEN_CACHE_PATH)
+        app.state.exact_scans[key] = scan
+    scan.add_done_callback(lambda scan: lease.release())
+    scan.add_done_callback(log_scan_failure)
+
+def log_scan_failure(scan):
+    if scan.exception():
+        logging.error(f"Background scan failed: {scan.exception()}")
+
+def exact_scan_pending(repo: Repo, encoding: str) -> bool:
+    scan = app.state.exact_scans.get((repo.path, encoding))
+    if scan is not None and not scan.done():
+        return True
+    return app.state.shared_scans.held(('exact', repo.path, encoding))
+
+def render_directory_structure(file_data, structure, checked=True, mask=None):
+    """
+    With a selection mask, each checkbox is checked as the mask says: a
+    file when it is selected, a directory when all of its files are.
+    """
     if structure['type'] == 'file':
         if structure.get('skipped', False):
             return Li(
                 f"{structure['name']} (Binary or unreadable file - skipped)",
                 style="color: gray; font-style: italic;"
             )
+        if mask is not None:
+            checked = bool(mask[structure['id']])
         return Li(
-            Checkbox(name="selected_files", value=structure['path'], checked=checked),
+            Checkbox(name="selected_files", value=structure['path'], checked=checked, data_id=f"f{structure['id']}"),
             f" {structure['name']} ({structure['size']} bytes, {structure['tokens']} tokens)"
         )
     else:
-        children = [render_directory_structure(child, checked) for child in structure['children']]
+        if mask is not None and structure['first_id'] is not None:
+            checked = mask.find(0, structure['first_id'], structure['end_id']) == -1
+        children = [render_directory_structure(file_data, child, checked, mask)
+                    for child in directory_children(file_data, structure)]
         return Li(
-            Checkbox(name="selected_files", value=structure['path'], checked=checked, cls="directory-checkbox"),
+            Checkbox(name="selected_files", value=structure['path'], checked=checked, cls="directory-checkbox",
+                     data_id=f"d{structure['id']}"),
             Button("+", cls="toggle", type="button"),
             structure['name'],
             Ul(*children, style="display: none;")
         )
     
 @rt("/")
-async def get(request: Request):
-    current_repo = get_current_repo(request)
+async def get(request: Request, encoding: str = None, repo_id: str = None):
+    current_repo = await get_current_repo(request, repo_id)
     if current_repo:
-        return render_repo_content(current_repo)
+        job = clone_job_for(current_repo)
+        if job is not None and job.status != 'done':
+            return Titled(f"Repository: {current_repo.name}", render_clone_job(job))
+        if job is None and await run_blocking(io_executor, clone_in_progress, current_repo):
+            return Titled(f"Repository: {current_repo.name}", render_remote_clone(current_repo))
+        encoding = resolve_encoding(encoding, current_repo.encoding)
+        # Revisions and uploaded archives do not change on disk, so only working trees are rescanned
+        scan = await get_scan(current_repo, encoding, rescan=not (current_repo.revision or current_repo.archive))
+        return await run_blocking(scan_executor, render_repo_content, current_repo, scan, encoding,
+                                  await get_repo_entry(request, repo_id), await open_repos(request))
     else:
-        return render_clone_form()
+        return render_clone_form(repos=await open_repos(request))
+
+@rt("/clone")
+async def get(request: Request):
+    return render_clone_form(repos=await open_repos(request))
+
+async def open_repos(request: Request):
+    return await run_blocking(io_executor, request.app.state.repos.entries, session_id(request))
+
+async def open_repo(request: Request, repo: Repo):
+    """Open repo in the session and send the browser to its page."""
+    entry = await run_blocking(io_executor, request.app.state.repos.open, session_id(request), repo)
+    return RedirectResponse(f'/?repo_id={entry.id}', status_code=303)
 
 @rt("/clone")
-async def post(request: Request, url: str):
+async def post(request: Request, url: str, encoding: str = DEFAULT_ENCODING, depth: str = '',
+               blob_limit: str = '', sparse_paths: str = '', revision: str = '', no_checkout: bool = False):
+    try:
+        options = CloneOptions(
+            depth=int(depth) if depth.strip() else None,
+            blob_limit=blob_limit.strip() or None,
+            sparse_paths=tuple(line.strip() for line in sparse_paths.splitlines() if line.strip()),
+            revision=revision.strip() or None)
+    except ValueError as e:
+        return render_clone_form(error=str(e))
     repo_name = url.split('/')[-1].replace('.git', '')
-    repo_path = os.path.join(SUBDIRECTORY, repo_name)
-    if not os.path.exists(repo_path):
-        clone_cmd = f'git clone {url} {repo_path}'
-        subprocess.run(clone_cmd, shell=True)
-    request.app.state.current_repo = Repo(name=repo_name, path=repo_path)
-    return RedirectResponse('/', status_code=303)
+    repo_path = checkout_path(SUBDIRECTORY, url, repo_name)
+    if no_checkout:
+        mirror = os.path.abspath(mirror_path(MIRROR_SUBDIRECTORY, url, options.blob_limit, options.depth))
+        revision = options.revision or 'HEAD'
+        repo = Repo(name=f"{repo_name}@{revision}", path=mirror, encoding=resolve_encoding(encoding),
+                    url=url, mirror=mirror, revision=revision)
+    else:
+        mirror = (os.path.abspath(mirror_path(MIRROR_SUBDIRECTORY, url, options.blob_limit))
+                  if options.uses_mirror else None)
+        repo = Repo(name=repo_name, path=repo_path, encoding=resolve_encoding(encoding), url=url, mirror=mirror)
+    await run_blocking(io_executor, forget_scans, repo)
+    start_clone_job(url, repo, options)
+    return await open_repo(request, repo)
+
+def start_clone_job(url, repo: Repo, options: Optional[CloneOptions] = None):
+    job = CloneJob(url=url, repo_path=repo.path, revision=repo.revision)
+    app.state.clone_jobs[job.id] = job
+    while len(app.state.clone_jobs) > MAX_CLONE_JOBS:
+        app.state.clone_jobs.popitem(last=False)
+    clone_executor.submit(run_clone_job, job, repo, options)
+    return job
+
+def run_clone_job(job: CloneJob, repo: Repo, options: Optional[CloneOptions] = None):
+    """
+    Clone the repo, or fetch into it if it is already on disk, then build
+    its index with an exact scan so the repo view opens without estimates.
+    The scan index reuses counts for unchanged files, so after a fetch only
+    the files it touched are tokenized again. The job holds the repo's
+    lock, and its clone lease across workers, so no page scans the repo
+    while its files are changing.
+    """
+    with app.state.repos.repo_lock(repo_id(repo.path, repo.revision)), app.state.shared_scans.hold(('clone', repo.path)):
+        clone_locked(job, repo, options)
+
+def clone_locked(job: CloneJob, repo: Repo, options: Optional[CloneOptions] = None):
+    try:
+        if repo.archive:
+            index_archive(job, repo)
+            return
+        if repo.revision:
+            read_revision(job, repo, options)
+            return
+        if not os.path.exists(repo.path):
+            job.status = 'cloning'
+            returncode = git_clone(job.url, repo.path, job.on_git_progress, options, mirror=repo.mirror)
+            if returncode != 0:
+                job.fail(f"git clone exited with status {returncode}: {job.progress}")
+                return
+        elif job.url:
+            job.status = 'fetching'
+            returncode = refresh_checkout(repo.path, job.on_git_progress, url=job.url, mirror=repo.mirror,
+                                          blob_limit=options.blob_limit if options else None)
+            if returncode != 0:
+                job.fail(f"git fetch exited with status {returncode}: {job.progress}")
+                return
+        job.status = 'indexing'
+        scan_repo(repo.path, index_path=repo.index_path, encoding=repo.encoding,
+                  calibration_path=CALIBRATION_PATH, progress=job.on_scan_progress, cache_path=TOKEN_CACHE_PATH)
+        job.status = 'done'
+    except Exception as e:
+        logging.error(f"Clone job {job.id} failed: {e}")
+        job.fail(str(e))
 
-def calculate_totals(file_data, selected_files, excluded_file_types):
-    total_files = 0
-    total_bytes = 0
-    total_tokens = 0
+def read_revision(job: CloneJob, repo: Repo, options: Optional[CloneOptions] = None):
+    """
+    Fetch the repo's mirror and count the revision's blobs, without
+    checking anything out.
+    """
+    job.status = 'fetching' if os.path.exists(repo.path) else 'cloning'
+    returncode = update_mirror(job.url, repo.path, job.on_git_progress, options.blob_limit if options else None,
+                               options.depth if options else None)
+    if returncode != 0:
+        job.fail(f"git fetch exited with status {returncode}: {job.progress}")
+        return
+    if resolve_revision(repo.path, repo.revision) is None:
+        job.fail(f"Unknown revision: {repo.revision}")
+        return
+    job.status = 'indexing'
+    scan_tree(repo.path, repo.revision, encoding=repo.encoding, cache_path=TOKEN_CACHE_PATH,
+              progress=job.on_scan_progress, cat_file=reader_for(repo))
+    job.status = 'done'
+
+def index_archive(job: CloneJob, repo: Repo):
+    """Count an uploaded archive's files in one pass and keep the scan for the page."""
+    job.status = 'indexing'
+    scan = scan_archive(repo.path, encoding=repo.encoding, cache_path=TOKEN_CACHE_PATH,
+                        progress=job.on_scan_progress, max_member_bytes=MAX_ARCHIVE_MEMBER_BYTES)
+    key = scan_key(repo, repo.encoding)
+    app.state.scans.set(key, (app.state.shared_scans.store(key, repo.path, scan), scan))
+    job.status = 'done'
+
+def clone_in_progress(repo: Repo) -> bool:
+    """Whether some worker, maybe another process, is cloning or indexing the repo."""
+    return app.state.shared_scans.held(('clone', repo.path))
+
+def render_remote_clone(repo: Repo):
+    return P("Another worker is cloning and indexing this repository...",
+             id="clone-job", style="font-style: italic;",
+             hx_get=f"/clone-status?repo_id={repo_id(repo.path, repo.revision)}", hx_trigger="every 1s", hx_swap="outerHTML")
+
+@rt("/clone-status")
+async def get(request: Request, repo_id: str = None):
+    current_repo = await get_current_repo(request, repo_id)
+    if current_repo and await run_blocking(io_executor, clone_in_progress, current_repo):
+        return render_remote_clone(current_repo)
+    return Response('', headers={'HX-Refresh': 'true'})
+
+def clone_job_for(repo: Repo) -> Optional[CloneJob]:
+    for job in reversed(app.state.clone_jobs.values()):
+        if job.repo_path == repo.path and job.revision == repo.revision:
+            return job
+    return None
+
+@rt("/upload")
+async def post(request: Request):
+    # The form parser spools the whole body, so refuse an oversized upload before reading it
+    if int(request.headers.get('content-length') or 0) > MAX_ARCHIVE_BYTES + UPLOAD_FORM_OVERHEAD:
+        return render_clone_form(error=f"Archives larger than {MAX_ARCHIVE_BYTES} bytes are not accepted")
+    form_data = await request.form()
+    upload = form_data.get('archive')
+    if not isinstance(upload, UploadFile) or not upload.filename:
+        return render_clone_form(error="Choose an archive to upload")
+    suffix = archive_suffix(upload.filename)
+    if suffix is None:
+        return render_clone_form(error=f"Unsupported archive type: {upload.filename}")
+    file_name = os.path.basename(upload.filename)
+    try:
+        path = await run_blocking(io_executor, save_upload, upload.file, ARCHIVE_SUBDIRECTORY, suffix,
+                                  MAX_ARCHIVE_BYTES)
+    except ArchiveTooLarge as e:
+        return render_clone_form(error=str(e))
+    repo = Repo(name=file_name[:-len(suffix)], path=path,
+                encoding=resolve_encoding(form_data.get('encoding')), archive=True)
+    start_clone_job(None, repo)
+    return await open_repo(request, repo)
 
-    exclude_no_extension = "(no extension)" in excluded_file_types
-    excluded_file_types = [ext for ext in excluded_file_types if ext != "(no extension)"]
+def save_upload(source, directory, suffix, max_bytes=None):
+    """
+    Store an uploaded file under a hash of its content and return its path.
+    Uploads with the same content share one file, and the client's file
+    name never reaches the filesystem, so uploads cannot overwrite each
+    other or any other file. Raises ArchiveTooLarge, keeping nothing, if
+    the file is larger than max_bytes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(suffix='.part', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: source.read(1 << 20), b''):
+                digest.update(chunk)
+                f.write(chunk)
+                if max_bytes is not None and f.tell() > max_bytes:
+                    raise ArchiveTooLarge(f"Archives larger than {max_bytes} bytes are not accepted")
+        path = os.path.join(directory, digest.hexdigest()[:32] + suffix)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path
 
+@rt("/clone-jobs/{job_id}")
+async def get(job_id: str):
+    job = app.state.clone_jobs.get(job_id)
+    if job is None:
+        return Response("Unknown clone job", status_code=404)
+    if job.status == 'done':
+        return Response('', headers={'HX-Refresh': 'true'})
+    return render_clone_job(job)
+
+def render_clone_job(job: CloneJob):
+    if job.status == 'failed':
+        return Div(
+            P(f"Clone failed: {job.error}", style="color: red;"),
+            Pre('\n'.join(job.log)) if job.log else "",
+            Form(Hidden(name="repo_id", value=repo_id(job.repo_path, job.revision)), Button("Delete Repository"),
+                 action="/delete", method="post"),
+            id="clone-job"
+        )
+    if job.status == 'indexing':
+        message = f"Indexing: {job.files_scanned} of {job.files_total} files, {job.tokens_counted} tokens counted"
+    elif job.status == 'cloning':
+        message = f"Cloning: {job.progress or 'starting...'}"
+    elif job.status == 'fetching':
+        message = f"Fetching: {job.progress or 'starting...'}"
+    else:
+        message = "Waiting to start..."
+    return Div(
+        P(message, style="font-style: italic;"),
+        id="clone-job",
+        hx_get=f"/clone-jobs/{job.id}",
+        hx_trigger="every 1s",
+        hx_swap="outerHTML"
+    )
+
+def selection_mask(scan, selected_files):
+    """
+    Turn selected paths into a bytearray over the scan's file ids. A
+    directory sets its whole id range, so overlapping selections of a
+    directory and its children are naturally counted once.
+    """
+    table = scan.file_data
+    directories = scan.directory_index
+    mask = bytearray(len(table))
     for file_path in selected_files:
-        if os.path.isdir(file_path):
-            # If it's a directory, include all files under it
-            for root, _, files in os.walk(file_path):
-                for file in files:
-                    full_path = os.path.join(root, file)
-                    if full_path in file_data:
-                        _, ext = os.path.splitext(full_path)
-                        if (ext or not exclude_no_extension) and not any(full_path.endswith(excluded_ext) for excluded_ext in excluded_file_types):
-                            info = file_data[full_path]
-                            total_files += info['count']
-                            total_bytes += info['size']
-                            total_tokens += info['tokens']
-        elif file_path in file_data:
-            _, ext = os.path.splitext(file_path)
-            if (ext or not exclude_no_extension) and not any(file_path.endswith(excluded_ext) for excluded_ext in excluded_file_types):
-                info = file_data[file_path]
-                total_files += info['count']
-                total_bytes += info['size']
-                total_tokens += info['tokens']
-
-    return total_files, total_bytes, total_tokens
+        node = directories.get(file_path)
+        if node is not None:
+            select_directory(mask, node, 1)
+        else:
+            file_id = table.ids.get(file_path)
+            if file_id is not None:
+                mask[file_id] = 1
+    return mask
+
+def select_directory(mask, node, value):
+    if node['first_id'] is not None:
+        mask[node['first_id']:node['end_id']] = bytes([value]) * (node['end_id'] - node['first_id'])
+
+def decode_selection(scan, selection):
+    """
+    Turn a selection delta into a bytearray over the scan's file ids. The
+    delta lists, in tree order, only the nodes whose checkbox differs from
+    their parent's: 'd<id>' for a directory and 'f<id>' for a file, with a
+    '-' prefix when unchecked. Replaying it from an empty mask rebuilds the
+    selection, so its size depends on what was toggled, not on the repo.
+    """
+    table = scan.file_data
+    directories = scan.directory_nodes
+    mask = bytearray(len(table))
+    for token in selection.split():
+        value = 0 if token.startswith('-') else 1
+        kind, node_id = token.lstrip('-')[:1], token.lstrip('-')[1:]
+        if not node_id.isdigit():
+            continue
+        node_id = int(node_id)
+        if kind == 'd' and node_id < len(directories):
+            select_directory(mask, directories[node_id], value)
+        elif kind == 'f' and node_id < len(table):
+            mask[node_id] = value
+    return mask
+
+async def remember_selection(request: Request, repo: Repo, selection, excluded_file_types):
+    """Keep a repo page's selection in its session entry, so reopening the page restores it."""
+    await run_blocking(io_executor, request.app.state.repos.remember, session_id(request),
+                       repo_id(repo.path, repo.revision), selection, excluded_file_types)
+
+def selection_paths(scan, selection):
+    """
+    A selection delta with each node id replaced by its path, so a kept
+    selection still means the same files after the repo is rescanned.
+    """
+    tokens = []
+    for token in selection.split():
+        sign = '-' if token.startswith('-') else ''
+        kind, node_id = token[len(sign):][:1], token[len(sign):][1:]
+        if not node_id.isdigit():
+            continue
+        node_id = int(node_id)
+        if kind == 'd' and node_id < len(scan.directory_nodes):
+            tokens.append(f"{sign}d{scan.directory_nodes[node_id]['path']}")
+        elif kind == 'f' and node_id < len(scan.file_data):
+            tokens.append(f"{sign}f{scan.file_data.paths[node_id]}")
+    return tokens
+
+def selection_ids(scan, tokens):
+    """The selection delta for selection_paths tokens in this scan, leaving out paths that are gone."""
+    delta = []
+    for token in tokens:
+        sign = '-' if token.startswith('-') else ''
+        kind, path = token[len(sign):][:1], token[len(sign):][1:]
+        if kind == 'd' and path in scan.directory_index:
+            delta.append(f"{sign}d{scan.directory_index[path]['id']}")
+        elif kind == 'f' and path in scan.file_data.ids:
+            delta.append(f"{sign}f{scan.file_data.ids[path]}")
+    return ' '.join(delta)
+
+def render_totals(total_files, total_bytes, total_tokens):
+    return f"Total: {total_files} files, {total_bytes} bytes, {total_tokens} tokens"
+
+def calculate_totals(scan, selected_files, excluded_file_types):
+    """
+    Sum the selection as masked sums over the scan's FileTable columns,
+    without touching the filesystem.
+    """
+    mask = selection_mask(scan, selected_files)
+    return scan.file_data.totals(mask, set(excluded_file_types))
 
 @rt("/update-totals")
 async def post(request: Request):
@@ -153,117 +688,466 @@ async def post(request: Request):
     excluded_file_types = form_data.getlist('file_types')
     selected_files = form_data.getlist('selected_files')
     
-    current_repo = get_current_repo(request)
+    current_repo = await get_current_repo(request, form_data.get('repo_id'))
     if not current_repo:
         return {"error": "No repository selected"}, 400
     
     logging.debug(f"update_totals called with excluded_file_types: {excluded_file_types}, selected_files: {selected_files}")
     
-    # Ensure all selected_files are relative to the repo path
-    selected_files = [os.path.relpath(path, current_repo.path) for path in selected_files]
-    
-    _, file_data, _ = get_file_types(current_repo.path)
-    total_files, total_bytes, total_tokens = calculate_totals(file_data, selected_files, excluded_file_types)
+    encoding = resolve_encoding(form_data.get('encoding'), current_repo.encoding)
+    scan = await get_scan(current_repo, encoding)
+    total_files, total_bytes, total_tokens = calculate_totals(scan, selected_files, excluded_file_types)
 
-    result = f"Total: {total_files} files, {total_bytes} bytes, {total_tokens} tokens"
+    result = render_totals(total_files, total_bytes, total_tokens)
     logging.debug(f"Final result: {result}")
     return result
 
+@rt("/totals")
+async def post(request: Request):
+    form_data = await request.form()
+    current_repo = await get_current_repo(request, form_data.get('repo_id'))
+    if not current_repo:
+        return {"error": "No repository selected"}, 400
+    encoding = resolve_encoding(form_data.get('encoding'), current_repo.encoding)
+    scan = await get_scan(current_repo, encoding)
+    mask = decode_selection(scan, form_data.get('selection', ''))
+    await remember_selection(request, current_repo, selection_paths(scan, form_data.get('selection', '')),
+                             form_data.getlist('file_types'))
+    return render_totals(*scan.file_data.totals(mask, set(form_data.getlist('file_types'))))
+
+def iter_combined(repo_path, selected_files, file_types, source=None):
+    """
+    Yield the combined output piece by piece, reading one file at a time so
+    that only the current file's contents are held in memory.
+    """
+    return render_text(iter_files(repo_path, selected_files, file_types, source))
+
+def combined_text(repo_path, selected_files, file_types, source=None):
+    """
+    Return (key, text) for the combined output, reading the selected files
+    only when the combine cache has no entry for them.
+    """
+    key = selection_key(repo_path, selected_files, file_types, 'text', 'none', stamps=source_stamps(source))
+    cached = combine_cache.get(key)
+    if cached is not None:
+        return key, Path(cached).read_bytes().decode('utf-8')
+    chunks = compress_stream(iter_combined(repo_path, selected_files, file_types, source), 'none')
+    return key, b''.join(combine_cache.store(key, chunks)).decode('utf-8')
+
+def parse_token_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+def combine_candidates(scan, selected_files, file_types, encoding):
+    """
+    Selected files with their cached token counts plus the tokens of their
+    section header, in selection order. Only the headers, and files the
+    scan has only estimated so far, are tokenized: a budget packed against
+    estimates could overflow.
+    """
+    table = scan.file_data
+    paths = [path for path in selected_files if path in table and not is_excluded(path, file_types)]
+    headers = get_tokenizer(encoding).count_batch([f">>> FILE: {path} <<<\n\n\n" for path in paths])
+    tokens = {path: table.tokens[table.ids[path]] for path in paths}
+    estimated = [path for path in paths if table.estimated[table.ids[path]]]
+    if estimated:
+        counts = scan_files([os.path.join(scan.repo_path, path) for path in estimated], encoding,
+                            cache_path=TOKEN_CACHE_PATH)
+        tokens.update((path, count or 0) for path, count in zip(estimated, counts, strict=True))
+    return [(path, tokens[path] + header) for path, header in zip(paths, headers, strict=True)]
+
+def file_mtimes(repo_path, paths):
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.stat(os.path.join(repo_path, path)).st_mtime_ns
+        except OSError:
+            pass
+    return mtimes
+
+def render_pack_report(kept, dropped, max_tokens, policy):
+    used = sum(tokens for _, tokens in kept)
+    return Div(
+        P(f"Packed {len(kept)} files, {used} of {max_tokens} tokens ({policy})", id="pack-summary"),
+        Details(
+            Summary(f"Dropped {len(dropped)} files"),
+            Ul(*[Li(f"{path} ({tokens} tokens)") for path, tokens in dropped]),
+            id="dropped-files"
+        ) if dropped else ""
+    )
+
 @rt("/combine")
 async def post(request: Request):
     form_data = await request.form()
     file_types = form_data.getlist('file_types')
     selected_files = form_data.getlist('selected_files')
     
-    current_repo = get_current_repo(request)
+    current_repo = await get_current_repo(request, form_data.get('repo_id'))
     if not current_repo:
         return {"error": "No repository selected"}, 400
-    combined_code = ""
 
-    for file_path in selected_files:
-        full_path = os.path.join(current_repo.path, file_path)
-        if os.path.exists(full_path) and not any(file_path.endswith(ext) for ext in file_types):
-            with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
-                combined_code += f">>> FILE: {file_path} <<<\n{f.read()}\n\n"
+    max_tokens = parse_token_limit(form_data.get('max_tokens'))
+    part_tokens = parse_token_limit(form_data.get('part_tokens'))
+    source = await file_source(current_repo)
+    if max_tokens is None and part_tokens is None:
+        _, text = await run_blocking(io_executor, combined_text, current_repo.path, selected_files, file_types, source)
+        return Pre(text)
+
+    encoding = resolve_encoding(form_data.get('encoding'), current_repo.encoding)
+    scan = await get_scan(current_repo, encoding)
+    candidates = await run_blocking(io_executor, combine_candidates, scan, selected_files, file_types, encoding)
+    report = ""
+    if max_tokens is not None:
+        policy = form_data.get('policy') if form_data.get('policy') in POLICIES else 'smallest'
+        mtimes = None
+        if policy == 'recent' and source is None:
+            mtimes = await run_blocking(io_executor, file_mtimes, current_repo.path, [path for path, _ in candidates])
+        candidates, dropped = pack(
+            candidates, max_tokens, policy,
+            weights=parse_weights(form_data.get('weights')),
+            order=[line.strip() for line in (form_data.get('order') or '').splitlines()],
+            mtimes=mtimes)
+        logging.debug(f"Packed {len(candidates)} files into {max_tokens} tokens, dropped {len(dropped)}")
+        report = render_pack_report(candidates, dropped, max_tokens, policy)
+
+    if part_tokens is not None:
+        parts = plan_parts(candidates, part_tokens)
+        plan_id = await run_blocking(io_executor, save_part_plan, current_repo, encoding, parts)
+        return Div(report, render_part_plan(plan_id, parts, part_tokens,
+                                            form_data.get('format', 'text'), form_data.get('compression', 'none')))
+    _, text = await run_blocking(io_executor, combined_text, current_repo.path, [path for path, _ in candidates], file_types,
+                                 source)
+    return Div(report, Pre(text))
+
+def save_part_plan(repo: Repo, encoding: str, parts):
+    """
+    Keep a plan so each part can be fetched on its own later, from any
+    worker. Plans are named by their content and only the most recent ones
+    are kept.
+    """
+    key = json.dumps([repo_id(repo.path, repo.revision), encoding, parts])
+    plan_id = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    app.state.part_plans.save(plan_id, {'repo': repo.to_json(), 'encoding': encoding, 'parts': parts})
+    return plan_id
+
+def render_part_plan(plan_id, parts, part_tokens, output_format, compression):
+    query = f"format={output_format}&compression={compression}"
+    return Div(
+        P(f"{len(parts)} parts of at most {part_tokens} tokens", id="part-summary"),
+        Ol(*[
+            Li(A("View", href=f"/parts/{plan_id}/{index}"), " | ",
+               A("Download", href=f"/parts/{plan_id}/{index}?{query}&download=1"),
+               f" {len(entries)} files, about {tokens} tokens")
+            for index, (entries, tokens) in enumerate(parts)
+        ], id="parts")
+    )
 
-    return Pre(combined_code)
+@rt("/parts/{plan_id}/{index}")
+async def get(request: Request, plan_id: str, index: int, format: str = 'text', compression: str = 'none',
+              download: bool = False):
+    plan = await run_blocking(io_executor, app.state.part_plans.load, plan_id)
+    if plan is None or not 0 <= index < len(plan['parts']):
+        return Response("Unknown part; combine again to plan new parts", status_code=404)
+    if format not in FORMATS or compression not in COMPRESSIONS:
+        return Response(f"Unsupported format or compression: {format}, {compression}", status_code=400)
+
+    repo = Repo.from_json(plan['repo'])
+    encoding = plan['encoding']
+    entries, _ = plan['parts'][index]
+    source = await file_source(repo)
+    key = await run_blocking(io_executor, selection_key, repo.path, [path for path, _, _ in entries], (),
+                             'part', plan_id, index, format, compression, stamps=source_stamps(source))
+
+    def render():
+        files = iter_part(repo.path, entries, get_tokenizer(encoding), source)
+        return FORMATS[format][0](files, lambda path, content: count_tokens(content, encoding))
+
+    filename = None
+    if download:
+        filename = f"{repo.name}.part{index + 1}of{len(plan['parts'])}"
+    return stream_export(request, key, render, format, compression, filename)
+
+def stream_export(request, key, render, output_format, compression, filename=None):
+    """
+    Stream an export, compressed as requested and optionally as an
+    attachment. A cached entry is served from disk; only a miss calls
+    render() and reads the repo. For GET requests the combine cache key
+    doubles as a strong ETag, so a matching If-None-Match gets a 304;
+    conditional POSTs are not answered with 304, so POST exports carry no
+    tag. The key covers each file's stat data (mtime, size, inode), or its
+    blob hash for revisions and archives, not a hash of what is read: a
+    working-tree file rewritten without changing any of those keeps its tag.
+    """
+    _, media_type, extension = FORMATS[output_format]
+    compressed_type, suffix = COMPRESSIONS[compression]
+    media_type = compressed_type or media_type
+    headers = {}
+    if request.method == 'GET':
+        headers['ETag'] = f'"{key}"'
+        if etag_matches(request.headers.get('if-none-match'), headers['ETag']):
+            return Response(status_code=304, headers=headers)
+    if filename:
+        headers['Content-Disposition'] = f'attachment; filename="{filename}.{extension}{suffix}"'
+    cached = combine_cache.get(key)
+    if cached is not None:
+        return FileResponse(cached, media_type=media_type, headers=headers)
+    return StreamingResponse(combine_cache.store(key, compress_stream(render(), compression)),
+                             media_type=media_type, headers=headers)
+
+@rt("/combine-stream")
+async def post(request: Request):
+    form_data = await request.form()
+    file_types = form_data.getlist('file_types')
+    selected_files = form_data.getlist('selected_files')
+
+    current_repo = await get_current_repo(request, form_data.get('repo_id'))
+    if not current_repo:
+        return {"error": "No repository selected"}, 400
+
+    # Starlette iterates sync generators in its threadpool, so file reads
+    # do not block the event loop
+    source = await file_source(current_repo)
+    key = await run_blocking(io_executor, selection_key, current_repo.path, selected_files, file_types, 'text', 'none',
+                             stamps=source_stamps(source))
+    return stream_export(request, key, lambda: iter_combined(current_repo.path, selected_files, file_types, source),
+                         'text', 'none')
+
+def scan_token_counter(scan, encoding):
+    """
+    Token counts from the scan, counting only files it does not cover or
+    only estimated, since records publish their counts as exact.
+    """
+    def count(file_path, content):
+        if file_path in scan.file_data:
+            info = scan.file_data[file_path]
+            if not info.get('estimated'):
+                return info['tokens']
+        return count_tokens(content, encoding)
+    return count
+
+@rt("/download")
+async def post(request: Request):
+    form_data = await request.form()
+    file_types = form_data.getlist('file_types')
+    selected_files = form_data.getlist('selected_files')
+    output_format = form_data.get('format', 'text')
+    compression = form_data.get('compression', 'none')
+
+    current_repo = await get_current_repo(request, form_data.get('repo_id'))
+    if not current_repo:
+        return {"error": "No repository selected"}, 400
+    if output_format not in FORMATS or compression not in COMPRESSIONS:
+        return Response(f"Unsupported format or compression: {output_format}, {compression}", status_code=400)
+
+    encoding = resolve_encoding(form_data.get('encoding'), current_repo.encoding)
+    scan = await get_scan(current_repo, encoding)
+    variant = [output_format, compression]
+    if output_format == 'jsonl':
+        # Records carry the scan's token counts, which change once estimates are replaced
+        variant += [encoding, scan.file_data.has_estimates()]
+    source = await file_source(current_repo)
+    key = await run_blocking(io_executor, selection_key, current_repo.path, selected_files, file_types, *variant,
+                             stamps=source_stamps(source))
+    return stream_export(
+        request, key,
+        lambda: FORMATS[output_format][0](iter_files(current_repo.path, selected_files, file_types, source),
+                                          scan_token_counter(scan, encoding)),
+        output_format, compression, current_repo.name)
 
 @rt("/select-all")
 async def post(request: Request):
-    current_repo = get_current_repo(request)
+    form_data = await request.form()
+    current_repo = await get_current_repo(request, form_data.get('repo_id'))
     if not current_repo:
         return {"error": "No repository selected"}, 400
-    _, file_data, skipped_files = get_file_types(current_repo.path)
-    structure = get_directory_structure(current_repo.path, file_data, skipped_files)
-    return render_directory_structure(structure)
+    encoding = resolve_encoding(form_data.get('encoding'), current_repo.encoding)
+    scan = await get_scan(current_repo, encoding)
+    await remember_selection(request, current_repo, selection_paths(scan, 'd0'), form_data.getlist('file_types'))
+    return render_totals(*calculate_totals(scan, ['.'], form_data.getlist('file_types')))
 
 @rt("/unselect-all")
 async def post(request: Request):
-    current_repo = get_current_repo(request)
+    form_data = await request.form()
+    current_repo = await get_current_repo(request, form_data.get('repo_id'))
+    if not current_repo:
+        return {"error": "No repository selected"}, 400
+    await remember_selection(request, current_repo, [], form_data.getlist('file_types'))
+    return render_totals(0, 0, 0)
+
+@rt("/refresh")
+async def post(request: Request):
+    form_data = await request.form()
+    current_repo = await get_current_repo(request, form_data.get('repo_id'))
     if not current_repo:
         return {"error": "No repository selected"}, 400
-    _, file_data, skipped_files = get_file_types(current_repo.path)
-    structure = get_directory_structure(current_repo.path, file_data, skipped_files)
-    return render_directory_structure(structure, checked=False)
+    await run_blocking(io_executor, forget_scans, current_repo)
+    start_clone_job(current_repo.url, current_repo)
+    return RedirectResponse(f'/?repo_id={repo_id(current_repo.path, current_repo.revision)}', status_code=303)
 
 @rt("/delete")
 async def post(request: Request):
-    current_repo = get_current_repo(request)
+    form_data = await request.form()
+    current_repo = await get_current_repo(request, form_data.get('repo_id'))
     if not current_repo:
         return {"error": "No repository selected"}, 400
-    if os.path.exists(current_repo.path):
-        subprocess.run(f'rm -rf {current_repo.path}', shell=True)
-    request.app.state.current_repo = None
+    await run_blocking(io_executor, remove_repo_files, current_repo)
+    await run_blocking(io_executor, close_reader, current_repo)
+    await run_blocking(io_executor, forget_scans, current_repo)
+    # The files are gone, so the repo is closed in every session
+    await run_blocking(io_executor, request.app.state.repos.remove, repo_id(current_repo.path, current_repo.revision))
     return RedirectResponse('/', status_code=303)
 
-def render_clone_form():
+def remove_repo_files(repo: Repo):
+    with app.state.repos.repo_lock(repo_id(repo.path, repo.revision)):
+        # A revision repo's path is its mirror, which other repos may borrow from
+        if repo.archive:
+            if os.path.isfile(repo.path):
+                os.remove(repo.path)
+        elif os.path.isdir(repo.path) and not repo.revision:
+            shutil.rmtree(repo.path)
+        try:
+            os.remove(repo.index_path)
+        except FileNotFoundError:
+            pass
+
+@rt("/scan-status")
+async def get(request: Request, encoding: str = None, repo_id: str = None):
+    current_repo = await get_current_repo(request, repo_id)
+    if current_repo:
+        encoding = resolve_encoding(encoding, current_repo.encoding)
+        if await run_blocking(io_executor, exact_scan_pending, current_repo, encoding):
+            return render_scan_status(encoding, repo_id)
+    return Response('', headers={'HX-Refresh': 'true'})
+
+def render_scan_status(encoding, repo_id=None):
+    query = f"encoding={encoding}" + (f"&repo_id={repo_id}" if repo_id else "")
+    return P(
+        "Token counts are estimates until indexing finishes...",
+        id="scan-status",
+        style="font-style: italic;",
+        hx_get=f"/scan-status?{query}",
+        hx_trigger="every 2s",
+        hx_swap="outerHTML"
+    )
+
+def render_clone_form(error=None, repos=()):
     return Titled("Clone Repository",
+        P(error, style="color: red;") if error else "",
+        Nav(Ul(*[Li(A(entry.repo.name, href=f"/?repo_id={entry.id}")) for entry in repos])) if repos else "",
         Form(
             Label("GitHub URL:", For="url"),
             Input(id='url', name='url', placeholder='https://github.com/user/repo.git'),
+            Label("Token encoding:", For="encoding"),
+            Select(*[Option(name, value=name, selected=name == DEFAULT_ENCODING) for name in ENCODINGS],
+                   id='encoding', name='encoding'),
+            Details(
+                Summary("Clone options"),
+                Label("Branch, tag or commit (default branch if empty):", For="revision"),
+                Input(id='revision', name='revision', placeholder='main'),
+                Label("History depth (empty for full history):", For="depth"),
+                Input(type='number', id='depth', name='depth', min='1', placeholder='e.g. 1'),
+                Label("Skip blobs larger than (e.g. 1m, fetched on demand):", For="blob_limit"),
+                Input(id='blob_limit', name='blob_limit', placeholder='1m'),
+                Label("Sparse checkout patterns (one per line, empty for everything):", For="sparse_paths"),
+                Textarea(id='sparse_paths', name='sparse_paths', rows=3, placeholder='src/\n*.md'),
+                Checkbox(id='no_checkout', name='no_checkout', value='1',
+                         label="Read the revision from git's object database (no checkout)"),
+            ),
             Button('Clone Repository'),
             action='/clone', method='post'
+        ),
+        Form(
+            Label(f"Or upload an archive ({', '.join(ARCHIVE_SUFFIXES)}):", For="archive"),
+            Input(type='file', id='archive', name='archive', accept=','.join(ARCHIVE_SUFFIXES)),
+            *([] if '.tar.zst' in ARCHIVE_SUFFIXES else [Small(".tar.zst uploads are unavailable: install the zstandard package to enable them.")]),
+            Label("Token encoding:", For="archive_encoding"),
+            Select(*[Option(name, value=name, selected=name == DEFAULT_ENCODING) for name in ENCODINGS],
+                   id='archive_encoding', name='encoding'),
+            Button('Upload Archive'),
+            action='/upload', method='post', enctype='multipart/form-data'
         )
     )
 
-def render_repo_content(repo: Repo):
-    file_types, file_data, skipped_files = get_file_types(repo.path)
-    structure = get_directory_structure(repo.path, file_data, skipped_files)
-    dir_structure = render_directory_structure(structure)
-    
-    # Calculate initial totals
-    all_files = list(file_data.keys())
-    total_files, total_bytes, total_tokens = calculate_totals(file_data, all_files, [])
+def render_repo_content(repo: Repo, scan, encoding: str, entry: Optional[RepoEntry] = None, repos=()):
+    current_id = repo_id(repo.path, repo.revision)
+    excluded = set(entry.excluded) if entry is not None else set()
+    if entry is not None and entry.selection is not None:
+        mask = decode_selection(scan, selection_ids(scan, entry.selection))
+        dir_structure = render_directory_structure(scan.file_data, scan.structure, mask=mask)
+        totals = render_totals(*scan.file_data.totals(mask, excluded))
+    else:
+        dir_structure = render_directory_structure(scan.file_data, scan.structure)
+        totals = render_totals(*calculate_totals(scan, ['.'], excluded))
     
     # Sort file types, putting "(no extension)" at the end if it exists
-    sorted_file_types = sorted(file_types.items(), key=lambda x: (x[0] != "(no extension)", x[0]))
+    sorted_file_types = sorted(scan.file_data.extension_totals().items(), key=lambda x: (x[0] != "(no extension)", x[0]))
     
     checkboxes = [
-        Checkbox(name="file_types", value=ext, label=f"{ext} ({info['count']} files, {info['size']} bytes, {info['tokens']} tokens)")
+        Checkbox(name="file_types", value=ext, checked=ext in excluded,
+                 label=f"{ext} ({info['count']} files, {info['size']} bytes, {info['tokens']} tokens)")
         for ext, info in sorted_file_types
     ]
     
+    other_repos = [Li(A(other.repo.name, href=f"/?repo_id={other.id}")) for other in repos if other.id != current_id]
     return Titled(f"Repository: {repo.name}",
+        Nav(Ul(*other_repos, Li(A("Open another repository", href="/clone")))),
         Form(
+            Hidden(name="encoding", value=encoding),
+            Hidden(name="repo_id", value=current_id),
             H3("File Type Exclusions"),
-            Div(*checkboxes, id="file-types", hx_post="/update-totals", hx_trigger="change", hx_target="#totals"),
-            P(f"Total: {total_files} files, {total_bytes} bytes, {total_tokens} tokens", id="totals"),
+            Div(*checkboxes, id="file-types", hx_post="/totals", hx_trigger="change", hx_target="#totals",
+                hx_params="file_types,encoding,repo_id"),
+            P(totals, id="totals"),
+            Small(f"Token counts use {encoding}."),
+            render_scan_status(encoding, current_id) if exact_scan_pending(repo, encoding) else "",
             H3("Directory Structure"),
             Div(
-                Button("Select All", hx_post="/select-all", hx_target="#directory-structure"),
-                Button("Unselect All", hx_post="/unselect-all", hx_target="#directory-structure")
+                Button("Select All", type="button", onclick="setAllSelected(true)",
+                       hx_post="/select-all", hx_target="#totals", hx_params="file_types,encoding,repo_id"),
+                Button("Unselect All", type="button", onclick="setAllSelected(false)",
+                       hx_post="/unselect-all", hx_target="#totals", hx_params="file_types,encoding,repo_id")
             ),
             Div(dir_structure, 
                 id="directory-structure", 
                 hx_trigger="change", 
-                hx_post="/update-totals", 
+                hx_post="/totals", 
                 hx_target="#totals",
-                hx_include="[name='file_types'],[name='selected_files']"
+                hx_params="file_types,encoding,repo_id"
+            ),
+            Fieldset(
+                Label("Token budget (optional):", For="max_tokens"),
+                Input(type="number", id="max_tokens", name="max_tokens", min="1", placeholder="e.g. 128000"),
+                Label("Priority when over budget:", For="policy"),
+                Select(*[Option(name, value=name) for name in POLICIES], id="policy", name="policy"),
+                Label("Path weights (pattern=weight per line):", For="weights"),
+                Textarea(id="weights", name="weights", rows=2, placeholder="src/*=2\ntests/*=0"),
+                Label("Explicit order (one path per line):", For="order"),
+                Textarea(id="order", name="order", rows=2),
+                Label("Split into parts of at most this many tokens (optional):", For="part_tokens"),
+                Input(type="number", id="part_tokens", name="part_tokens", min="1", placeholder="e.g. 100000"),
             ),
             Button("Combine Files", type="submit"),
+            Button("Combine as Plain Text", type="submit", formaction="/combine-stream", cls="secondary"),
+            Fieldset(
+                Label("Download format:", For="format"),
+                Select(*[Option(name, value=name) for name in FORMATS], id="format", name="format"),
+                Label("Compression:", For="compression"),
+                Select(*[Option(name, value=name) for name in COMPRESSIONS], id="compression", name="compression"),
+                *([] if 'zstd' in COMPRESSIONS else [Small("zstd is unavailable: install the zstandard package to enable it.")]),
+                Button("Download", type="submit", formaction="/download", cls="secondary"),
+            ),
             action="/combine", method="post"
         ),
         Form(
+            Hidden(name="repo_id", value=current_id),
+            Button("Refresh Repository", cls="secondary"),
+            action="/refresh", method="post"
+        ),
+        Form(
+            Hidden(name="repo_id", value=current_id),
             Button("Delete Repository"),
             action="/delete", method="post"
         )
@@ -0,0 +1,155 @@
+import hashlib
+import os
+import tarfile
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from export import decode_file
+
+try:
+    import zstandard
+except ImportError:  # .tar.zst uploads are accepted only when zstandard is installed
+    zstandard = None
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz')
+if zstandard is not None:
+    ARCHIVE_SUFFIXES += ('.tar.zst', '.tzst')
+
+COPY_CHUNK_BYTES = 1 << 20
+
+
+class ArchiveTooLarge(ValueError):
+    pass
+
+
+def archive_suffix(file_name):
+    """The archive suffix of file_name, or None if it is not a supported archive."""
+    lowered = file_name.lower()
+    return next((suffix for suffix in sorted(ARCHIVE_SUFFIXES, key=len, reverse=True) if lowered.endswith(suffix)), None)
+
+
+@contextmanager
+def open_tar(archive_path):
+    """Open a tar archive as a stream, so a compressed one is decompressed in a single pass."""
+    compressed_with_zstd = archive_suffix(archive_path) in ('.tar.zst', '.tzst')
+    with open(archive_path, 'rb') as f:
+        stream = zstandard.ZstdDecompressor().stream_reader(f) if compressed_with_zstd else f
+        with tarfile.open(fileobj=stream, mode='r|' if compressed_with_zstd else 'r|*') as archive:
+            yield archive
+
+
+def iter_members(archive_path, max_total_bytes=None):
+    """
+    Yield (name, data) for each regular file in an archive, in archive
+    order, holding one member in memory at a time. Raises ArchiveTooLarge
+    before reading a member that takes the total size of the members past
+    max_total_bytes, so an archive cannot expand without bound.
+    """
+    total_bytes = 0
+
+    def count(name, size):
+        nonlocal total_bytes
+        total_bytes += size
+        if max_total_bytes is not None and total_bytes > max_total_bytes:
+            raise ArchiveTooLarge(f"Archive expands to more than {max_total_bytes} bytes at {name}")
+
+    if archive_suffix(archive_path) == '.zip':
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    count(info.filename, info.file_size)
+                    yield info.filename, archive.read(info)
+        return
+    with open_tar(archive_path) as archive:
+        for info in archive:
+            if info.isfile():
+                count(info.name, info.size)
+                yield info.name, archive.extractfile(info).read()
+
+
+def member_prefix(names):
+    """
+    The single top-level directory shared by every member ('repo-main/'
+    in GitHub archives), which is dropped from paths, or ''.
+    """
+    first, sep, _ = names[0].partition('/') if names else ('', '', '')
+    if sep and all(name.startswith(first + '/') for name in names):
+        return first + '/'
+    return ''
+
+
+class ArchiveReader:
+    """
+    Reads members of an uploaded archive on demand. Zip members are read
+    directly. A tar stream cannot seek, so the first read extracts every
+    member in one pass, a chunk at a time, into a temporary directory where
+    each file is named by the sha1 of its content; later reads open those
+    files. The directory is removed when the reader is closed.
+    """
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self.lock = threading.Lock()
+        self.zip = zipfile.ZipFile(archive_path) if archive_suffix(archive_path) == '.zip' else None
+        self.extract_dir = None
+        self.extracted = None  # member name -> path of its content in extract_dir
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, name):
+        """Return a member's bytes. Raises KeyError if there is no such member."""
+        with self.lock:
+            if self.zip is not None:
+                return self.zip.read(name)
+            if self.extracted is None:
+                self.extract()
+            with open(self.extracted[name], 'rb') as f:
+                return f.read()
+
+    def extract(self):
+        self.extract_dir = tempfile.TemporaryDirectory(prefix='archive-')
+        partial_path = os.path.join(self.extract_dir.name, 'partial')
+        extracted = {}
+        with open_tar(self.archive_path) as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                digest = hashlib.sha1()
+                with archive.extractfile(info) as member, open(partial_path, 'wb') as f:
+                    while chunk := member.read(COPY_CHUNK_BYTES):
+                        digest.update(chunk)
+                        f.write(chunk)
+                content_path = os.path.join(self.extract_dir.name, digest.hexdigest())
+                os.replace(partial_path, content_path)
+                extracted[info.name] = content_path
+        self.extracted = extracted
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+        if self.extract_dir is not None:
+            self.extract_dir.cleanup()
+
+
+class ArchiveSource:
+    """
+    Reads a scanned archive's files for export, like git_objects.TreeSource.
+    blobs maps each path to its content hash, which serves as its stamp in
+    combine cache keys.
+    """
+
+    def __init__(self, reader, prefix, blobs):
+        self.reader = reader
+        self.prefix = prefix
+        self.blobs = blobs
+
+    def __contains__(self, path):
+        return path in self.blobs
+
+    def read(self, path):
+        return decode_file(self.reader.read(self.prefix + path))
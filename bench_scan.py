@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+import time
+from utils import get_file_types
+
+def make_synthetic_repo(path, n_files=2000, lines=200):
+    for i in range(n_files):
+        subdir = os.path.join(path, f"pkg{i % 50}")
+        os.makedirs(subdir, exist_ok=True)
+        with open(os.path.join(subdir, f"module{i}.py"), "w") as f:
+            for j in range(lines):
+                f.write(f"def function_{j}(x, y):\n    return x * {j} + y  # line {j}\n")
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{label}: {time.perf_counter() - start:.2f}s")
+    return result
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    with tempfile.TemporaryDirectory() as repo_path:
+        make_synthetic_repo(repo_path)
+        serial = timed("serial", lambda: get_file_types(repo_path))
+        threaded = timed(f"thread x{workers}", lambda: get_file_types(repo_path, workers=workers, executor='thread'))
+        parallel = timed(f"process x{workers}", lambda: get_file_types(repo_path, workers=workers))
+        assert serial == threaded == parallel
@@ -0,0 +1,247 @@
+import hashlib
+import os
+import re
+import subprocess
+import threading
+import uuid
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+
+PROGRESS_SEPARATOR = re.compile(rb'[\r\n]')
+BLOB_LIMIT = re.compile(r'^\d+[kmg]?$', re.IGNORECASE)
+COMMIT_ID = re.compile(r'^[0-9a-f]{40}$', re.IGNORECASE)
+
+mirror_locks = defaultdict(threading.Lock)
+mirror_locks_lock = threading.Lock()
+
+
+@dataclass
+class CloneOptions:
+    """
+    How much of a remote to fetch. depth limits history, blob_limit skips
+    blobs larger than e.g. '1m' until they are needed (a partial clone),
+    sparse_paths restricts the working tree to gitignore-style patterns,
+    and revision selects a branch, tag or commit instead of the remote's
+    default branch.
+    """
+    depth: int = None
+    blob_limit: str = None
+    sparse_paths: tuple = ()
+    revision: str = None
+
+    def __post_init__(self):
+        if self.depth is not None and self.depth < 1:
+            raise ValueError(f"Invalid clone depth: {self.depth}")
+        if self.blob_limit is not None and not BLOB_LIMIT.match(self.blob_limit):
+            raise ValueError(f"Invalid blob size limit: {self.blob_limit}")
+        for value in (self.revision, *self.sparse_paths):
+            if value is not None and (not value or value.startswith('-')):
+                raise ValueError(f"Invalid clone argument: {value!r}")
+
+    @property
+    def uses_mirror(self):
+        """
+        Whether a checkout can borrow from a mirror. Mirrors hold the full
+        history of every branch, which is exactly what shallow and sparse
+        clones exist to avoid downloading.
+        """
+        return self.depth is None and not self.sparse_paths
+
+    @property
+    def is_commit(self):
+        """
+        Whether revision is a full commit id, which can be fetched by name.
+        Servers refuse abbreviated ids, so those are resolved after cloning.
+        """
+        return self.revision is not None and bool(COMMIT_ID.match(self.revision))
+
+
+@dataclass
+class CloneJob:
+    """
+    State of one background clone-and-index job, updated from the worker
+    thread and read by the status endpoint.
+    """
+    url: str
+    repo_path: str
+    revision: str = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    status: str = 'queued'  # queued, cloning, fetching, indexing, done or failed
+    progress: str = ''
+    files_scanned: int = 0
+    files_total: int = 0
+    tokens_counted: int = 0
+    error: str = ''
+    log: deque = field(default_factory=lambda: deque(maxlen=20))
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def on_git_progress(self, line):
+        self.progress = line
+        self.log.append(line)
+
+    def on_scan_progress(self, scanned, total, tokens):
+        self.files_scanned = scanned
+        self.files_total = total
+        self.tokens_counted = tokens
+
+    def fail(self, error):
+        self.status = 'failed'
+        self.error = error
+
+
+def checkout_path(root, url, name):
+    """
+    Location of the working copy of url, named after the repo and a hash
+    of url, so forks that share a name get checkouts of their own.
+    """
+    return os.path.join(root, f"{name}-{hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]}")
+
+
+def mirror_path(mirror_root, url, blob_limit=None, depth=None):
+    """
+    Location of the bare mirror of url. Partial mirrors are kept apart per
+    blob limit: a checkout borrowing from a mirror must use the same filter,
+    or git would assume it already has blobs the mirror never fetched.
+    Shallow mirrors, which are only read directly, are kept apart per depth.
+    """
+    key = url
+    if blob_limit is not None:
+        key += f" blob:limit={blob_limit}"
+    if depth is not None:
+        key += f" depth={depth}"
+    return os.path.join(mirror_root, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.git')
+
+
+def update_mirror(url, mirror, on_progress, blob_limit=None, depth=None):
+    """
+    Create a bare mirror of url, or fetch new objects into an existing one.
+    Automatic gc is turned off in the mirror because checkouts borrow its
+    objects through --reference and must not lose them to a prune. With a
+    depth the mirror is shallow; git refuses to borrow from shallow
+    repositories, so such mirrors are only read directly.
+    """
+    depth_args = ['--depth', str(depth)] if depth else []
+    with mirror_locks_lock:
+        lock = mirror_locks[mirror]
+    with lock:
+        if os.path.isdir(mirror):
+            return run_git(['-C', mirror, 'fetch', '--prune', '--progress', *depth_args], on_progress)
+        args = ['clone', '--mirror', '--progress', *depth_args]
+        if blob_limit:
+            args.append(f'--filter=blob:limit={blob_limit}')
+        returncode = run_git(args + ['--', url, mirror], on_progress)
+        if returncode == 0:
+            returncode = run_git(['-C', mirror, 'config', 'gc.auto', '0'], on_progress)
+        return returncode
+
+
+def git_clone(url, path, on_progress, options=None, mirror=None):
+    """
+    Clone url into path with the given CloneOptions, passing git's
+    progress lines to on_progress. With a mirror, the mirror is created or
+    fetched first and the clone borrows its objects with --reference, so
+    only refs are exchanged with the remote; shallow and sparse clones
+    ignore the mirror. Branches and tags the remote lists, even ones with
+    hex-looking names, are cloned directly with --branch. A full commit id
+    is fetched by name; any other revision, such as an abbreviated commit
+    id, is resolved in the clone with rev-parse. These, and sparse
+    checkouts, are cloned without a checkout first and checked out once
+    the commit is known and the sparse patterns are set. Returns the first
+    non-zero git exit code, or 0.
+    """
+    options = options or CloneOptions()
+    is_ref = bool(options.revision) and not options.is_commit and remote_has_ref(url, options.revision)
+    resolve_locally = bool(options.revision) and not options.is_commit and not is_ref
+    if not options.uses_mirror:
+        mirror = None
+    if mirror:
+        returncode = update_mirror(url, mirror, on_progress, options.blob_limit)
+        if returncode != 0:
+            return returncode
+    args = ['clone', '--progress']
+    if mirror:
+        args += ['--reference', mirror]
+    if options.depth:
+        args += ['--depth', str(options.depth)]
+    if options.blob_limit:
+        args += [f'--filter=blob:limit={options.blob_limit}']
+    if is_ref:
+        args += ['--branch', options.revision]
+    deferred_checkout = options.is_commit or resolve_locally or bool(options.sparse_paths)
+    if deferred_checkout:
+        args += ['--no-checkout']
+    commands = [args + ['--', url, path]]
+
+    if options.is_commit:
+        fetch = ['-C', path, 'fetch', '--progress']
+        if options.depth:
+            fetch += ['--depth', str(options.depth)]
+        commands.append(fetch + ['origin', options.revision])
+    if options.sparse_paths:
+        commands.append(['-C', path, 'sparse-checkout', 'set', '--no-cone', '--', *options.sparse_paths])
+    if deferred_checkout:
+        checkout = ['-C', path, 'checkout', '--progress']
+        if options.is_commit:
+            checkout += ['--detach', options.revision]
+        elif resolve_locally:
+            commit = f'{options.revision}^{{commit}}'
+            commands.append(['-C', path, 'rev-parse', '--verify', commit])
+            checkout += ['--detach', commit]
+        commands.append(checkout)
+
+    for command in commands:
+        returncode = run_git(command, on_progress)
+        if returncode != 0:
+            return returncode
+    return 0
+
+
+def remote_has_ref(url, revision):
+    """Whether the remote at url has a branch or tag named revision."""
+    result = subprocess.run(['git', 'ls-remote', '--', url, f'refs/heads/{revision}', f'refs/tags/{revision}'],
+                            stdin=subprocess.DEVNULL, capture_output=True, text=True)
+    return result.returncode == 0 and bool(result.stdout.strip())
+
+
+def refresh_checkout(path, on_progress, url=None, mirror=None, blob_limit=None):
+    """
+    Bring a checkout up to date with an incremental fetch (through its
+    mirror, if it has one) and move a checked-out branch to its upstream.
+    Only files that changed are rewritten, so a rescan against the scan
+    index re-reads just those. Detached checkouts of a tag or commit stay
+    where they are.
+    """
+    if mirror and url:
+        returncode = update_mirror(url, mirror, on_progress, blob_limit)
+        if returncode != 0:
+            return returncode
+    if run_git(['-C', path, 'symbolic-ref', '-q', 'HEAD'], on_progress) != 0:
+        return 0
+    for args in (['fetch', '--progress', 'origin'], ['reset', '-q', '--hard', '@{upstream}']):
+        returncode = run_git(['-C', path, *args], on_progress)
+        if returncode != 0:
+            return returncode
+    return 0
+
+
+def run_git(args, on_progress):
+    """
+    Run a git command, passing each line it writes to stderr to
+    on_progress as it arrives. git redraws its progress counters with
+    carriage returns, so both \\r and \\n end a line. Returns the exit code.
+    """
+    process = subprocess.Popen(['git', *args],
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    pending = b''
+    for chunk in iter(lambda: process.stderr.read1(4096), b''):
+        *lines, pending = PROGRESS_SEPARATOR.split(pending + chunk)
+        for line in lines:
+            if line.strip():
+                on_progress(line.decode('utf-8', 'replace').strip())
+    if pending.strip():
+        on_progress(pending.decode('utf-8', 'replace').strip())
+    process.stderr.close()
+    return process.wait()
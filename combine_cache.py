@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import tempfile
+from scan_index import stat_key
+
+TEMP_PREFIX = '.tmp-'
+
+
+def selection_key(repo_path, paths, file_types, *variant, stamps=None):
+    """
+    Key for the output of combining paths under repo_path. The selection
+    is de-duplicated in order and the exclusions are sorted. Each path's
+    mtime, size and inode stand in for its content (the same rule the scan
+    index uses), so computing the key costs one stat per path and no reads.
+    For files read from a git tree, stamps maps paths to their blob SHAs
+    and nothing is stat'ed.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([os.path.abspath(repo_path), sorted(set(file_types)), *variant]).encode('utf-8'))
+    for path in dict.fromkeys(paths):
+        if stamps is not None:
+            stamp = stamps.get(path)
+        else:
+            try:
+                stamp = stat_key(os.stat(os.path.join(repo_path, path)))
+            except OSError:
+                stamp = None
+        digest.update(json.dumps([path, stamp]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches etag (weak comparison, as RFC 9110 requires)."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or etag in [candidate.removeprefix('W/') for candidate in candidates]
+
+
+class CombineCache:
+    """
+    Size-bounded on-disk cache of combined outputs, one file per key.
+    Entries are written to a temporary file while they stream to the
+    client and only become visible once complete. A hit refreshes the
+    entry's mtime, and eviction removes the least recently used entries
+    until the cache fits in max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return the path of a cached entry, or None."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def store(self, key, chunks):
+        """
+        Yield chunks (bytes) through while writing them to the cache. An
+        interrupted stream leaves no entry behind.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.replace(temp_path, self.path(key))
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith(TEMP_PREFIX):
+                    st = entry.stat()
+                    entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
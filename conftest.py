@@ -4,7 +4,12 @@ import signal
 import time
 import requests
 from requests.exceptions import RequestException
-from app import app, SUBDIRECTORY, Repo
+from app import app, MAX_KEPT_SCANS, SUBDIRECTORY, Repo
+from repo_registry import RepoRegistry
+from shared_scans import SharedScans
+from part_plans import PartPlans
+from single_flight import SingleFlight
+from utils import RepoScan
 import os
 from starlette.testclient import TestClient
 import pytest
@@ -16,12 +21,14 @@ from pathlib import Path
 PORT = 5001
 
 @pytest.fixture(scope="session", autouse=True)
-def server(request):
+def server(request, tmp_path_factory):
     process = None
+    state = tmp_path_factory.mktemp("server_state")
     try:
         print("Starting server...")
         process = subprocess.Popen(
             ["poetry", "run", "python", "app.py"],
+            env={**os.environ, 'STATE_PATH': str(state / "state.db"), 'SCANS_PATH': str(state / "scans.db")},
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             text=True,
@@ -95,7 +102,6 @@ def mock_repo(tmp_path):
 # for nonui tests
 @pytest.fixture
 def loaded_repo_page(page, mock_repo):
-    app.state.current_repo = None  # Reset the current repo
     page.goto(f"http://localhost:{PORT}")
     page.wait_for_load_state("networkidle")
     page.fill("input[name='url']", f"file://{mock_repo.path}")
@@ -124,78 +130,63 @@ def mock_repo_structure(mocker):
     }
     mock_skipped_files = ['binary_file']
 
-    def mock_get_file_types(repo_path):
-        print("mock_get_file_types called")
-        return mock_file_types, mock_file_data, mock_skipped_files
-
-    mocker.patch('app.get_file_types', side_effect=mock_get_file_types)
-    mocker.patch('app.get_directory_structure', return_value={
-        'type': 'directory',
-        'name': 'test_repo',
-        'path': '/path/to/test_repo',
-        'children': [
-            {
-                'type': 'file',
-                'name': 'file1.py',
-                'path': '/path/to/test_repo/file1.py',
-                'size': 100,
-                'tokens': 50
-            },
-            {
-                'type': 'file',
-                'name': 'file2.txt',
-                'path': '/path/to/test_repo/file2.txt',
-                'size': 200,
-                'tokens': 100
-            },
-            {
-                'type': 'directory',
-                'name': 'subdir',
-                'path': '/path/to/test_repo/subdir',
-                'children': [
-                    {
-                        'type': 'file',
-                        'name': 'file3.js',
-                        'path': '/path/to/test_repo/subdir/file3.js',
-                        'size': 150,
-                        'tokens': 75
-                    }
-                ]
-            },
-            {
-                'type': 'file',
-                'name': '.gitignore',
-                'path': '/path/to/test_repo/.gitignore',
-                'size': 20,
-                'tokens': 10
-            },
-            {
-                'type': 'file',
-                'name': 'LICENSE',
-                'path': '/path/to/test_repo/LICENSE',
-                'size': 50,
-                'tokens': 25
-            },
-            {
-                'type': 'file',
-                'name': 'binary_file',
-                'path': '/path/to/test_repo/binary_file',
-                'skipped': True
-            }
-        ]
-    })
+    def mock_scan_repo(repo_path, **kwargs):
+        return RepoScan(repo_path, mock_file_types, mock_file_data, mock_skipped_files, ['subdir'])
+
+    mocker.patch('app.scan_repo', side_effect=mock_scan_repo)
+
+@pytest.fixture(autouse=True)
+def isolated_token_cache(mocker, tmp_path):
+    mocker.patch('app.TOKEN_CACHE_PATH', str(tmp_path / "token_cache.db"))
+
+@pytest.fixture(autouse=True)
+def isolated_shared_state(tmp_path_factory):
+    db_path = str(tmp_path_factory.mktemp("state") / "state.db")
+    app.state.repos = RepoRegistry(db_path, Repo)
+    app.state.shared_scans = SharedScans(db_path)
+    app.state.part_plans = PartPlans(db_path)
+    app.state.scans = SingleFlight(max_results=MAX_KEPT_SCANS)
+    yield
+    app.state.repos.close()
+    app.state.shared_scans.close()
+    app.state.part_plans.close()
+
+@pytest.fixture(autouse=True)
+def isolated_combine_cache(mocker, tmp_path):
+    from combine_cache import CombineCache
+    cache = CombineCache(str(tmp_path / "combine_cache"), 1 << 20)
+    mocker.patch('app.combine_cache', cache)
+    return cache
 
 @pytest.fixture
 def mock_current_repo(mocker, mock_repo):
-    def mock_get_current_repo(request):
+    def mock_get_current_repo(request, repo_id=None):
         return mock_repo
     mocker.patch('app.get_current_repo', side_effect=mock_get_current_repo)
     return mock_repo
 
+@pytest.fixture
+def opened_repo():
+    """Look up a repo opened in any session by its id."""
+    def find(repo_id):
+        row = app.state.repos.db.execute("select repo from repos where repo_id = ?", (repo_id,)).fetchone()
+        return Repo.from_json(row[0]) if row else None
+    return find
+
+@pytest.fixture
+def wait_for():
+    """Wait up to five seconds for a clone job to finish, or for a condition to hold."""
+    def wait(job_or_condition, timeout=5):
+        done = job_or_condition if callable(job_or_condition) else lambda: job_or_condition.finished
+        deadline = time.monotonic() + timeout
+        while not done() and time.monotonic() < deadline:
+            time.sleep(0.05)
+    return wait
+
 @pytest.fixture
 def client(mock_repo_structure, mock_current_repo):
     with TestClient(app, follow_redirects=True) as client:
-        app.state.current_repo = mock_current_repo
+        app.state.clone_jobs.clear()
         yield client
 
 @pytest.fixture(scope="session")
@@ -233,7 +224,6 @@ def test_git_repo():
 
 @pytest.fixture
 def loaded_ui_test_repo_page(page, test_git_repo):
-    app.state.current_repo = None  # Reset the current repo
     page.goto(f"http://localhost:{PORT}")
     page.wait_for_load_state("networkidle")
     page.fill("input[name='url']", f"file://{test_git_repo}")
@@ -0,0 +1,136 @@
+import json
+import os
+import re
+import zlib
+from xml.sax.saxutils import escape, quoteattr
+from file_table import get_extension
+from packer import split_lines
+
+try:
+    import zstandard
+except ImportError:  # zstd downloads are offered only when zstandard is installed
+    zstandard = None
+
+BACKTICK_RUN = re.compile(r'`{3,}')
+
+
+def is_excluded(file_path, file_types):
+    return any(file_path.endswith(ext) for ext in file_types)
+
+
+def iter_files(repo_path, selected_files, file_types, source=None):
+    """
+    Yield (path, content) for each selected regular file whose extension is
+    not excluded, reading one file at a time. With a source (such as a
+    git_objects.TreeSource) files are read from it instead of repo_path.
+    """
+    for file_path in selected_files:
+        if source is not None:
+            if file_path in source and not is_excluded(file_path, file_types):
+                yield file_path, source.read(file_path)
+            continue
+        full_path = os.path.join(repo_path, file_path)
+        if os.path.exists(full_path) and not os.path.isdir(full_path) and not is_excluded(file_path, file_types):
+            yield file_path, read_file(full_path)
+
+
+def read_file(full_path):
+    with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
+        return f.read()
+
+
+def decode_file(data):
+    """Decode file bytes from another source the way read_file decodes a file on disk."""
+    text = data.decode('utf-8', 'ignore')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def iter_part(repo_path, entries, tokenizer, source=None):
+    """
+    Yield (label, content) for one planned part, reading only its files.
+    Pieces of a split file are labelled with their line range.
+    """
+    for file_path, piece, pieces in entries:
+        try:
+            if source is not None:
+                content = source.read(file_path)
+            else:
+                content = read_file(os.path.join(repo_path, file_path))
+        except (OSError, KeyError):
+            continue
+        if pieces == 1:
+            yield file_path, content
+            continue
+        first, last, text = split_lines(content, piece, pieces, tokenizer)
+        lines = f"lines {first}-{last}" if first is not None else "no lines"
+        yield f"{file_path} ({lines}, piece {piece + 1}/{pieces})", text
+
+
+def render_text(files, count_tokens=None):
+    for file_path, content in files:
+        yield f">>> FILE: {file_path} <<<\n"
+        yield content
+        yield "\n\n"
+
+
+def render_markdown(files, count_tokens=None):
+    for file_path, content in files:
+        # The fence must be longer than any backtick run inside the file
+        fence = '`' * max([3] + [len(run) + 1 for run in BACKTICK_RUN.findall(content)])
+        ext = get_extension(os.path.basename(file_path))
+        language = ext[1:] if ext.startswith('.') else ''
+        yield f"## {file_path}\n\n{fence}{language}\n"
+        yield content
+        if content and not content.endswith('\n'):
+            yield "\n"
+        yield f"{fence}\n\n"
+
+
+def render_xml(files, count_tokens=None):
+    yield "<documents>\n"
+    for index, (file_path, content) in enumerate(files, 1):
+        yield f'<document index="{index}" path={quoteattr(file_path)}>\n'
+        yield escape(content)
+        yield "\n</document>\n"
+    yield "</documents>\n"
+
+
+def render_jsonl(files, count_tokens):
+    for file_path, content in files:
+        record = {'path': file_path, 'tokens': count_tokens(file_path, content), 'content': content}
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+# format: (renderer, media type, file extension)
+FORMATS = {
+    'text': (render_text, 'text/plain; charset=utf-8', 'txt'),
+    'markdown': (render_markdown, 'text/markdown; charset=utf-8', 'md'),
+    'xml': (render_xml, 'application/xml', 'xml'),
+    'jsonl': (render_jsonl, 'application/x-ndjson', 'jsonl'),
+}
+
+# compression: (media type, file extension)
+COMPRESSIONS = {
+    'none': (None, ''),
+    'gzip': ('application/gzip', '.gz'),
+}
+if zstandard is not None:
+    COMPRESSIONS['zstd'] = ('application/zstd', '.zst')
+
+
+def compress_stream(chunks, compression):
+    """Encode text chunks as UTF-8 and compress them on the fly."""
+    if compression == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    elif compression == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        yield from (chunk.encode('utf-8') for chunk in chunks)
+        return
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
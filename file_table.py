@@ -0,0 +1,174 @@
+import os
+import sys
+from array import array
+from collections.abc import Mapping
+from itertools import accumulate, compress, islice
+from operator import mul
+
+
+def get_extension(file_name):
+    if file_name.startswith('.'):
+        return file_name
+    _, ext = os.path.splitext(file_name)
+    return ext or "(no extension)"
+
+
+def tree_order_key(path):
+    """Sort key matching the directory tree: files before subdirectories, by name."""
+    parts = path.split(os.sep)
+    return [(1, part) for part in parts[:-1]] + [(0, parts[-1])]
+
+
+class FileTable(Mapping):
+    """
+    Columnar store for per-file scan results. Paths are interned and
+    assigned consecutive ids; extension ids, sizes, token counts and the
+    estimated flag live in parallel arrays. When files are added in tree
+    order every directory covers a contiguous id range, so a selection is
+    a bytearray mask and totals are masked sums over the columns.
+
+    The table also behaves as a read-only mapping of path to
+    {'count', 'size', 'tokens'} so it can stand in for file_data dicts.
+    """
+
+    def __init__(self):
+        self.paths = []
+        self.ids = {}
+        self.extensions = []
+        self.extension_ids = {}
+        self.ext = bytearray()
+        self.sizes = array('Q')
+        self.tokens = array('Q')
+        self.estimated = bytearray()
+        self.prefix_sums = {}
+
+    @classmethod
+    def from_file_data(cls, file_data):
+        table = cls()
+        for path in sorted(file_data, key=tree_order_key):
+            info = file_data[path]
+            table.add(path, None, info['size'], info['tokens'], info.get('estimated', False))
+        return table
+
+    def add(self, path, ext, size, tokens, estimated=False):
+        if ext is None:
+            ext = get_extension(os.path.basename(path))
+        ext_id = self.extension_ids.get(ext)
+        if ext_id is None:
+            ext_id = self.extension_ids[ext] = len(self.extensions)
+            self.extensions.append(ext)
+            if ext_id == 256:
+                self.ext = array('H', iter(self.ext))
+        path = sys.intern(path)
+        self.ids[path] = len(self.paths)
+        self.paths.append(path)
+        self.ext.append(ext_id)
+        self.sizes.append(size)
+        self.tokens.append(tokens)
+        self.estimated.append(bool(estimated))
+        self.prefix_sums.clear()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter(self.paths)
+
+    def __contains__(self, path):
+        return path in self.ids
+
+    def __getitem__(self, path):
+        file_id = self.ids[path]
+        info = {'count': 1, 'size': self.sizes[file_id], 'tokens': self.tokens[file_id]}
+        if self.estimated[file_id]:
+            info['estimated'] = True
+        return info
+
+    def extension_of(self, file_id):
+        return self.extensions[self.ext[file_id]]
+
+    def has_estimates(self):
+        return 1 in self.estimated
+
+    def select_extensions(self, ext_ids):
+        """Return a mask with 1 for every file whose extension id is in ext_ids."""
+        if isinstance(self.ext, bytearray):
+            return self.ext.translate(bytes(ext_id in ext_ids for ext_id in range(256)))
+        return bytearray(ext_id in ext_ids for ext_id in self.ext)
+
+    def extension_mask(self, excluded):
+        """Return a mask with 1 for every file whose extension is not excluded."""
+        return self.select_extensions({
+            ext_id for ext, ext_id in self.extension_ids.items() if ext not in excluded})
+
+    def prefix_sum(self, ext_id=None):
+        """
+        Cumulative (count, size, tokens) arrays over file ids, for all files
+        or for one extension, built on first use.
+        """
+        sums = self.prefix_sums.get(ext_id)
+        if sums is None:
+            if ext_id is None:
+                only = bytearray(b'\x01') * len(self.paths)
+            else:
+                only = self.select_extensions({ext_id})
+            sums = self.prefix_sums[ext_id] = tuple(
+                array('Q', accumulate(column, initial=0))
+                for column in (only, map(mul, self.sizes, only), map(mul, self.tokens, only)))
+        return sums
+
+    def totals(self, mask, excluded=()):
+        """
+        Return (files, bytes, tokens) for the files set in mask, minus
+        excluded extensions. Selections made of whole directories are a
+        few runs of consecutive ids, which are summed from prefix sums in
+        time proportional to the number of runs; fragmented masks fall back
+        to a masked sum over the columns.
+        """
+        max_runs = len(mask) // 64 + 1
+        ranges = list(islice(runs(mask), max_runs + 1))
+        if len(ranges) > max_runs:
+            if excluded:
+                mask = mask_and(mask, self.extension_mask(excluded))
+            return mask.count(1), sum(compress(self.sizes, mask)), sum(compress(self.tokens, mask))
+
+        totals = [0, 0, 0]
+        signed_sums = [(1, self.prefix_sum())] + [
+            (-1, self.prefix_sum(self.extension_ids[ext])) for ext in excluded if ext in self.extension_ids]
+        for sign, sums in signed_sums:
+            for i, prefix in enumerate(sums):
+                totals[i] += sign * sum(prefix[end] - prefix[start] for start, end in ranges)
+        return tuple(totals)
+
+    def extension_totals(self, mask=None):
+        """
+        Return {ext: {'count', 'size', 'tokens'}} in first-seen order, in
+        one pass over the columns.
+        """
+        columns = (self.ext, self.sizes, self.tokens)
+        if mask is not None:
+            columns = [compress(column, mask) for column in columns]
+        counts = [0] * len(self.extensions)
+        sizes = [0] * len(self.extensions)
+        tokens = [0] * len(self.extensions)
+        for ext_id, size, token_count in zip(*columns, strict=True):
+            counts[ext_id] += 1
+            sizes[ext_id] += size
+            tokens[ext_id] += token_count
+        return {ext: {'count': counts[ext_id], 'size': sizes[ext_id], 'tokens': tokens[ext_id]}
+                for ext_id, ext in enumerate(self.extensions) if counts[ext_id]}
+
+
+def runs(mask):
+    """Yield (start, end) for each run of consecutive 1s in a mask."""
+    start = mask.find(1)
+    while start != -1:
+        end = mask.find(0, start)
+        if end == -1:
+            end = len(mask)
+        yield start, end
+        start = mask.find(1, end)
+
+
+def mask_and(a, b):
+    return bytearray((int.from_bytes(a, 'little') & int.from_bytes(b, 'little')).to_bytes(len(a), 'little'))
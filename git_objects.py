@@ -0,0 +1,93 @@
+import subprocess
+import threading
+from export import decode_file
+
+REGULAR_FILE_MODES = (b'100644', b'100755')
+
+
+def ls_tree(git_dir, revision='HEAD'):
+    """
+    Return [(path, blob_sha, size)] for the regular files in a revision's
+    tree, as listed by `git ls-tree -r -l`. Submodules and symlinks are
+    left out. Raises subprocess.CalledProcessError for an unknown revision.
+    """
+    output = subprocess.run(['git', '-C', git_dir, 'ls-tree', '-r', '-l', '-z', '--full-tree', revision, '--'],
+                            check=True, capture_output=True).stdout
+    entries = []
+    for record in output.split(b'\0'):
+        if not record:
+            continue
+        info, _, path = record.partition(b'\t')
+        mode, object_type, sha, size = info.split()
+        if object_type == b'blob' and mode in REGULAR_FILE_MODES:
+            entries.append((path.decode('utf-8', 'surrogateescape'), sha.decode('ascii'), int(size)))
+    return entries
+
+
+def resolve_revision(git_dir, revision='HEAD'):
+    """Return the commit a revision points to, or None if it does not exist."""
+    result = subprocess.run(['git', '-C', git_dir, 'rev-parse', '--verify', '-q', f'{revision}^{{commit}}'],
+                            capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+class CatFile:
+    """
+    One long-lived `git cat-file --batch` process that reads blobs by SHA,
+    so reading many files costs a pipe round trip each instead of a
+    process. Reads are serialized, so one instance can be shared between
+    threads.
+    """
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self.lock = threading.Lock()
+        self.process = subprocess.Popen(['git', '-C', git_dir, 'cat-file', '--batch'],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, sha):
+        """Return the blob's bytes. Raises KeyError if it does not exist."""
+        with self.lock:
+            self.process.stdin.write(sha.encode('ascii') + b'\n')
+            self.process.stdin.flush()
+            header = self.process.stdout.readline()
+            if not header:
+                raise OSError(f"git cat-file exited in {self.git_dir}")
+            fields = header.split()
+            if len(fields) < 3 or fields[1] == b'missing':
+                raise KeyError(sha)
+            data = self.process.stdout.read(int(fields[2]))
+            self.process.stdout.read(1)  # trailing newline
+            return data
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.close()
+            self.process.wait()
+        self.process.stdout.close()
+
+
+class TreeSource:
+    """
+    Reads a revision's files for export instead of the working tree.
+    blobs maps each repo-relative path to its blob SHA, which also serves
+    as the file's stamp in combine cache keys.
+    """
+
+    def __init__(self, cat_file, blobs):
+        self.cat_file = cat_file
+        self.blobs = blobs
+
+    def __contains__(self, path):
+        return path in self.blobs
+
+    def read(self, path):
+        """Return the file's text the way a text-mode read would decode it."""
+        return decode_file(self.cat_file.read(self.blobs[path]))
@@ -0,0 +1,184 @@
+import os
+import re
+
+ALWAYS_IGNORED = ('.git',)
+
+DEFAULT_IGNORES = (
+    '.hg',
+    '.svn',
+    'node_modules/',
+    'bower_components/',
+    '__pycache__/',
+    '.venv/',
+    'venv/',
+    '.tox/',
+    '.nox/',
+    '.mypy_cache/',
+    '.pytest_cache/',
+    '.ruff_cache/',
+    '*.egg-info/',
+    '.gradle/',
+    '.next/',
+    'build/',
+    'dist/',
+)
+
+
+def translate_glob(pattern):
+    """Translate a gitignore glob (without anchoring) into a regex body."""
+    i, n = 0, len(pattern)
+    parts = []
+    while i < n:
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == n:
+            parts.append('/.*')
+            i += 3
+        elif pattern[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        elif pattern[i] == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                parts.append(re.escape('['))
+                i += 1
+                continue
+            body = pattern[i + 1:end]
+            if body[0] in '!^':
+                body = '^' + body[1:]
+            parts.append('[' + body.replace('\\', '\\\\') + ']')
+            i = end + 1
+        elif pattern[i] == '\\' and i + 1 < n:
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(parts)
+
+
+def compile_pattern(line):
+    """
+    Compile one gitignore line into (regex, negated), or return None for
+    blank lines and comments. The regex is matched against a path relative
+    to the ignore file's directory, with a trailing '/' for directories.
+    """
+    line = line.rstrip('\n').rstrip('\r')
+    if line.endswith('\\ '):
+        line = line[:-2].rstrip(' ') + '\\ '
+    else:
+        line = line.rstrip(' ')
+    if not line or line.startswith('#'):
+        return None
+    negated = line.startswith('!')
+    if negated:
+        line = line[1:]
+    elif line.startswith('\\!') or line.startswith('\\#'):
+        line = line[1:]
+    dir_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    if '/' in line:
+        prefix = ''
+        line = line.lstrip('/')
+    else:
+        prefix = '(?:.*/)?'
+    suffix = '/' if dir_only else '/?'
+    return '^' + prefix + translate_glob(line) + suffix + '$', negated
+
+
+class RuleSet:
+    """
+    The ignore rules of one directory. Consecutive rules with the same sign
+    are merged into one alternation so that a path is tested against a few
+    compiled regexes instead of one per line; the last matching group wins.
+    """
+
+    def __init__(self, lines):
+        groups = []
+        for line in lines:
+            compiled = compile_pattern(line)
+            if compiled is None:
+                continue
+            regex, negated = compiled
+            if groups and groups[-1][1] == negated:
+                groups[-1][0].append(regex)
+            else:
+                groups.append(([regex], negated))
+        self.groups = [(re.compile('|'.join(regexes)), negated) for regexes, negated in reversed(groups)]
+
+    def __bool__(self):
+        return bool(self.groups)
+
+    def match(self, rel_path, is_dir):
+        """Return True (ignored), False (re-included) or None (no rule matched)."""
+        candidate = rel_path + '/' if is_dir else rel_path
+        for regex, negated in self.groups:
+            if regex.match(candidate):
+                return not negated
+        return None
+
+
+def read_lines(path):
+    try:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            return f.readlines()
+    except OSError:
+        return []
+
+
+class IgnoreEngine:
+    """
+    Decides which paths under a repo to skip, from a default deny-list,
+    .git/info/exclude and the .gitignore of every directory visited. The
+    .git directory itself is always skipped.
+    Directories must be loaded top-down (as os.walk does) so that an
+    ignored directory is pruned before anything inside it is considered.
+    """
+
+    def __init__(self, repo_path, default_patterns=DEFAULT_IGNORES):
+        self.repo_path = repo_path
+        self.rule_sets = {}
+        self.root_lines = list(ALWAYS_IGNORED) + list(default_patterns) + read_lines(
+            os.path.join(repo_path, '.git', 'info', 'exclude'))
+
+    def load_dir(self, rel_dir):
+        if rel_dir in self.rule_sets:
+            return
+        lines = read_lines(os.path.join(self.repo_path, rel_dir, '.gitignore'))
+        if not rel_dir:
+            lines = self.root_lines + lines
+        rules = RuleSet(lines)
+        if rules:
+            self.rule_sets[rel_dir] = rules
+
+    def is_ignored(self, rel_path, is_dir):
+        rel_dir = rel_path
+        while rel_dir:
+            rel_dir = os.path.dirname(rel_dir)
+            rules = self.rule_sets.get(rel_dir)
+            if rules is not None:
+                result = rules.match(rel_path[len(rel_dir) + 1:] if rel_dir else rel_path, is_dir)
+                if result is not None:
+                    return result
+        return False
+
+    def walk(self):
+        """
+        os.walk over the repo, yielding (root, rel_root, dirs, files) with
+        ignored entries pruned and names sorted, so files come out in the
+        same order as the directory tree.
+        """
+        for root, dirs, files in os.walk(self.repo_path):
+            rel_root = os.path.relpath(root, self.repo_path)
+            if rel_root == '.':
+                rel_root = ''
+            self.load_dir(rel_root)
+            dirs[:] = sorted(d for d in dirs if not self.is_ignored(os.path.join(rel_root, d), True))
+            files = sorted(f for f in files if not self.is_ignored(os.path.join(rel_root, f), False))
+            yield root, rel_root, dirs, files
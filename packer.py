@@ -0,0 +1,132 @@
+from fnmatch import fnmatch
+
+POLICIES = ('smallest', 'weights', 'recent', 'order')
+
+
+def parse_weights(text):
+    """
+    Parse 'pattern=weight' lines into [(pattern, weight)]. Patterns are
+    fnmatch globs matched against the repo-relative path; blank lines and
+    lines without a valid number are ignored.
+    """
+    weights = []
+    for line in (text or '').splitlines():
+        pattern, _, weight = line.rpartition('=')
+        try:
+            weights.append((pattern.strip(), float(weight)))
+        except ValueError:
+            continue
+    return [(pattern, weight) for pattern, weight in weights if pattern]
+
+
+def path_weight(path, weights, default=1.0):
+    """Weight of the last pattern matching path, as in gitignore files."""
+    weight = default
+    for pattern, pattern_weight in weights:
+        if fnmatch(path, pattern):
+            weight = pattern_weight
+    return weight
+
+
+def pack(files, budget, policy='smallest', weights=(), order=(), mtimes=None):
+    """
+    Choose which files fit in a token budget. files is a list of
+    (path, tokens) in selection order, where tokens already include the
+    section header. Files are considered in priority order and each one
+    that still fits is kept, so a large file does not stop smaller ones
+    behind it from being packed.
+
+    - 'smallest': fewest tokens first, which keeps the most files.
+    - 'weights': highest path weight first, then fewest tokens; files
+      with a weight of 0 or less are always dropped.
+    - 'recent': most recently modified first (mtimes maps path to mtime).
+    - 'order': the paths in order first, then the rest in selection order.
+
+    Returns (kept, dropped) as lists of (path, tokens). Kept files are in
+    selection order, or in the requested order for the 'order' policy.
+    """
+    position = {path: i for i, (path, _) in enumerate(files)}
+    if policy == 'weights':
+        ranked = [(path, tokens) for path, tokens in files if path_weight(path, weights) > 0]
+        ranked.sort(key=lambda item: (-path_weight(item[0], weights), item[1]))
+    elif policy == 'recent':
+        ranked = sorted(files, key=lambda item: -(mtimes or {}).get(item[0], 0))
+    elif policy == 'order':
+        rank = {path: i for i, path in enumerate(order)}
+        ranked = sorted(files, key=lambda item: rank.get(item[0], len(rank) + position[item[0]]))
+    else:
+        ranked = sorted(files, key=lambda item: item[1])
+
+    kept = []
+    used = 0
+    for path, tokens in ranked:
+        if used + tokens <= budget:
+            kept.append((path, tokens))
+            used += tokens
+    kept_paths = {path for path, _ in kept}
+    dropped = [(path, tokens) for path, tokens in files if path not in kept_paths]
+    if policy != 'order':
+        kept.sort(key=lambda item: position[item[0]])
+    return kept, dropped
+
+
+def plan_parts(files, max_tokens):
+    """
+    Split files, a list of (path, tokens) in output order, into
+    consecutive parts of at most max_tokens using only the given counts.
+    Parts break on file boundaries; a file larger than max_tokens gets
+    parts of its own, one per piece, which split_lines cuts to size. Returns [(entries, tokens)] where each
+    entry is (path, piece, pieces).
+    """
+    parts = []
+    entries = []
+    used = 0
+    for path, tokens in files:
+        if entries and used + tokens > max_tokens:
+            parts.append((entries, used))
+            entries = []
+            used = 0
+        if tokens > max_tokens:
+            pieces = -(-tokens // max_tokens)
+            parts.extend(([(path, piece, pieces)], tokens // pieces) for piece in range(pieces))
+            continue
+        entries.append((path, 0, 1))
+        used += tokens
+    if entries:
+        parts.append((entries, used))
+    return parts
+
+
+def split_lines(text, piece, pieces, tokenizer):
+    """
+    Return (first_line, last_line, text) of one of `pieces` consecutive
+    ranges of text with equal token counts, counting each line on its own
+    with tokenizer.count_batch. A line that crosses a range boundary is cut
+    there with tokenizer.cut, so no piece is larger than its share even if
+    a single line is; first_line and last_line then number the lines the
+    piece has any part of. first_line is None for an empty piece.
+    """
+    lines = text.splitlines(keepends=True)
+    counts = tokenizer.count_batch(lines)
+    total = sum(counts)
+
+    def piece_of(token):
+        return min(token * pieces // total, pieces - 1) if total else 0
+
+    selected = []
+    first = last = None
+    before = 0
+    for number, (line, count) in enumerate(zip(lines, counts, strict=True), 1):
+        first_piece = piece_of(before)
+        last_piece = piece_of(before + count - 1) if count else first_piece
+        if first_piece <= piece <= last_piece:
+            if first_piece != last_piece:
+                # The first token of piece k is the smallest t with t * pieces // total >= k
+                offsets = [-(-k * total // pieces) - before for k in range(first_piece + 1, last_piece + 1)]
+                line = tokenizer.cut(line, offsets)[piece - first_piece]
+            if first is None:
+                first = number
+            last = number
+            selected.append(line)
+        before += count
+    return first, last, ''.join(selected)
@@ -0,0 +1,45 @@
+import json
+import threading
+import time
+from typing import Optional
+from repo_registry import open_shared_db
+
+MAX_PART_PLANS = 32
+
+
+class PartPlans:
+    """
+    Part plans in a SQLite database shared by every worker, so a part
+    link works whichever worker the request reaches. A plan is stored as
+    JSON: the repo, the encoding and the parts. Only the most recently
+    saved plans are kept.
+    """
+
+    def __init__(self, db_path, max_plans=MAX_PART_PLANS):
+        self.db_path = db_path
+        self.max_plans = max_plans
+        self.lock = threading.Lock()
+        self.db = open_shared_db(db_path)
+        self.db['part_plans'].create({
+            'plan_id': str,
+            'plan': str,
+            'saved': int,
+        }, pk='plan_id', if_not_exists=True)
+        self.db['part_plans'].create_index(['saved'], if_not_exists=True)
+
+    def close(self):
+        self.db.close()
+
+    def save(self, plan_id, plan):
+        with self.lock, self.db.conn:
+            self.db.conn.execute("insert or replace into part_plans values (?, ?, ?)",
+                                 (plan_id, json.dumps(plan), time.time_ns()))
+            self.db.conn.execute(
+                "delete from part_plans where plan_id not in "
+                "(select plan_id from part_plans order by saved desc limit ?)",
+                (self.max_plans,))
+
+    def load(self, plan_id) -> Optional[dict]:
+        with self.lock:
+            row = self.db.conn.execute("select plan from part_plans where plan_id = ?", (plan_id,)).fetchone()
+        return json.loads(row[0]) if row else None
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional
+from sqlite_minutils.db import Database
+
+MAX_SESSIONS = 1000
+MAX_REPOS_PER_SESSION = 20
+BUSY_TIMEOUT_MS = 10_000
+TOUCH_SECONDS = 60
+
+
+def repo_id(path, revision=None):
+    """
+    Stable id of the repo at path, the same in every session. Revisions
+    read from one mirror share its path, so the revision is part of the id.
+    """
+    key = os.path.abspath(path) if revision is None else f"{os.path.abspath(path)}@{revision}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+def open_shared_db(db_path):
+    """
+    Open a database shared by every worker process: WAL mode lets readers
+    run alongside a writer, and writers wait for each other instead of
+    failing with 'database is locked'.
+    """
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    db = Database(db_path)
+    db.execute(f"pragma busy_timeout = {BUSY_TIMEOUT_MS}")
+    db.enable_wal()
+    return db
+
+
+@dataclass
+class RepoEntry:
+    """
+    A repo open in one session. selection is the selection delta last
+    posted from the repo's page, with paths in place of node ids (None
+    until the user changes anything), and excluded the file types excluded
+    with it, so reopening the page restores both.
+    """
+    repo: object
+    selection: Optional[list] = None
+    excluded: tuple = ()
+
+    @property
+    def id(self):
+        return repo_id(self.repo.path, self.repo.revision)
+
+
+class RepoRegistry:
+    """
+    The repos each session has open, keyed by session id and repo id, in a
+    SQLite database shared by every worker, so any worker can serve any
+    session. Only the most recently used sessions, and repos per session,
+    are kept. repo_type rebuilds repos with its from_json.
+
+    Repos on disk are shared between sessions, so locks are per repo, not
+    per entry: whatever scans, refreshes or deletes a repo in this process
+    holds its lock.
+
+    Reading an entry marks it used only when it was last marked more than
+    touch_seconds ago, so most requests only read the database.
+    """
+
+    def __init__(self, db_path, repo_type, max_sessions=MAX_SESSIONS, max_repos=MAX_REPOS_PER_SESSION,
+                 touch_seconds=TOUCH_SECONDS):
+        self.repo_type = repo_type
+        self.touch_ns = int(touch_seconds * 1e9)
+        self.max_sessions = max_sessions
+        self.max_repos = max_repos
+        self.lock = threading.Lock()
+        self.repo_locks = {}
+        self.db = open_shared_db(db_path)
+        self.db['repos'].create({
+            'session_id': str,
+            'repo_id': str,
+            'repo': str,
+            'selection': str,
+            'excluded': str,
+            'used': int,
+        }, pk=('session_id', 'repo_id'), if_not_exists=True)
+        self.db['repos'].create_index(['session_id', 'used'], if_not_exists=True)
+
+    def close(self):
+        self.db.close()
+
+    def open(self, session_id, repo) -> RepoEntry:
+        """Open repo in a session, replacing any earlier entry for the same path."""
+        entry = RepoEntry(repo)
+        with self.lock, self.db.conn:
+            self.db.conn.execute("insert or replace into repos values (?, ?, ?, null, '[]', ?)",
+                                 (session_id, entry.id, repo.to_json(), time.time_ns()))
+            self.db.conn.execute(
+                "delete from repos where session_id = ? and repo_id not in "
+                "(select repo_id from repos where session_id = ? order by used desc limit ?)",
+                (session_id, session_id, self.max_repos))
+            self.db.conn.execute(
+                "delete from repos where session_id not in "
+                "(select session_id from repos group by session_id order by max(used) desc limit ?)",
+                (self.max_sessions,))
+        return entry
+
+    def get(self, session_id, repo_id=None) -> Optional[RepoEntry]:
+        """A session's entry for repo_id, or its most recently used one."""
+        query = "select repo_id, used, repo, selection, excluded from repos where session_id = ?"
+        args = (session_id,)
+        if repo_id is not None:
+            query, args = query + " and repo_id = ?", (session_id, repo_id)
+        with self.lock:
+            row = self.db.conn.execute(query + " order by used desc limit 1", args).fetchone()
+            if row is None:
+                return None
+            now = time.time_ns()
+            if now - row[1] > self.touch_ns:
+                with self.db.conn:
+                    self.db.conn.execute("update repos set used = ? where session_id = ? and repo_id = ?",
+                                         (now, session_id, row[0]))
+        return self.entry(*row[2:])
+
+    def entries(self, session_id):
+        """A session's entries, most recently used first."""
+        with self.lock:
+            rows = self.db.conn.execute(
+                "select repo, selection, excluded from repos where session_id = ? order by used desc",
+                (session_id,)).fetchall()
+        return [self.entry(*row) for row in rows]
+
+    def remember(self, session_id, repo_id, selection, excluded):
+        """Keep the selection last posted from a repo's page."""
+        with self.lock, self.db.conn:
+            self.db.conn.execute(
+                "update repos set selection = ?, excluded = ? where session_id = ? and repo_id = ?",
+                (json.dumps(list(selection)), json.dumps(list(excluded)), session_id, repo_id))
+
+    def remove(self, repo_id):
+        """Close a repo in every session, as when its files are deleted."""
+        with self.lock, self.db.conn:
+            self.db.conn.execute("delete from repos where repo_id = ?", (repo_id,))
+
+    @contextmanager
+    def repo_lock(self, repo_id):
+        """
+        Hold repo_id's lock. A lock is kept only while some thread holds or
+        waits for it, so locks do not pile up for every repo ever opened.
+        """
+        with self.lock:
+            entry = self.repo_locks.get(repo_id)
+            if entry is None:
+                entry = self.repo_locks[repo_id] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.repo_locks[repo_id]
+
+    def entry(self, repo, selection, excluded):
+        return RepoEntry(self.repo_type.from_json(repo), None if selection is None else json.loads(selection),
+                         tuple(json.loads(excluded)))
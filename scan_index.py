@@ -0,0 +1,190 @@
+import os
+import time
+from sqlite_minutils.db import Database
+
+TOKEN_CACHE_ENTRIES = int(os.environ.get('TOKEN_CACHE_ENTRIES', 1_000_000))
+
+
+class ScanIndex:
+    """
+    Persistent per-repo cache of scan results. Rows are keyed by the file's
+    path relative to the repo root and the token encoding, and are only
+    trusted while the file's mtime, size and inode are unchanged.
+    """
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db = Database(db_path)
+        self.db['files'].create({
+            'path': str,
+            'encoding': str,
+            'mtime_ns': int,
+            'size': int,
+            'inode': int,
+            'ext': str,
+            'tokens': int,
+            'skipped': int,
+        }, pk=('path', 'encoding'), if_not_exists=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def load(self, encoding):
+        rows = self.db.execute(
+            "select path, mtime_ns, size, inode, ext, tokens, skipped from files "
+            "where encoding = ?", (encoding,))
+        return {row[0]: row[1:] for row in rows}
+
+    def update(self, changed, removed):
+        """
+        Write rows for re-scanned files and drop rows for files that no
+        longer exist, in a single transaction.
+        """
+        if not changed and not removed:
+            return
+        with self.db.conn:
+            self.db.conn.executemany(
+                "insert or replace into files values (?, ?, ?, ?, ?, ?, ?, ?)", changed)
+            self.db.conn.executemany(
+                "delete from files where path = ?", [(path,) for path in removed])
+
+
+class TokenCache:
+    """
+    Token counts keyed by content hash and encoding, shared by every repo,
+    fork and revision. The hash is the git blob SHA of the content, for
+    files read from the object database and from a working tree alike, so
+    rows need no validation. Skipped (binary or undecodable) content is
+    cached as well. Once the cache holds more than max_entries rows, the
+    least recently used are evicted. Triggers keep the row count in
+    blob_count, so checking it does not scan the table.
+    """
+
+    def __init__(self, db_path, max_entries=TOKEN_CACHE_ENTRIES):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.max_entries = max_entries
+        self.db = Database(db_path)
+        self.db['blobs'].create({
+            'sha': str,
+            'encoding': str,
+            'tokens': int,
+            'skipped': int,
+            'used': int,
+        }, pk=('sha', 'encoding'), if_not_exists=True)
+        self.db['blobs'].create_index(['used'], if_not_exists=True)
+        # A replaced row fires the delete trigger too, as recursive triggers are on
+        with self.db.conn:
+            self.db.conn.executescript("""
+                create table if not exists blob_count (n integer not null);
+                insert into blob_count select count(*) from blobs where not exists (select 1 from blob_count);
+                create trigger if not exists blobs_inserted after insert on blobs
+                    begin update blob_count set n = n + 1; end;
+                create trigger if not exists blobs_deleted after delete on blobs
+                    begin update blob_count set n = n - 1; end;
+            """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def load(self, encoding, shas):
+        """
+        Return {sha: tokens, or None for skipped content} for the shas that
+        are cached, marking them as recently used.
+        """
+        found = {}
+        shas = list(shas)
+        now = time.time_ns()
+        with self.db.conn:
+            for start in range(0, len(shas), 500):
+                chunk = shas[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.db.execute(
+                    f"select sha, tokens, skipped from blobs where encoding = ? and sha in ({placeholders})",
+                    (encoding, *chunk)).fetchall()
+                found.update((sha, None if skipped else tokens) for sha, tokens, skipped in rows)
+                if rows:
+                    self.db.conn.execute(
+                        f"update blobs set used = ? where encoding = ? and sha in ({placeholders})",
+                        (now, encoding, *chunk))
+        return found
+
+    def update(self, encoding, counts):
+        """Store {sha: tokens, or None for skipped content} and evict down to max_entries."""
+        if not counts:
+            return
+        now = time.time_ns()
+        with self.db.conn:
+            self.db.conn.executemany(
+                "insert or replace into blobs values (?, ?, ?, ?, ?)",
+                [(sha, encoding, tokens or 0, tokens is None, now) for sha, tokens in counts.items()])
+            excess = self.db.execute("select n from blob_count").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.db.conn.execute(
+                    "delete from blobs where rowid in (select rowid from blobs order by used limit ?)", (excess,))
+
+
+def stat_key(st):
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class Calibration:
+    """
+    Per-extension tokens-per-byte and skip rates, learned from exact scans
+    and shared across repos. Each repo's contribution is replaced on every
+    exact scan so rescans do not skew the totals.
+    """
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db = Database(db_path)
+        self.db['ratios'].create({
+            'source': str,
+            'encoding': str,
+            'ext': str,
+            'files': int,
+            'bytes': int,
+            'tokens': int,
+            'skipped': int,
+        }, pk=('source', 'encoding', 'ext'), if_not_exists=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def learn(self, source, encoding, stats):
+        with self.db.conn:
+            self.db.conn.execute(
+                "delete from ratios where source = ? and encoding = ?", (source, encoding))
+            self.db.conn.executemany(
+                "insert into ratios values (?, ?, ?, ?, ?, ?, ?)",
+                [(source, encoding, ext, *ext_stats) for ext, ext_stats in stats.items()])
+
+    def ratios(self, encoding):
+        """
+        Return {ext: (tokens_per_byte, skip_rate)} for an encoding. The
+        ratio is None for extensions that never had readable content.
+        """
+        rows = self.db.execute(
+            "select ext, sum(files), sum(bytes), sum(tokens), sum(skipped) from ratios "
+            "where encoding = ? group by ext", (encoding,))
+        return {
+            ext: (tokens / size if size else None, skipped / files)
+            for ext, files, size, tokens, skipped in rows
+        }
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+from typing import Optional
+from repo_registry import open_shared_db
+
+LEASE_SECONDS = 30
+POLL_SECONDS = 0.1
+
+
+class Lease:
+    """
+    A held lease on a key. It is renewed in the background until released,
+    so it outlives a long scan; if the worker dies, it expires on its own.
+    The renewing thread uses a connection of its own, closed on release.
+    """
+
+    def __init__(self, scans, key, owner):
+        self.scans = scans
+        self.key = key
+        self.owner = owner
+        self.released = threading.Event()
+        self.renewer = threading.Thread(target=self.renew, daemon=True)
+        self.renewer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def renew(self):
+        db = None
+        try:
+            while not self.released.wait(self.scans.lease_seconds / 3):
+                db = db or open_shared_db(self.scans.db_path)
+                with db.conn:
+                    db.conn.execute("update leases set expires = ? where key = ? and owner = ?",
+                                    (time.time() + self.scans.lease_seconds, self.key, self.owner))
+        finally:
+            if db is not None:
+                db.close()
+
+    def release(self):
+        if not self.released.is_set():
+            self.released.set()
+            self.scans.execute("delete from leases where key = ? and owner = ?", (self.key, self.owner))
+
+
+class SharedScans:
+    """
+    Scan results and scan leases in SQLite databases shared by every
+    worker process. Whichever worker scans a repo stores the result, and
+    the others load it instead of scanning themselves, so the file ids in
+    a page stay valid whichever worker a later request reaches. A lease on
+    a key makes sure one worker scans it at a time.
+
+    Scans are large, so they live in a database of their own (scans_path,
+    by default next to db_path), and writing one never holds up the small
+    lease and registry writes in db_path. A scan's version is the hash of
+    its pickled bytes: storing an unchanged scan keeps its version and
+    does not write it again.
+
+    Each thread has its own connections, so reading a version or a lease
+    does not wait for another thread writing a large scan.
+    """
+
+    def __init__(self, db_path, scans_path=None, lease_seconds=LEASE_SECONDS):
+        self.db_path = db_path
+        self.scans_path = scans_path or '.scans'.join(os.path.splitext(db_path))
+        self.lease_seconds = lease_seconds
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+        scans_db = self.scans_db()
+        scans_db['scans'].create({
+            'key': str,
+            'path': str,
+            'version': str,
+            'stored': float,
+        }, pk='key', if_not_exists=True)
+        scans_db['scans'].create_index(['path'], if_not_exists=True)
+        scans_db['scan_data'].create({
+            'version': str,
+            'scan': bytes,
+        }, pk='version', if_not_exists=True)
+        db = self.db()
+        db['leases'].create({
+            'key': str,
+            'owner': str,
+            'expires': float,
+        }, pk='key', if_not_exists=True)
+
+    def db(self):
+        return self.connection('db', self.db_path)
+
+    def scans_db(self):
+        return self.connection('scans_db', self.scans_path)
+
+    def connection(self, name, path):
+        db = getattr(self.local, name, None)
+        if db is None:
+            db = open_shared_db(path)
+            setattr(self.local, name, db)
+            with self.connections_lock:
+                self.connections.append(db)
+        return db
+
+    def close(self):
+        with self.connections_lock:
+            for db in self.connections:
+                db.close()
+            self.connections = []
+        self.local = threading.local()
+
+    def execute(self, sql, args=()):
+        conn = self.db().conn
+        with conn:
+            return conn.execute(sql, args)
+
+    def execute_scans(self, sql, args=()):
+        conn = self.scans_db().conn
+        with conn:
+            return conn.execute(sql, args)
+
+    def version(self, key) -> Optional[str]:
+        row = self.execute_scans("select version from scans where key = ?", (json.dumps(key),)).fetchone()
+        return row[0] if row else None
+
+    def stored(self, key) -> Optional[float]:
+        """When a scan of key was last stored, changed or not."""
+        row = self.execute_scans("select stored from scans where key = ?", (json.dumps(key),)).fetchone()
+        return row[0] if row else None
+
+    def load(self, key):
+        """Return (version, scan) as last stored for key, or None."""
+        row = self.execute_scans(
+            "select scans.version, scan from scans join scan_data using (version) where key = ?",
+            (json.dumps(key),)).fetchone()
+        return (row[0], pickle.loads(row[1])) if row else None
+
+    def store(self, key, path, scan) -> str:
+        """Store scan as key's latest and return its version."""
+        data = pickle.dumps(scan, pickle.HIGHEST_PROTOCOL)
+        version = hashlib.sha1(data).hexdigest()
+        conn = self.scans_db().conn
+        with conn:
+            if conn.execute("select 1 from scan_data where version = ?", (version,)).fetchone() is None:
+                conn.execute("insert into scan_data values (?, ?)", (version, data))
+            conn.execute("insert or replace into scans values (?, ?, ?, ?)",
+                         (json.dumps(key), path, version, time.time()))
+            conn.execute("delete from scan_data where version not in (select version from scans)")
+        return version
+
+    def forget(self, path):
+        """Drop the stored scans of the repo at path."""
+        conn = self.scans_db().conn
+        with conn:
+            conn.execute("delete from scans where path = ?", (path,))
+            conn.execute("delete from scan_data where version not in (select version from scans)")
+
+    def acquire(self, key) -> Optional[Lease]:
+        """Take key's lease unless another holder's lease is still live."""
+        owner = uuid.uuid4().hex
+        now = time.time()
+        self.execute(
+            "insert into leases values (?, ?, ?) on conflict(key) do update "
+            "set owner = excluded.owner, expires = excluded.expires where leases.expires < ?",
+            (json.dumps(key), owner, now + self.lease_seconds, now))
+        row = self.execute("select owner from leases where key = ?", (json.dumps(key),)).fetchone()
+        return Lease(self, json.dumps(key), owner) if row and row[0] == owner else None
+
+    def held(self, key) -> bool:
+        row = self.execute("select 1 from leases where key = ? and expires >= ?",
+                           (json.dumps(key), time.time())).fetchone()
+        return row is not None
+
+    def hold(self, key) -> Lease:
+        """Wait for key's lease and take it."""
+        while True:
+            lease = self.acquire(key)
+            if lease is not None:
+                return lease
+            time.sleep(POLL_SECONDS)
+
+    def scan_once(self, key, path, scan, fresh=False):
+        """
+        Return (version, result) for key: the stored result, unless fresh
+        is set, in which case scan() is called while holding key's lease.
+        When another worker holds the lease, wait for it and return what it
+        stores instead of scanning as well; if it stores nothing (it failed
+        or died), scan here.
+        """
+        before = self.stored(key)
+        if not fresh and before is not None:
+            stored = self.load(key)
+            if stored is not None:
+                return stored
+        while True:
+            lease = self.acquire(key)
+            if lease is not None:
+                with lease:
+                    result = scan()
+                    return self.store(key, path, result), result
+            while self.held(key):
+                time.sleep(POLL_SECONDS)
+            if self.stored(key) != before:
+                stored = self.load(key)
+                if stored is not None:
+                    return stored
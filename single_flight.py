@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import partial
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time and keeps the latest result.
+    Callers asking for a key while its call is in flight get that call's
+    future instead of starting another, so N concurrent requests cost one
+    call. Later callers get the kept result, unless they ask for a fresh
+    call. Failed calls are not kept, and with max_results only that many
+    results are kept, least recently used first out.
+    """
+
+    def __init__(self, max_results=None):
+        self.lock = threading.Lock()
+        self.max_results = max_results
+        self.calls = {}
+        self.results = OrderedDict()
+
+    def submit(self, key, executor, func, *args, fresh=False, **kwargs) -> Future:
+        """
+        Return a future for key's result: the kept result unless fresh is
+        set, else the call in flight, else a new call of func on executor.
+        """
+        with self.lock:
+            if not fresh and key in self.results:
+                self.results.move_to_end(key)
+                future = Future()
+                future.set_result(self.results[key])
+                return future
+            future = self.calls.get(key)
+            if future is not None:
+                return future
+            future = self.calls[key] = executor.submit(func, *args, **kwargs)
+        # Outside the lock: the callback runs at once if the call already finished
+        future.add_done_callback(partial(self.finished, key))
+        return future
+
+    def finished(self, key, future):
+        with self.lock:
+            if self.calls.get(key) is not future:
+                return  # forgotten while in flight, so its result is stale
+            del self.calls[key]
+            if future.exception() is None:
+                self.keep(key, future.result())
+
+    def get(self, key):
+        with self.lock:
+            if key in self.results:
+                self.results.move_to_end(key)
+            return self.results.get(key)
+
+    def set(self, key, result):
+        with self.lock:
+            self.keep(key, result)
+
+    def keep(self, key, result):
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while self.max_results is not None and len(self.results) > self.max_results:
+            self.results.popitem(last=False)
+
+    def forget(self, matches):
+        """
+        Drop the results and calls in flight of every key for which
+        matches(key) is true. A forgotten call still finishes, but its
+        result is not kept and later callers start a new one.
+        """
+        with self.lock:
+            for key in [key for key in self.results if matches(key)]:
+                del self.results[key]
+            for key in [key for key in self.calls if matches(key)]:
+                del self.calls[key]
@@ -2,7 +2,15 @@ import pytest
 from starlette.testclient import TestClient
 from fasthtml.common import Li, Checkbox, Button, Ul
 from app import app, SUBDIRECTORY, Repo, get_current_repo
+from clone_jobs import checkout_path
+from repo_registry import repo_id
+from part_plans import PartPlans
+import app as app_module
+from utils import RepoScan, count_tokens
 import os
+import gzip
+import re
+import json
 import threading
 import time
 import requests
@@ -18,10 +26,12 @@ PORT = 5001
 
 
 @pytest.fixture(scope="session", autouse=True)
-def server(request):
+def server(request, tmp_path_factory):
     print("Starting server...")
+    state = tmp_path_factory.mktemp("server_state")
     process = subprocess.Popen(
         ["poetry", "run", "python", "app.py"],
+        env={**os.environ, 'STATE_PATH': str(state / "state.db"), 'SCANS_PATH': str(state / "scans.db")},
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         text=True,
@@ -88,7 +98,6 @@ def mock_repo(tmp_path):
 
 @pytest.fixture
 def loaded_repo_page(page, mock_repo):
-    app.state.current_repo = None  # Reset the current repo
     page.goto("http://localhost:5001")
     page.wait_for_load_state("networkidle")
     page.screenshot(path="debug_screenshot1.png")
@@ -118,69 +127,14 @@ def mock_repo_structure(mocker):
     }
     mock_skipped_files = ['binary_file']
 
-    def mock_get_file_types(repo_path):
-        return mock_file_types, mock_file_data, mock_skipped_files
-
-    mocker.patch('app.get_file_types', side_effect=mock_get_file_types)
-    mocker.patch('app.get_directory_structure', return_value={
-        'type': 'directory',
-        'name': 'test_repo',
-        'path': '/path/to/test_repo',
-        'children': [
-            {
-                'type': 'file',
-                'name': 'file1.py',
-                'path': '/path/to/test_repo/file1.py',
-                'size': 100,
-                'tokens': 50
-            },
-            {
-                'type': 'file',
-                'name': 'file2.txt',
-                'path': '/path/to/test_repo/file2.txt',
-                'size': 200,
-                'tokens': 100
-            },
-            {
-                'type': 'directory',
-                'name': 'subdir',
-                'path': '/path/to/test_repo/subdir',
-                'children': [
-                    {
-                        'type': 'file',
-                        'name': 'file3.js',
-                        'path': '/path/to/test_repo/subdir/file3.js',
-                        'size': 150,
-                        'tokens': 75
-                    }
-                ]
-            },
-            {
-                'type': 'file',
-                'name': '.gitignore',
-                'path': '/path/to/test_repo/.gitignore',
-                'size': 20,
-                'tokens': 10
-            },
-            {
-                'type': 'file',
-                'name': 'LICENSE',
-                'path': '/path/to/test_repo/LICENSE',
-                'size': 50,
-                'tokens': 25
-            },
-            {
-                'type': 'file',
-                'name': 'binary_file',
-                'path': '/path/to/test_repo/binary_file',
-                'skipped': True
-            }
-        ]
-    })
+    def mock_scan_repo(repo_path, **kwargs):
+        return RepoScan(repo_path, mock_file_types, mock_file_data, mock_skipped_files, ['subdir'])
+
+    mocker.patch('app.scan_repo', side_effect=mock_scan_repo)
 
 @pytest.fixture
 def mock_current_repo(mocker, mock_repo):
-    def mock_get_current_repo(request):
+    def mock_get_current_repo(request, repo_id=None):
         return mock_repo
     mocker.patch('app.get_current_repo', side_effect=mock_get_current_repo)
     return mock_repo
@@ -188,7 +142,6 @@ def mock_current_repo(mocker, mock_repo):
 @pytest.fixture
 def client(mock_repo_structure, mock_current_repo):
     with TestClient(app, follow_redirects=True) as client:
-        app.state.current_repo = mock_current_repo
         yield client
 
 def test_home_route_no_repo(client, mocker):
@@ -208,13 +161,37 @@ def test_initial_totals_calculation(client, mock_current_repo):
     assert response.status_code == 200
     assert 'Total: 5 files, 520 bytes, 260 tokens' in response.text
     
-def test_clone_route(client, mocker):
-    mocker.patch('subprocess.run')
+def test_clone_route(client, mocker, opened_repo):
+    mocker.patch('app.git_clone', return_value=0)
     mocker.patch('os.path.exists', return_value=False)
     response = client.post('/clone', data={'url': 'https://github.com/user/repo.git'})
     assert response.status_code == 200
-    assert app.state.current_repo is not None
-    assert app.state.current_repo.name == 'repo'
+    assert response.url.params['repo_id'] == repo_id(checkout_path(SUBDIRECTORY, 'https://github.com/user/repo.git', 'repo'))
+    assert opened_repo(response.url.params['repo_id']).name == 'repo'
+
+def test_clone_route_passes_options(client, mocker, wait_for):
+    git_clone = mocker.patch('app.git_clone', return_value=0)
+    mocker.patch('os.path.exists', return_value=False)
+    client.post('/clone', data={'url': 'https://github.com/user/opts.git', 'depth': '1', 'blob_limit': '1m',
+                                'sparse_paths': 'src/\n\n*.md\n', 'revision': 'v2'})
+    wait_for(lambda: git_clone.called)
+    options = git_clone.call_args.args[3]
+    assert (options.depth, options.blob_limit, options.sparse_paths, options.revision) == (1, '1m', ('src/', '*.md'), 'v2')
+
+def test_clone_route_rejects_bad_options(client, mocker):
+    git_clone = mocker.patch('app.git_clone', return_value=0)
+    response = client.post('/clone', data={'url': 'https://github.com/user/opts.git', 'depth': '0'})
+    assert 'Invalid clone depth: 0' in response.text
+    assert not git_clone.called
+
+def test_default_clone_uses_mirror(client, mocker, opened_repo):
+    mocker.patch('app.git_clone', return_value=0)
+    mocker.patch('os.path.exists', return_value=False)
+    depth = re.search(r'<input[^>]*name="depth"[^>]*>', client.get('/clone').text).group(0)
+    assert 'value=' not in depth
+    response = client.post('/clone', data={'url': 'https://github.com/user/plain.git', 'depth': ''},
+                           follow_redirects=False)
+    assert opened_repo(response.headers['location'].split('repo_id=')[1]).mirror
 
 def test_update_totals_route(client, mock_current_repo):
     response = client.post('/update-totals', data={'selected_files': ['file1.py', 'subdir/file3.js'], 'file_types': ['.txt']})
@@ -229,25 +206,424 @@ def test_combine_route(client, mock_current_repo, mocker):
     assert '&gt;&gt;&gt; FILE: file1.py &lt;&lt;&lt;' in response.text
     assert 'file content' in response.text
 
+def test_combine_stream_route(client, mock_current_repo, mocker):
+    mocker.patch('builtins.open', mocker.mock_open(read_data="file content"))
+    mocker.patch('os.path.exists', return_value=True)
+    mocker.patch('os.path.isdir', side_effect=lambda path: path.endswith('subdir'))
+    response = client.post('/combine-stream', data={'selected_files': ['file1.py', 'subdir', 'subdir/file3.js', 'file2.txt'], 'file_types': ['.txt']})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert response.text == ">>> FILE: file1.py <<<\nfile content\n\n>>> FILE: subdir/file3.js <<<\nfile content\n\n"
+
+def test_download_route_jsonl_gzip(client, mock_current_repo, mocker):
+    count_tokens('warm up the tokenizer before open is mocked')
+    mocker.patch('builtins.open', mocker.mock_open(read_data="file content"))
+    mocker.patch('os.path.exists', return_value=True)
+    response = client.post('/download', data={'selected_files': ['file1.py', 'extra.py'], 'format': 'jsonl', 'compression': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/gzip'
+    assert 'filename="test_repo.jsonl.gz"' in response.headers['content-disposition']
+    records = [json.loads(line) for line in gzip.decompress(response.content).splitlines()]
+    assert records[0] == {'path': 'file1.py', 'tokens': 50, 'content': 'file content'}
+    assert records[1]['tokens'] == 2
+
+def test_scan_token_counter_counts_estimated_files():
+    file_data = {'exact.py': {'count': 1, 'size': 100, 'tokens': 50},
+                 'guessed.py': {'count': 1, 'size': 100, 'tokens': 1, 'estimated': True}}
+    scan = RepoScan('repo', {}, file_data, [], [])
+    count = app_module.scan_token_counter(scan, 'cl100k_base')
+    assert count('exact.py', "print('exact')") == 50
+    assert count('guessed.py', "print('guessed')") == count_tokens("print('guessed')", 'cl100k_base')
+
+def test_download_route_rejects_unknown_format(client, mock_current_repo):
+    response = client.post('/download', data={'selected_files': ['file1.py'], 'format': 'pdf'})
+    assert response.status_code == 400
+
+def test_combine_route_with_token_budget(client, mock_current_repo, mocker):
+    count_tokens('warm up the tokenizer before open is mocked')
+    mocker.patch('builtins.open', mocker.mock_open(read_data="file content"))
+    mocker.patch('os.path.exists', return_value=True)
+    response = client.post('/combine', data={
+        'selected_files': ['file1.py', 'file2.txt', 'subdir/file3.js'], 'max_tokens': '160', 'policy': 'smallest'})
+    assert response.status_code == 200
+    assert 'Packed 2 files, 142 of 160 tokens (smallest)' in response.text
+    assert 'Dropped 1 files' in response.text
+    assert 'file2.txt (108 tokens)' in response.text
+    assert 'FILE: file1.py' in response.text
+    assert 'FILE: subdir/file3.js' in response.text
+    assert 'FILE: file2.txt' not in response.text
+
+def test_combine_candidates_tokenize_estimated_files(tmp_path):
+    text = "def main():\n    return [index * 2 for index in range(10)]\n"
+    (tmp_path / 'guessed.py').write_text(text)
+    file_data = {'exact.py': {'count': 1, 'size': 10, 'tokens': 7},
+                 'guessed.py': {'count': 1, 'size': len(text), 'tokens': 1, 'estimated': True}}
+    scan = RepoScan(str(tmp_path), {}, file_data, [], [])
+    candidates = dict(app_module.combine_candidates(scan, ['exact.py', 'guessed.py'], [], 'cl100k_base'))
+    header = count_tokens(">>> FILE: guessed.py <<<\n\n\n", 'cl100k_base')
+    assert candidates['guessed.py'] == count_tokens(text, 'cl100k_base') + header
+    assert candidates['exact.py'] == 7 + count_tokens(">>> FILE: exact.py <<<\n\n\n", 'cl100k_base')
+
+def test_combine_route_plans_parts(client, mock_current_repo, mocker):
+    read_file = mocker.patch('export.read_file', return_value="line\n" * 10)
+    response = client.post('/combine', data={
+        'selected_files': ['file1.py', 'file2.txt', 'subdir/file3.js'], 'part_tokens': '100'})
+    assert response.status_code == 200
+    assert '4 parts of at most 100 tokens' in response.text
+    assert not read_file.called
+    plan_id = re.search(r'/parts/(\w+)/0"', response.text).group(1)
+    other_worker = PartPlans(app.state.part_plans.db_path)
+    try:
+        assert other_worker.load(plan_id)['encoding'] == mock_current_repo.encoding
+    finally:
+        other_worker.close()
+
+    response = client.get(f'/parts/{plan_id}/1')
+    assert response.text.startswith('>>> FILE: file2.txt (lines 1-5, piece 1/2) <<<\n')
+    response = client.get(f'/parts/{plan_id}/3?format=markdown&compression=gzip&download=1')
+    assert 'filename="test_repo.part4of4.md.gz"' in response.headers['content-disposition']
+    assert gzip.decompress(response.content).decode('utf-8').startswith('## subdir/file3.js')
+    assert [call.args[0] for call in read_file.call_args_list] == [
+        os.path.join(mock_current_repo.path, 'file2.txt'), os.path.join(mock_current_repo.path, 'subdir/file3.js')]
+
+def test_unknown_part(client, mock_current_repo):
+    assert client.get('/parts/missing/0').status_code == 404
+
+def test_combine_route_uses_cache(client, mock_current_repo, mocker):
+    read_file = mocker.patch('export.read_file', return_value="file content")
+    mocker.patch('os.path.exists', return_value=True)
+    data = {'selected_files': ['file1.py', 'file2.txt'], 'file_types': []}
+    response = client.post('/combine', data=data)
+    assert 'etag' not in response.headers
+    assert read_file.call_count == 2
+
+    response = client.post('/combine', data=data, headers={'If-None-Match': '*'})
+    assert response.status_code == 200 and 'FILE: file2.txt' in response.text
+    response = client.post('/download', data={**data, 'format': 'text'})
+    assert response.text.startswith('>>> FILE: file1.py <<<')
+    assert read_file.call_count == 2
+
+def test_download_route_uses_cache(client, mock_current_repo, mocker):
+    read_file = mocker.patch('export.read_file', return_value="file content")
+    mocker.patch('os.path.exists', return_value=True)
+    data = {'selected_files': ['file1.py'], 'format': 'xml', 'compression': 'gzip'}
+    first = client.post('/download', data=data)
+    second = client.post('/download', data=data, headers={'If-None-Match': '*'})
+    assert second.status_code == 200
+    assert first.content == second.content
+    assert read_file.call_count == 1
+
+def test_part_route_not_modified(client, mock_current_repo, mocker):
+    read_file = mocker.patch('export.read_file', return_value="line\n" * 10)
+    response = client.post('/combine', data={'selected_files': ['file1.py'], 'part_tokens': '100'})
+    plan_id = re.search(r'/parts/(\w+)/0"', response.text).group(1)
+    first = client.get(f'/parts/{plan_id}/0')
+    second = client.get(f'/parts/{plan_id}/0')
+    assert first.headers['etag'] == second.headers['etag']
+    response = client.get(f'/parts/{plan_id}/0', headers={'If-None-Match': first.headers['etag']})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert read_file.call_count == 1
+
+def test_clone_runs_as_background_job(client, mock_current_repo, mocker, wait_for):
+    clone_started = threading.Event()
+    release_clone = threading.Event()
+
+    def slow_clone(url, path, on_progress, options=None, mirror=None):
+        on_progress("Receiving objects:  45% (450/1000)")
+        clone_started.set()
+        release_clone.wait(10)
+        return 0
+
+    mocker.patch('app.git_clone', side_effect=slow_clone)
+    mocker.patch('os.path.exists', return_value=False)
+    client.get('/')
+    try:
+        response = client.post('/clone', data={'url': 'https://example.com/slow.git'}, follow_redirects=False)
+        assert response.status_code == 303
+        assert clone_started.wait(5)
+        job = next(reversed(app.state.clone_jobs.values()))
+        assert job.status == 'cloning'
+
+        start = time.monotonic()
+        response = client.post('/totals', data={'selection': 'd0'})
+        assert 'Total: 5 files, 520 bytes, 260 tokens' in response.text
+        assert time.monotonic() - start < 2
+
+        response = client.get(f'/clone-jobs/{job.id}')
+        assert 'Cloning: Receiving objects:  45% (450/1000)' in response.text
+        assert 'hx-trigger="every 1s"' in response.text
+    finally:
+        release_clone.set()
+    wait_for(job)
+    assert job.status == 'done'
+    response = client.get(f'/clone-jobs/{job.id}')
+    assert response.headers['HX-Refresh'] == 'true'
+
+def test_session_keeps_several_repos_open(client, mocker, wait_for):
+    mocker.patch('app.git_clone', return_value=0)
+    mocker.patch('os.path.exists', return_value=False)
+    mocker.patch('app.get_current_repo', side_effect=get_current_repo)
+    jobs = []
+    for name in ('first', 'second'):
+        client.post('/clone', data={'url': f'https://example.com/{name}.git'}, follow_redirects=False)
+        jobs.append(next(reversed(app.state.clone_jobs.values())))
+    for job in jobs:
+        wait_for(job)
+        assert job.status == 'done'
+    first, second = (repo_id(checkout_path(SUBDIRECTORY, f'https://example.com/{name}.git', name))
+                     for name in ('first', 'second'))
+
+    response = client.get('/')
+    assert 'Repository: second' in response.text
+    assert f'href="/?repo_id={first}"' in response.text
+
+    response = client.post('/totals', data={'repo_id': first, 'selection': 'd0', 'file_types': ['.txt']})
+    assert 'Total: 4 files, 320 bytes, 160 tokens' in response.text
+    response = client.get(f'/?repo_id={first}')
+    assert 'Repository: first' in response.text
+    assert 'Total: 4 files, 320 bytes, 160 tokens' in response.text
+    assert 'checked value=".txt"' in response.text
+    response = client.get(f'/?repo_id={second}')
+    assert 'Total: 5 files, 520 bytes, 260 tokens' in response.text
+
+    client.post('/unselect-all', data={'repo_id': second})
+    assert 'Total: 0 files, 0 bytes, 0 tokens' in client.get(f'/?repo_id={second}').text
+    assert 'Total: 4 files, 320 bytes, 160 tokens' in client.get(f'/?repo_id={first}').text
+
+def test_kept_selection_survives_rescan():
+    def make_scan(paths, directories=('src',)):
+        file_data = {path: {'count': 1, 'size': 10, 'tokens': 5} for path in paths}
+        return RepoScan('repo', {}, file_data, [], list(directories))
+    before = make_scan(['b.py', 'src/c.py', 'src/d.py'])
+    d_id = before.file_data.ids['src/d.py']
+    kept = app_module.selection_paths(before, f"d{before.directory_index['src']['id']} -f{d_id}")
+    assert kept == ['dsrc', '-fsrc/d.py']
+
+    after = make_scan(['a.py', 'b.py', 'src/c.py', 'src/d.py', 'src/e.py'])
+    mask = app_module.decode_selection(after, app_module.selection_ids(after, kept))
+    assert [after.file_data.paths[i] for i, selected in enumerate(mask) if selected] == ['src/c.py', 'src/e.py']
+    gone = make_scan(['b.py'], directories=())
+    assert app_module.selection_ids(gone, kept) == ''
+
+def test_home_shows_clone_job_until_indexed(client, mock_current_repo, mocker, wait_for):
+    mocker.patch('app.git_clone', return_value=128)
+    mocker.patch('os.path.exists', return_value=False)
+    job = app_module.start_clone_job('https://example.com/missing.git', mock_current_repo)
+    wait_for(job)
+    try:
+        response = client.get('/')
+        assert 'Clone failed: git clone exited with status 128' in response.text
+        assert 'File Type Exclusions' not in response.text
+        assert client.get('/clone-jobs/unknown').status_code == 404
+    finally:
+        del app.state.clone_jobs[job.id]
+
+def test_concurrent_page_loads_share_one_scan(client, mock_current_repo, mocker):
+    import asyncio
+    scan_repo = app_module.scan_repo
+    release = threading.Event()
+
+    def slow_scan(repo_path, **kwargs):
+        release.wait(5)
+        return scan_repo(repo_path, **kwargs)
+
+    counted = mocker.patch('app.scan_repo', side_effect=slow_scan)
+    encoding = mock_current_repo.encoding
+    app_module.forget_scans(mock_current_repo)
+
+    async def load_pages():
+        loads = [app_module.get_scan(mock_current_repo, encoding, rescan=True) for _ in range(4)]
+        posts = [app_module.get_scan(mock_current_repo, encoding) for _ in range(4)]
+        tasks = [asyncio.ensure_future(load) for load in loads + posts]
+        await asyncio.sleep(0.1)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    scans = asyncio.run(load_pages())
+    assert counted.call_count == 1
+    assert all(scan is scans[0] for scan in scans)
+    assert asyncio.run(app_module.get_scan(mock_current_repo, encoding)) is scans[0]
+    assert counted.call_count == 1
+
+def test_requests_use_scan_stored_by_another_worker(client, mock_current_repo):
+    from shared_scans import SharedScans
+    response = client.get('/')
+    assert 'Total: 5 files, 520 bytes, 260 tokens' in response.text
+
+    # Another worker rescans the repo after a file was deleted and serves the next page
+    other_worker = SharedScans(app.state.shared_scans.db_path, app.state.shared_scans.scans_path)
+    try:
+        key = app_module.scan_key(mock_current_repo, mock_current_repo.encoding)
+        scan = RepoScan(mock_current_repo.path, {}, {'file1.py': {'count': 1, 'size': 100, 'tokens': 50}}, [], [])
+        other_worker.store(key, mock_current_repo.path, scan)
+        response = client.post('/totals', data={'selection': 'd0'})
+        assert 'Total: 1 files, 100 bytes, 50 tokens' in response.text
+
+        lease = other_worker.acquire(('exact', mock_current_repo.path, mock_current_repo.encoding))
+        assert app_module.exact_scan_pending(mock_current_repo, mock_current_repo.encoding)
+        lease.release()
+        assert not app_module.exact_scan_pending(mock_current_repo, mock_current_repo.encoding)
+
+        with other_worker.acquire(('clone', mock_current_repo.path)):
+            response = client.get('/')
+            assert 'Another worker is cloning and indexing this repository' in response.text
+            assert 'Another worker' in client.get('/clone-status').text
+        assert client.get('/clone-status').headers['HX-Refresh'] == 'true'
+    finally:
+        other_worker.close()
+
+def test_refresh_route_fetches_and_rescans(client, mock_current_repo, mocker, wait_for):
+    refresh = mocker.patch('app.refresh_checkout', return_value=0)
+    mocker.patch('os.path.exists', return_value=True)
+    mock_current_repo.url = 'https://example.com/repo.git'
+    try:
+        response = client.post('/refresh', follow_redirects=False)
+        assert response.status_code == 303
+        job = next(reversed(app.state.clone_jobs.values()))
+        wait_for(job)
+        assert job.status == 'done', job.error
+        assert refresh.call_args.args[0] == mock_current_repo.path
+        assert refresh.call_args.kwargs['url'] == 'https://example.com/repo.git'
+    finally:
+        mock_current_repo.url = None
+        del app.state.clone_jobs[job.id]
+
+def test_clone_without_checkout_reads_object_database(client, mocker, tmp_path, opened_repo, wait_for):
+    origin = tmp_path / 'origin'
+    subprocess.run(['git', 'init', '-q', str(origin)], check=True)
+    (origin / 'main.py').write_text("print('main')\n")
+    (origin / 'notes.md').write_text("# notes\n")
+    subprocess.run(['git', '-C', str(origin), 'add', '.'], check=True)
+    subprocess.run(['git', '-C', str(origin), '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-qm', 'init'],
+                   check=True)
+    mocker.patch('app.MIRROR_SUBDIRECTORY', str(tmp_path / 'mirrors'))
+    mocker.patch('app.get_current_repo', side_effect=get_current_repo)
+
+    response = client.post('/clone', data={'url': f"file://{origin}", 'no_checkout': '1'}, follow_redirects=False)
+    repo = opened_repo(response.headers['location'].split('repo_id=')[1])
+    job = app_module.clone_job_for(repo)
+    try:
+        wait_for(job)
+        assert job.status == 'done', job.error
+        assert repo.revision == 'HEAD' and repo.path.startswith(str(tmp_path / 'mirrors'))
+        assert not os.path.exists(checkout_path(SUBDIRECTORY, f"file://{origin}", 'origin'))
+
+        response = client.get('/')
+        assert 'main.py' in response.text and 'notes.md' in response.text
+        response = client.post('/combine', data={'selected_files': ['main.py', 'notes.md'], 'file_types': ['.md']})
+        assert "print(&#x27;main&#x27;)" in response.text
+        assert 'notes' not in response.text
+    finally:
+        del app.state.clone_jobs[job.id]
+        app_module.close_reader(repo)
+        app_module.forget_scans(repo)
+
+def test_upload_archive_scans_without_extracting(client, mocker, tmp_path, opened_repo, wait_for):
+    import zipfile
+    archive_path = tmp_path / 'upload.zip'
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        archive.writestr('project/main.py', "print('main')\n")
+        archive.writestr('project/docs/notes.md', "# notes\n")
+    mocker.patch('app.ARCHIVE_SUBDIRECTORY', str(tmp_path / 'archives'))
+    mocker.patch('app.get_current_repo', side_effect=get_current_repo)
+
+    response = client.post('/upload', files={'archive': ('project.rar', b'not an archive')})
+    assert 'Unsupported archive type: project.rar' in response.text
+
+    with open(archive_path, 'rb') as f:
+        response = client.post('/upload', files={'archive': ('project.zip', f)}, follow_redirects=False)
+    repo = opened_repo(response.headers['location'].split('repo_id=')[1])
+    job = app_module.clone_job_for(repo)
+    try:
+        wait_for(job)
+        assert job.status == 'done', job.error
+        assert repo.archive and repo.name == 'project'
+        assert os.listdir(tmp_path / 'archives') == [os.path.basename(repo.path)]
+        assert repo.path.endswith('.zip') and 'project' not in repo.path
+
+        response = client.get('/')
+        assert 'main.py' in response.text and 'notes.md' in response.text
+        response = client.post('/combine', data={'selected_files': ['main.py', 'docs/notes.md'], 'file_types': []})
+        assert '&gt;&gt;&gt; FILE: docs/notes.md &lt;&lt;&lt;' in response.text
+        assert '# notes' in response.text
+    finally:
+        del app.state.clone_jobs[job.id]
+        app_module.close_reader(repo)
+        app_module.forget_scans(repo)
+
+def test_uploads_are_stored_by_content(client, mocker, tmp_path, opened_repo, wait_for):
+    import zipfile, io
+    archives = tmp_path / 'archives'
+    mocker.patch('app.ARCHIVE_SUBDIRECTORY', str(archives))
+    bystander = tmp_path / 'repo.zip'
+    bystander.write_bytes(b'keep me')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('main.py', "print('main')\n")
+
+    paths = []
+    for name in ('my repo.zip', '$(touch pwned).zip', 'other.zip'):
+        response = client.post('/upload', files={'archive': (name, buffer.getvalue())}, follow_redirects=False)
+        paths.append(opened_repo(response.headers['location'].split('repo_id=')[1]).path)
+    assert len(set(paths)) == 1 and os.listdir(archives) == [os.path.basename(paths[0])]
+    for job in list(app.state.clone_jobs.values()):
+        wait_for(job)
+
+    repo = Repo(name='my repo', path=paths[0], archive=True)
+    app_module.remove_repo_files(repo)
+    assert os.listdir(archives) == []
+    assert bystander.read_bytes() == b'keep me'
+    assert not os.path.exists('pwned')
+
+def test_upload_size_limits(client, mocker, tmp_path, opened_repo, wait_for):
+    import zipfile, io
+    archives = tmp_path / 'archives'
+    mocker.patch('app.ARCHIVE_SUBDIRECTORY', str(archives))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('main.py', 'x' * 10_000)
+
+    mocker.patch('app.MAX_ARCHIVE_BYTES', 100)
+    response = client.post('/upload', files={'archive': ('big.zip', buffer.getvalue())})
+    assert 'Archives larger than 100 bytes are not accepted' in response.text
+    assert os.listdir(archives) == []
+    mocker.patch('app.UPLOAD_FORM_OVERHEAD', 0)
+    response = client.post('/upload', files={'archive': ('big.zip', buffer.getvalue())})
+    assert 'Archives larger than 100 bytes are not accepted' in response.text
+
+    mocker.patch('app.MAX_ARCHIVE_BYTES', 1 << 20)
+    mocker.patch('app.MAX_ARCHIVE_MEMBER_BYTES', 1000)
+    response = client.post('/upload', files={'archive': ('big.zip', buffer.getvalue())}, follow_redirects=False)
+    repo = opened_repo(response.headers['location'].split('repo_id=')[1])
+    job = app_module.clone_job_for(repo)
+    try:
+        wait_for(job)
+        assert job.status == 'failed'
+        assert 'Archive expands to more than 1000 bytes at main.py' in job.error
+    finally:
+        del app.state.clone_jobs[job.id]
+        app_module.remove_repo_files(repo)
+
 def test_select_all_route(client, mock_current_repo):
     response = client.post('/select-all')
     assert response.status_code == 200
-    assert 'checked' in response.text
-    assert 'file1.py' in response.text
-    assert 'file2.txt' in response.text
-    assert 'file3.js' in response.text
+    assert 'Total: 5 files, 520 bytes, 260 tokens' in response.text
 
-def test_unselect_all_route(client, mock_current_repo):
-    response = client.post('/unselect-all')
+def test_unselect_all_route(client, mock_current_repo, mocker):
+    remember = mocker.spy(app.state.repos, 'remember')
+    response = client.post('/unselect-all', data={'file_types': ['.txt']})
     assert response.status_code == 200
-    assert 'checked' not in response.text
+    assert 'Total: 0 files, 0 bytes, 0 tokens' in response.text
+    assert remember.call_args.args[2:] == ([], ['.txt'])
 
-def test_delete_route(client, mock_current_repo, mocker):
-    mocker.patch('os.path.exists', return_value=True)
-    mocker.patch('subprocess.run')
-    response = client.post('/delete')
+def test_delete_route(client, mock_current_repo, mocker, opened_repo):
+    mocker.patch('os.path.isdir', return_value=True)
+    rmtree = mocker.patch('shutil.rmtree')
+    response = client.post('/delete', data={'repo_id': repo_id(mock_current_repo.path)})
     assert response.status_code == 200
-    assert app.state.current_repo is None
+    rmtree.assert_called_once_with(mock_current_repo.path)
+    assert opened_repo(repo_id(mock_current_repo.path)) is None
 
 def test_dotfile_in_directory_structure(client, mock_current_repo):
     response = client.get('/')
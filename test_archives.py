@@ -0,0 +1,80 @@
+import io
+import os
+import tarfile
+import zipfile
+import pytest
+import archives
+from archives import ArchiveReader, ArchiveSource, ArchiveTooLarge, archive_suffix, iter_members, member_prefix
+
+FILES = {'repo-main/a.py': b"print('a')\r\n", 'repo-main/src/b.txt': b"bee", 'repo-main/img.bin': b'\x00\x01'}
+
+def make_tar(path, files=FILES):
+    with tarfile.open(path, 'w:gz') as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return str(path)
+
+def make_zip(path, files=FILES):
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('repo-main/', b'')
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return str(path)
+
+def test_archive_suffix():
+    assert archive_suffix('Repo.TAR.GZ') == '.tar.gz'
+    assert archive_suffix('repo.tgz') == '.tgz'
+    assert archive_suffix('repo.zip') == '.zip'
+    assert archive_suffix('repo.rar') is None
+
+@pytest.mark.parametrize('make', [make_tar, make_zip])
+def test_iter_members(tmp_path, make):
+    path = make(tmp_path / ('repo.tar.gz' if make is make_tar else 'repo.zip'))
+    assert dict(iter_members(path)) == FILES
+
+def test_iter_members_zstd(tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    tar_path = make_tar(tmp_path / 'repo.tar.gz')
+    with tarfile.open(tar_path) as source, tarfile.open(tmp_path / 'repo.tar', 'w') as plain:
+        for info in source.getmembers():
+            plain.addfile(info, source.extractfile(info))
+    path = tmp_path / 'repo.tar.zst'
+    path.write_bytes(zstandard.ZstdCompressor().compress((tmp_path / 'repo.tar').read_bytes()))
+    assert archive_suffix(str(path)) == '.tar.zst'
+    assert dict(iter_members(str(path))) == FILES
+
+@pytest.mark.parametrize('make', [make_tar, make_zip])
+def test_iter_members_caps_total_size(tmp_path, make):
+    path = make(tmp_path / ('repo.tar.gz' if make is make_tar else 'repo.zip'))
+    assert len(list(iter_members(path, max_total_bytes=17))) == 3
+    with pytest.raises(ArchiveTooLarge, match='repo-main/img.bin'):
+        list(iter_members(path, max_total_bytes=16))
+
+def test_member_prefix():
+    assert member_prefix(list(FILES)) == 'repo-main/'
+    assert member_prefix(['a.py', 'src/b.py']) == ''
+    assert member_prefix(['src/a.py', 'docs/b.md']) == ''
+    assert member_prefix([]) == ''
+
+def test_tar_reader_extracts_once(tmp_path, mocker):
+    path = make_tar(tmp_path / 'repo.tar.gz', {**FILES, 'repo-main/copy.py': FILES['repo-main/a.py']})
+    open_spy = mocker.spy(archives, 'open_tar')
+    with ArchiveReader(path) as reader:
+        source = ArchiveSource(reader, 'repo-main/', {'a.py': 'x', 'src/b.txt': 'y', 'copy.py': 'x'})
+        assert source.read('src/b.txt') == "bee"
+        assert source.read('a.py') == "print('a')\n"
+        assert source.read('copy.py') == "print('a')\n"
+        assert open_spy.call_count == 1
+        assert reader.extracted['repo-main/a.py'] == reader.extracted['repo-main/copy.py']
+        extract_dir = reader.extract_dir.name
+        with pytest.raises(KeyError):
+            reader.read('repo-main/missing.py')
+    assert not os.path.exists(extract_dir)
+
+def test_zip_reader(tmp_path):
+    with ArchiveReader(make_zip(tmp_path / 'repo.zip')) as reader:
+        assert reader.read('repo-main/src/b.txt') == b"bee"
+        with pytest.raises(KeyError):
+            reader.read('missing')
@@ -0,0 +1,153 @@
+import os
+import subprocess
+import pytest
+from clone_jobs import CloneJob, CloneOptions, checkout_path, git_clone, mirror_path, refresh_checkout, update_mirror
+
+def make_repo(path):
+    subprocess.run(['git', 'init', '-q', str(path)], check=True)
+    (path / 'a.py').write_text("print('a')\n")
+    subprocess.run(['git', '-C', str(path), 'add', '.'], check=True)
+    subprocess.run(['git', '-C', str(path), '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-qm', 'init'], check=True)
+
+def test_git_clone_reports_progress(tmp_path):
+    make_repo(tmp_path / 'origin')
+    job = CloneJob(url=f"file://{tmp_path / 'origin'}", repo_path=str(tmp_path / 'clone'))
+    assert git_clone(job.url, job.repo_path, job.on_git_progress) == 0
+    assert (tmp_path / 'clone' / 'a.py').exists()
+    assert any(line.startswith('Cloning into') for line in job.log)
+
+def test_git_clone_failure(tmp_path):
+    job = CloneJob(url=f"file://{tmp_path / 'missing'}", repo_path=str(tmp_path / 'clone'))
+    assert git_clone(job.url, job.repo_path, job.on_git_progress) != 0
+    assert job.progress
+
+def test_scan_progress_updates_job():
+    job = CloneJob(url='u', repo_path='p')
+    job.on_scan_progress(3, 10, 120)
+    assert (job.files_scanned, job.files_total, job.tokens_counted) == (3, 10, 120)
+    assert not job.finished
+    job.fail('boom')
+    assert job.finished and job.error == 'boom'
+
+
+def git(*args):
+    return subprocess.run(['git', *args], check=True, capture_output=True, text=True).stdout.strip()
+
+def commit(path, message):
+    git('-C', str(path), 'add', '.')
+    git('-C', str(path), '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-qm', message)
+    return git('-C', str(path), 'rev-parse', 'HEAD')
+
+@pytest.fixture(scope="module")
+def bare_repo(tmp_path_factory):
+    """A bare repo with two commits on the default branch, a tag and a feature branch."""
+    root = tmp_path_factory.mktemp("remote")
+    work = root / 'work'
+    git('init', '-q', str(work))
+    (work / 'src').mkdir()
+    (work / 'docs').mkdir()
+    (work / 'src' / 'a.py').write_text("print('a')\n")
+    (work / 'docs' / 'big.txt').write_text('x' * 50000)
+    first = commit(work, 'one')
+    git('-C', str(work), 'tag', 'v1')
+    git('-C', str(work), 'branch', 'cafe123')
+    (work / 'src' / 'b.py').write_text("print('b')\n")
+    commit(work, 'two')
+    default_branch = git('-C', str(work), 'rev-parse', '--abbrev-ref', 'HEAD')
+    git('-C', str(work), 'checkout', '-qb', 'feature')
+    (work / 'src' / 'f.py').write_text("print('f')\n")
+    commit(work, 'three')
+    git('-C', str(work), 'checkout', '-q', default_branch)
+    git('clone', '-q', '--bare', str(work), str(root / 'remote.git'))
+    git('-C', str(root / 'remote.git'), 'config', 'uploadpack.allowfilter', 'true')
+    return {'url': f"file://{root / 'remote.git'}", 'first': first}
+
+def clone(bare_repo, tmp_path, **options):
+    path = str(tmp_path / 'clone')
+    job = CloneJob(url=bare_repo['url'], repo_path=path)
+    assert git_clone(job.url, path, job.on_git_progress, CloneOptions(**options)) == 0, list(job.log)
+    return tmp_path / 'clone'
+
+def test_shallow_clone(bare_repo, tmp_path):
+    path = clone(bare_repo, tmp_path, depth=1)
+    assert git('-C', str(path), 'rev-list', '--count', 'HEAD') == '1'
+    assert (path / 'src' / 'b.py').exists()
+
+def test_clone_branch_and_tag(bare_repo, tmp_path):
+    assert (clone(bare_repo, tmp_path / 'branch', depth=1, revision='feature') / 'src' / 'f.py').exists()
+    tagged = clone(bare_repo, tmp_path / 'tag', revision='v1')
+    assert (tagged / 'src' / 'a.py').exists()
+    assert not (tagged / 'src' / 'b.py').exists()
+
+def test_clone_commit(bare_repo, tmp_path):
+    path = clone(bare_repo, tmp_path, depth=1, revision=bare_repo['first'])
+    assert git('-C', str(path), 'rev-parse', 'HEAD') == bare_repo['first']
+    assert not (path / 'src' / 'b.py').exists()
+
+def test_clone_abbreviated_commit_and_hex_named_branch(bare_repo, tmp_path):
+    path = clone(bare_repo, tmp_path / 'short', revision=bare_repo['first'][:7])
+    assert git('-C', str(path), 'rev-parse', 'HEAD') == bare_repo['first']
+    branch = clone(bare_repo, tmp_path / 'hex', revision='cafe123')
+    assert git('-C', str(branch), 'symbolic-ref', 'HEAD') == 'refs/heads/cafe123'
+    assert not CloneOptions(revision='cafe123').is_commit
+
+def test_sparse_partial_clone(bare_repo, tmp_path):
+    path = clone(bare_repo, tmp_path, depth=1, blob_limit='1k', sparse_paths=('src/',))
+    assert (path / 'src' / 'a.py').exists()
+    assert not (path / 'docs').exists()
+    missing = git('-C', str(path), 'rev-list', '--objects', '--missing=print', 'HEAD').splitlines()
+    assert any(line.startswith('?') for line in missing)
+
+def test_clone_through_mirror_and_refresh(tmp_path):
+    origin = tmp_path / 'origin'
+    make_repo(origin)
+    url = f"file://{origin}"
+    mirror = mirror_path(str(tmp_path / 'mirrors'), url)
+    assert mirror_path(str(tmp_path / 'mirrors'), url, '1m') != mirror
+    job = CloneJob(url=url, repo_path=str(tmp_path / 'clone'))
+    assert git_clone(url, job.repo_path, job.on_git_progress, CloneOptions(), mirror=mirror) == 0
+    # Every object is borrowed from the mirror
+    assert git('-C', job.repo_path, 'count-objects', '-v').splitlines()[0] == 'count: 0'
+    assert (tmp_path / 'clone' / 'a.py').exists()
+
+    (origin / 'b.py').write_text("print('b')\n")
+    head = commit(origin, 'two')
+    assert refresh_checkout(job.repo_path, job.on_git_progress, url=url, mirror=mirror) == 0
+    assert git('-C', mirror, 'rev-parse', 'HEAD') == head
+    assert git('-C', job.repo_path, 'rev-parse', 'HEAD') == head
+    assert (tmp_path / 'clone' / 'b.py').exists()
+
+def test_forks_get_their_own_checkouts():
+    alice = checkout_path('cloned_repos', 'https://example.com/alice/src.git', 'src')
+    bob = checkout_path('cloned_repos', 'https://example.com/bob/src.git', 'src')
+    assert alice != bob and os.path.basename(alice).startswith('src-')
+    assert checkout_path('cloned_repos', 'https://example.com/alice/src.git', 'src') == alice
+
+def test_shallow_clone_skips_mirror(tmp_path):
+    origin = tmp_path / 'origin'
+    make_repo(origin)
+    for message in ('two', 'three'):
+        (origin / f'{message}.py').write_text(f"print('{message}')\n")
+        commit(origin, message)
+    url = f"file://{origin}"
+    mirror = mirror_path(str(tmp_path / 'mirrors'), url)
+    job = CloneJob(url=url, repo_path=str(tmp_path / 'clone'))
+    assert git_clone(url, job.repo_path, job.on_git_progress, CloneOptions(depth=1), mirror=mirror) == 0
+    assert git('-C', job.repo_path, 'rev-list', '--count', 'HEAD') == '1'
+    assert not os.path.exists(mirror)
+
+    shallow = mirror_path(str(tmp_path / 'mirrors'), url, depth=1)
+    assert shallow != mirror
+    assert update_mirror(url, shallow, job.on_git_progress, depth=1) == 0
+    assert git('-C', shallow, 'rev-list', '--count', 'HEAD') == '1'
+
+def test_refresh_leaves_detached_checkout(bare_repo, tmp_path):
+    path = clone(bare_repo, tmp_path, revision=bare_repo['first'])
+    assert refresh_checkout(str(path), lambda line: None) == 0
+    assert git('-C', str(path), 'rev-parse', 'HEAD') == bare_repo['first']
+
+@pytest.mark.parametrize('options', [
+    {'depth': 0}, {'blob_limit': '1 mb'}, {'revision': '--upload-pack=evil'}, {'sparse_paths': ('-x',)}])
+def test_invalid_options(options):
+    with pytest.raises(ValueError):
+        CloneOptions(**options)
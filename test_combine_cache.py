@@ -0,0 +1,46 @@
+import os
+from combine_cache import CombineCache, etag_matches, selection_key
+
+def test_selection_key_normalizes_and_tracks_changes(tmp_path):
+    (tmp_path / 'a.py').write_text('a')
+    (tmp_path / 'b.py').write_text('b')
+    key = selection_key(str(tmp_path), ['a.py', 'b.py', 'a.py'], ['.txt', '.md'], 'text')
+    assert key == selection_key(str(tmp_path), ['a.py', 'b.py'], ['.md', '.txt'], 'text')
+    assert key != selection_key(str(tmp_path), ['b.py', 'a.py'], ['.md', '.txt'], 'text')
+    assert key != selection_key(str(tmp_path), ['a.py', 'b.py'], ['.md', '.txt'], 'jsonl')
+    (tmp_path / 'b.py').write_text('changed')
+    assert key != selection_key(str(tmp_path), ['a.py', 'b.py'], ['.md', '.txt'], 'text')
+
+def test_etag_matches():
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('"x", W/"abc"', '"abc"')
+    assert etag_matches('*', '"abc"')
+    assert not etag_matches('"abcd"', '"abc"')
+    assert not etag_matches(None, '"abc"')
+
+def test_store_then_get(tmp_path):
+    cache = CombineCache(str(tmp_path), 1000)
+    assert cache.get('k') is None
+    assert list(cache.store('k', [b'ab', b'cd'])) == [b'ab', b'cd']
+    with open(cache.get('k'), 'rb') as f:
+        assert f.read() == b'abcd'
+
+def test_interrupted_store_leaves_no_entry(tmp_path):
+    cache = CombineCache(str(tmp_path), 1000)
+    stream = cache.store('k', iter([b'ab', b'cd']))
+    next(stream)
+    stream.close()
+    assert cache.get('k') is None
+    assert os.listdir(tmp_path) == []
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = CombineCache(str(tmp_path), 10)
+    list(cache.store('old', [b'1234']))
+    list(cache.store('used', [b'1234']))
+    os.utime(cache.path('old'), ns=(1, 1))
+    os.utime(cache.path('used'), ns=(2, 2))
+    cache.get('used')
+    list(cache.store('new', [b'1234']))
+    assert cache.get('old') is None
+    assert cache.get('used') is not None
+    assert cache.get('new') is not None
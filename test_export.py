@@ -0,0 +1,45 @@
+import gzip
+import json
+import xml.etree.ElementTree as ET
+import pytest
+from export import COMPRESSIONS, compress_stream, iter_files, render_jsonl, render_markdown, render_text, render_xml
+
+FILES = [('a.py', "print('a')\n"), ('docs/b.md', "```py\nx\n```"), ('c', '<tag> & "q"')]
+
+def test_render_text():
+    assert ''.join(render_text(FILES[:1])) == ">>> FILE: a.py <<<\nprint('a')\n\n\n"
+
+def test_render_markdown_fences_outlast_content():
+    output = ''.join(render_markdown(FILES))
+    assert "## a.py\n\n```py\nprint('a')\n```\n\n" in output
+    assert "## docs/b.md\n\n````md\n```py\nx\n```\n````\n\n" in output
+    assert "## c\n\n```\n" in output
+
+def test_render_xml_is_well_formed():
+    root = ET.fromstring(''.join(render_xml(FILES)))
+    documents = root.findall('document')
+    assert [doc.get('path') for doc in documents] == ['a.py', 'docs/b.md', 'c']
+    assert documents[2].text == '\n<tag> & "q"\n'
+
+def test_render_jsonl_records():
+    lines = ''.join(render_jsonl(FILES, lambda path, content: len(content))).splitlines()
+    records = [json.loads(line) for line in lines]
+    assert records[0] == {'path': 'a.py', 'tokens': 11, 'content': "print('a')\n"}
+    assert [record['path'] for record in records] == ['a.py', 'docs/b.md', 'c']
+
+def test_compress_stream_gzip():
+    data = b''.join(compress_stream(render_text(FILES), 'gzip'))
+    assert gzip.decompress(data).decode('utf-8') == ''.join(render_text(FILES))
+
+def test_compress_stream_zstd():
+    zstandard = pytest.importorskip('zstandard')
+    data = b''.join(compress_stream(render_text(FILES), 'zstd'))
+    assert 'zstd' in COMPRESSIONS
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(data).decode('utf-8') == ''.join(render_text(FILES))
+
+def test_iter_files_skips_directories_and_excluded_types(tmp_path):
+    (tmp_path / 'a.py').write_text('a')
+    (tmp_path / 'b.txt').write_text('b')
+    (tmp_path / 'sub').mkdir()
+    files = list(iter_files(str(tmp_path), ['sub', 'a.py', 'b.txt', 'missing.py'], ['.txt']))
+    assert files == [('a.py', 'a')]
@@ -41,4 +41,42 @@ def test_directory_structure_collapsible(client, mock_current_repo):
 def test_get_current_repo(client, mock_current_repo):
     response = client.get('/')
     assert response.status_code == 200
-    assert 'Repository: test_repo' in response.text
\ No newline at end of file
+    assert 'Repository: test_repo' in response.text
+
+
+def test_update_totals_with_directory_does_not_double_count(client, mock_current_repo):
+    response = client.post('/update-totals', data={'selected_files': ['subdir', 'subdir/file3.js', 'file1.py'], 'file_types': []})
+    assert response.status_code == 200
+    assert 'Total: 2 files, 250 bytes, 125 tokens' in response.text
+
+def test_update_totals_excludes_file_types_below_directory(client, mock_current_repo, mocker):
+    mocker.patch('os.walk', side_effect=AssertionError("totals must not walk the filesystem"))
+    response = client.post('/update-totals', data={'selected_files': ['.', 'file2.txt'], 'file_types': ['.txt', '(no extension)']})
+    assert response.status_code == 200
+    assert 'Total: 3 files, 270 bytes, 135 tokens' in response.text
+
+def test_totals_from_selection_delta(client, mock_current_repo):
+    client.get('/')
+    response = client.post('/totals', data={'selection': 'd0 -d1 -f3', 'file_types': []})
+    assert response.status_code == 200
+    assert 'Total: 3 files, 170 bytes, 85 tokens' in response.text
+
+def test_totals_selection_delta_with_exclusions(client, mock_current_repo):
+    response = client.post('/totals', data={'selection': '-d0 d1 f2', 'file_types': ['.js']})
+    assert 'Total: 1 files, 100 bytes, 50 tokens' in response.text
+    response = client.post('/totals', data={'selection': '', 'file_types': []})
+    assert 'Total: 0 files, 0 bytes, 0 tokens' in response.text
+
+def test_totals_ignore_unknown_ids(client, mock_current_repo):
+    response = client.post('/totals', data={'selection': 'f2 f99 d99 x1 dd', 'file_types': []})
+    assert 'Total: 1 files, 100 bytes, 50 tokens' in response.text
+
+def test_totals_reuse_rendered_scan(client, mock_current_repo):
+    import app as app_module
+    response = client.get('/')
+    assert 'data-id="d1"' in response.text
+    assert 'data-id="f4"' in response.text
+    calls = app_module.scan_repo.call_count
+    client.post('/totals', data={'selection': 'd0'})
+    client.post('/select-all')
+    assert app_module.scan_repo.call_count == calls
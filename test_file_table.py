@@ -0,0 +1,64 @@
+import os
+import tempfile
+from file_table import FileTable, get_extension, mask_and
+from utils import get_directory_structure, get_directory_index, scan_repo
+
+def make_table():
+    return FileTable.from_file_data({
+        'b.py': {'count': 1, 'size': 10, 'tokens': 3},
+        os.path.join('pkg', 'c.txt'): {'count': 1, 'size': 20, 'tokens': 5},
+        'a.txt': {'count': 1, 'size': 30, 'tokens': 7, 'estimated': True},
+        os.path.join('pkg', 'sub', 'd.py'): {'count': 1, 'size': 40, 'tokens': 11},
+    })
+
+def test_file_table_is_in_tree_order_and_behaves_like_file_data():
+    table = make_table()
+    assert table.paths == ['a.txt', 'b.py', os.path.join('pkg', 'c.txt'), os.path.join('pkg', 'sub', 'd.py')]
+    assert len(table) == 4
+    assert table['b.py'] == {'count': 1, 'size': 10, 'tokens': 3}
+    assert table['a.txt']['estimated'] is True
+    assert 'missing.py' not in table
+    assert table.has_estimates()
+
+def test_totals_with_mask_and_exclusions():
+    table = make_table()
+    assert table.totals(bytearray(b'\x01\x01\x01\x01')) == (4, 100, 26)
+    assert table.totals(bytearray(b'\x01\x01\x01\x01'), {'.txt'}) == (2, 50, 14)
+    assert table.totals(bytearray(b'\x00\x01\x00\x01'), {'.py'}) == (0, 0, 0)
+    assert mask_and(bytearray(b'\x01\x01\x00'), bytearray(b'\x00\x01\x01')) == bytearray(b'\x00\x01\x00')
+
+def test_extension_totals():
+    assert make_table().extension_totals() == {
+        '.txt': {'count': 2, 'size': 50, 'tokens': 12},
+        '.py': {'count': 2, 'size': 50, 'tokens': 14},
+    }
+    assert make_table().extension_totals(bytearray(b'\x00\x01\x01\x00')) == {
+        '.txt': {'count': 1, 'size': 20, 'tokens': 5},
+        '.py': {'count': 1, 'size': 10, 'tokens': 3},
+    }
+
+def test_more_than_256_extensions():
+    table = FileTable()
+    for i in range(300):
+        table.add(f"file.e{i}", f".e{i}", 1, 2)
+    assert table.extension_of(299) == '.e299'
+    assert table.totals(bytearray(b'\x01' * 300), {'.e0', '.e299'}) == (298, 298, 596)
+
+def test_directories_cover_contiguous_id_ranges():
+    structure = get_directory_structure('repo', make_table(), [], ['pkg', os.path.join('pkg', 'sub'), 'empty'])
+    directories = get_directory_index(structure)
+    assert (directories['.']['first_id'], directories['.']['end_id']) == (0, 4)
+    assert (directories['pkg']['first_id'], directories['pkg']['end_id']) == (2, 4)
+    assert (directories[os.path.join('pkg', 'sub')]['first_id'], directories[os.path.join('pkg', 'sub')]['end_id']) == (3, 4)
+    assert directories['empty']['first_id'] is None
+
+def test_scan_file_table_matches_file_types():
+    with tempfile.TemporaryDirectory() as repo_path:
+        for rel_path in ['z.py', os.path.join('b', 'x.py'), os.path.join('a', 'y.md'), 'README']:
+            os.makedirs(os.path.join(repo_path, os.path.dirname(rel_path)), exist_ok=True)
+            with open(os.path.join(repo_path, rel_path), 'w') as f:
+                f.write("hello world\n")
+        scan = scan_repo(repo_path)
+        assert scan.file_data.paths == ['README', 'z.py', os.path.join('a', 'y.md'), os.path.join('b', 'x.py')]
+        assert scan.file_data.extension_totals() == scan.file_types
+        assert get_extension('README') == '(no extension)'
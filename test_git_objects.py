@@ -0,0 +1,39 @@
+import subprocess
+import pytest
+from git_objects import CatFile, TreeSource, ls_tree, resolve_revision
+
+def git(*args):
+    return subprocess.run(['git', *args], check=True, capture_output=True).stdout
+
+@pytest.fixture
+def repo(tmp_path):
+    git('init', '-q', str(tmp_path))
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'a.py').write_bytes(b"print('a')\r\n")
+    (tmp_path / 'b.txt').write_text("bee")
+    (tmp_path / 'link').symlink_to('b.txt')
+    git('-C', str(tmp_path), 'add', '.')
+    git('-C', str(tmp_path), '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-qm', 'init')
+    return str(tmp_path)
+
+def test_ls_tree_lists_regular_files(repo):
+    entries = {path: (sha, size) for path, sha, size in ls_tree(repo)}
+    assert set(entries) == {'b.txt', 'src/a.py'}
+    assert entries['b.txt'] == (git('-C', repo, 'rev-parse', 'HEAD:b.txt').decode().strip(), 3)
+    with pytest.raises(subprocess.CalledProcessError):
+        ls_tree(repo, 'no-such-branch')
+
+def test_cat_file_reads_blobs(repo):
+    blobs = {path: sha for path, sha, _ in ls_tree(repo)}
+    with CatFile(repo) as cat_file:
+        assert cat_file.read(blobs['b.txt']) == b"bee"
+        assert cat_file.read(blobs['src/a.py']) == b"print('a')\r\n"
+        with pytest.raises(KeyError):
+            cat_file.read('0' * 40)
+        # The process survives a missing object
+        assert cat_file.read(blobs['b.txt']) == b"bee"
+        assert TreeSource(cat_file, blobs).read('src/a.py') == "print('a')\n"
+
+def test_resolve_revision(repo):
+    assert resolve_revision(repo) == git('-C', repo, 'rev-parse', 'HEAD').decode().strip()
+    assert resolve_revision(repo, 'no-such-branch') is None
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import pytest
+from ignore_rules import IgnoreEngine, RuleSet
+from utils import directory_children, get_file_types, scan_repo
+
+@pytest.mark.parametrize("pattern, path, is_dir, expected", [
+    ("*.log", "debug.log", False, True),
+    ("*.log", "logs/debug.log", False, True),
+    ("*.log", "debug.txt", False, None),
+    ("/build", "build", True, True),
+    ("/build", "src/build", True, None),
+    ("docs/*.md", "docs/readme.md", False, True),
+    ("docs/*.md", "docs/api/readme.md", False, None),
+    ("cache/", "cache", True, True),
+    ("cache/", "cache", False, None),
+    ("**/fixtures", "a/b/fixtures", True, True),
+    ("a/**/z", "a/z", False, True),
+    ("a/**/z", "a/b/c/z", False, True),
+    ("out/**", "out/x/y.txt", False, True),
+    ("file?.[ch]", "file1.c", False, True),
+    ("file?.[!ch]", "file1.c", False, None),
+    ("# comment", "# comment", False, None),
+])
+def test_rule_set_match(pattern, path, is_dir, expected):
+    assert RuleSet([pattern]).match(path, is_dir) == expected
+
+def test_last_matching_rule_wins():
+    rules = RuleSet(["*.txt", "!keep.txt"])
+    assert rules.match("drop.txt", False) is True
+    assert rules.match("keep.txt", False) is False
+    assert RuleSet(["!keep.txt", "*.txt"]).match("keep.txt", False) is True
+
+@pytest.fixture
+def temp_repo():
+    with tempfile.TemporaryDirectory() as repo_path:
+        def write(rel_path, content="x = 1\n"):
+            full_path = os.path.join(repo_path, rel_path)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "w") as f:
+                f.write(content)
+        write("main.py")
+        write("debug.log")
+        write(".gitignore", "*.log\n/generated/\n")
+        write("generated/out.py")
+        write("src/generated/keep.py")
+        write("src/.gitignore", "*.tmp\n!important.log\n")
+        write("src/scratch.tmp")
+        write("src/important.log")
+        write("node_modules/pkg/index.js")
+        write(".git/objects/ab/cdef")
+        write(".git/HEAD", "ref: refs/heads/main\n")
+        write(".git/info/exclude", "secret.py\n")
+        write("secret.py")
+        yield repo_path
+
+def test_get_file_types_prunes_ignored_paths(temp_repo):
+    _, file_data, _ = get_file_types(temp_repo)
+    scanned = sorted(file_data)
+    assert scanned == sorted([
+        ".gitignore",
+        "main.py",
+        os.path.join("src", ".gitignore"),
+        os.path.join("src", "generated", "keep.py"),
+        os.path.join("src", "important.log"),
+    ])
+
+def test_default_ignores_are_configurable(temp_repo):
+    _, file_data, _ = get_file_types(temp_repo, ignore_patterns=())
+    assert os.path.join("node_modules", "pkg", "index.js") in file_data
+    assert not any(path.startswith(".git" + os.sep) for path in file_data)
+
+def test_directory_structure_prunes_ignored_paths(temp_repo):
+    scan = scan_repo(temp_repo)
+    names = {child['name'] for child in directory_children(scan.file_data, scan.structure)}
+    assert names == {".gitignore", "main.py", "src"}
+
+def test_ignored_directories_are_not_descended(temp_repo, mocker):
+    engine = IgnoreEngine(temp_repo)
+    is_ignored = mocker.spy(engine, 'is_ignored')
+    roots = [rel_root for _, rel_root, _, _ in engine.walk()]
+    assert "node_modules" not in roots and ".git" not in roots
+    assert not any(call.args[0].startswith("node_modules" + os.sep) for call in is_ignored.call_args_list)
@@ -0,0 +1,83 @@
+from packer import pack, parse_weights, path_weight, plan_parts, split_lines
+from tokenizer import get_tokenizer
+
+FILES = [('README.md', 40), ('src/app.py', 300), ('src/util.py', 120), ('tests/test_app.py', 200)]
+
+def test_smallest_first_keeps_most_files():
+    kept, dropped = pack(FILES, 400, 'smallest')
+    assert kept == [('README.md', 40), ('src/util.py', 120), ('tests/test_app.py', 200)]
+    assert dropped == [('src/app.py', 300)]
+
+def test_large_file_does_not_block_smaller_ones():
+    kept, dropped = pack(FILES, 350, 'order', order=['src/app.py', 'tests/test_app.py'])
+    assert kept == [('src/app.py', 300), ('README.md', 40)]
+    assert [path for path, _ in dropped] == ['src/util.py', 'tests/test_app.py']
+
+def test_weights_rank_by_pattern_and_drop_zero_weight():
+    weights = parse_weights("src/*=3\ntests/*=0\nnot a weight\n=2")
+    assert weights == [('src/*', 3.0), ('tests/*', 0.0)]
+    kept, dropped = pack(FILES, 450, 'weights', weights=weights)
+    assert kept == [('src/app.py', 300), ('src/util.py', 120)]
+    assert ('tests/test_app.py', 200) in dropped
+
+def test_last_matching_weight_wins():
+    weights = parse_weights("*.py=2\nsrc/util.py=0.5")
+    assert path_weight('src/util.py', weights) == 0.5
+    assert path_weight('src/app.py', weights) == 2
+    assert path_weight('README.md', weights) == 1
+
+def test_recent_first():
+    mtimes = {'README.md': 1, 'src/app.py': 4, 'src/util.py': 3, 'tests/test_app.py': 2}
+    kept, dropped = pack(FILES, 450, 'recent', mtimes=mtimes)
+    assert kept == [('src/app.py', 300), ('src/util.py', 120)]
+    assert len(dropped) == 2
+
+def test_everything_fits():
+    kept, dropped = pack(FILES, 10000)
+    assert kept == FILES
+    assert dropped == []
+
+def test_plan_parts_breaks_on_file_boundaries():
+    parts = plan_parts([('a', 40), ('b', 50), ('c', 30), ('d', 100)], 100)
+    assert parts == [([('a', 0, 1), ('b', 0, 1)], 90), ([('c', 0, 1)], 30), ([('d', 0, 1)], 100)]
+
+def test_plan_parts_splits_oversized_files():
+    parts = plan_parts([('a', 10), ('big', 250), ('b', 10)], 100)
+    assert [entries for entries, _ in parts] == [
+        [('a', 0, 1)], [('big', 0, 3)], [('big', 1, 3)], [('big', 2, 3)], [('b', 0, 1)]]
+
+class CharTokenizer:
+    """Counts every character as a token."""
+
+    def count_batch(self, texts):
+        return [len(text) for text in texts]
+
+    def cut(self, text, offsets):
+        bounds = [0, *offsets, len(text)]
+        return [text[start:end] for start, end in zip(bounds[:-1], bounds[1:], strict=True)]
+
+def test_split_lines_covers_every_line_once():
+    text = ''.join(f"line {i}\n" for i in range(1, 11))
+    pieces = [split_lines(text, piece, 3, CharTokenizer()) for piece in range(3)]
+    assert ''.join(piece_text for _, _, piece_text in pieces) == text
+    assert pieces[0][0] == 1
+    assert pieces[2][1] == 10
+    assert all(first is not None for first, _, _ in pieces)
+    assert [len(piece_text) for _, _, piece_text in pieces] == [24, 24, 23]
+
+def test_split_lines_cuts_a_line_longer_than_a_piece():
+    assert split_lines("one long line\n", 0, 2, CharTokenizer()) == (1, 1, "one lon")
+    assert split_lines("one long line\n", 1, 2, CharTokenizer()) == (1, 1, "g line\n")
+    text = "short\n" + "x" * 20 + "\nend\n"
+    pieces = [split_lines(text, piece, 4, CharTokenizer()) for piece in range(4)]
+    assert [(first, last) for first, last, _ in pieces] == [(1, 2), (2, 2), (2, 2), (2, 3)]
+    assert ''.join(piece_text for _, _, piece_text in pieces) == text
+    assert max(len(piece_text) for _, _, piece_text in pieces) == 8
+
+def test_split_lines_with_real_tokens():
+    tokenizer = get_tokenizer('cl100k_base')
+    text = "x = [" + ", ".join(f"'é{i}'" for i in range(300)) + "]\n"
+    total = tokenizer.count(text)
+    pieces = [split_lines(text, piece, 4, tokenizer)[2] for piece in range(4)]
+    assert ''.join(pieces) == text
+    assert all(tokenizer.count(piece) <= -(-total // 4) + 1 for piece in pieces)
@@ -0,0 +1,15 @@
+from part_plans import PartPlans
+
+
+def test_plans_are_shared_and_only_recent_ones_kept(tmp_path):
+    db_path = str(tmp_path / "state.db")
+    first, second = PartPlans(db_path, max_plans=2), PartPlans(db_path)
+    try:
+        for plan_id in ('a', 'b', 'c'):
+            first.save(plan_id, {'encoding': 'cl100k_base', 'parts': [[[['x.py', 0, 1]], 5]]})
+        assert second.load('a') is None
+        assert second.load('c') == {'encoding': 'cl100k_base', 'parts': [[[['x.py', 0, 1]], 5]]}
+        assert second.load('b') is not None
+    finally:
+        first.close()
+        second.close()
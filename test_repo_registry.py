@@ -0,0 +1,112 @@
+import threading
+import pytest
+from repo_registry import RepoEntry, RepoRegistry, repo_id
+from app import Repo
+
+
+def make_repo(name):
+    return Repo(name=name, path=f"cloned_repos/{name}", encoding='cl100k_base')
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = RepoRegistry(str(tmp_path / "state.db"), Repo, touch_seconds=0)
+    yield registry
+    registry.close()
+
+
+def test_sessions_keep_separate_entries(registry):
+    first = registry.open('alice', make_repo('first'))
+    registry.open('alice', make_repo('second'))
+    registry.open('bob', make_repo('first'))
+
+    assert registry.get('alice').repo.name == 'second'
+    assert registry.get('alice', first.id).repo == first.repo
+    assert registry.get('alice').repo.name == 'first'
+    assert [entry.repo.name for entry in registry.entries('alice')] == ['first', 'second']
+
+    registry.remember('alice', first.id, ['d.', '-fsrc/a b.py'], ['.md'])
+    assert registry.get('alice', first.id).selection == ['d.', '-fsrc/a b.py']
+    assert registry.get('alice', first.id).excluded == ('.md',)
+    assert registry.get('bob', first.id).selection is None
+    assert registry.get('carol') is None
+    assert registry.get('alice', 'unknown') is None
+
+
+def test_reopening_replaces_entry(registry):
+    entry = registry.open('alice', make_repo('first'))
+    registry.remember('alice', entry.id, ['d.'], [])
+    reopened = registry.open('alice', make_repo('first'))
+    assert reopened.id == entry.id == repo_id('cloned_repos/first')
+    assert registry.get('alice').selection is None
+    assert len(registry.entries('alice')) == 1
+
+
+def test_limits_and_removal(tmp_path):
+    registry = RepoRegistry(str(tmp_path / "state.db"), Repo, max_sessions=2, max_repos=2,
+                            touch_seconds=0)
+    for name in ('a', 'b', 'c'):
+        registry.open('alice', make_repo(name))
+    assert [entry.repo.name for entry in registry.entries('alice')] == ['c', 'b']
+
+    registry.open('bob', make_repo('c'))
+    registry.get('alice')
+    registry.open('carol', make_repo('c'))
+    assert registry.get('bob') is None
+    assert registry.get('alice') is not None
+
+    registry.remove(repo_id('cloned_repos/c'))
+    assert [entry.repo.name for entry in registry.entries('alice')] == ['b']
+    assert registry.entries('carol') == []
+
+
+def test_reads_mark_entries_used_at_most_once_per_interval(tmp_path):
+    registry = RepoRegistry(str(tmp_path / "state.db"), Repo)
+    try:
+        first = registry.open('alice', make_repo('first'))
+        registry.open('alice', make_repo('second'))
+        changes = registry.db.conn.total_changes
+        assert registry.get('alice', first.id).repo.name == 'first'
+        assert registry.db.conn.total_changes == changes
+        assert registry.get('alice').repo.name == 'second'
+    finally:
+        registry.close()
+
+
+def test_workers_share_entries(registry, tmp_path):
+    other_worker = RepoRegistry(str(tmp_path / "state.db"), Repo)
+    try:
+        entry = other_worker.open('alice', Repo(name='rev', path='cloned_repos/.mirrors/x.git', revision='v1'))
+        other_worker.remember('alice', entry.id, ['-fa.py'], [])
+        assert registry.get('alice') == RepoEntry(entry.repo, ['-fa.py'], ())
+        assert registry.get('alice').repo.revision == 'v1'
+        assert registry.db.execute("pragma journal_mode").fetchone()[0] == 'wal'
+    finally:
+        other_worker.close()
+
+
+def test_revisions_of_one_mirror_are_separate_repos(registry):
+    mirror = 'cloned_repos/.mirrors/foo.git'
+    v1 = registry.open('alice', Repo(name='foo@v1', path=mirror, revision='v1'))
+    v2 = registry.open('alice', Repo(name='foo@v2', path=mirror, revision='v2'))
+    assert v1.id != v2.id and repo_id(mirror) not in (v1.id, v2.id)
+    assert [entry.repo.name for entry in registry.entries('alice')] == ['foo@v2', 'foo@v1']
+    registry.remove(v1.id)
+    assert [entry.repo.name for entry in registry.entries('alice')] == ['foo@v2']
+
+def test_repo_lock_is_shared_per_repo(registry):
+    waited = threading.Event()
+
+    def wait_for_lock():
+        with registry.repo_lock('abc'):
+            waited.set()
+
+    with registry.repo_lock('abc'):
+        with registry.repo_lock('def'):
+            pass
+        thread = threading.Thread(target=wait_for_lock)
+        thread.start()
+        assert not waited.wait(0.2)
+    thread.join(5)
+    assert waited.is_set()
+    assert registry.repo_locks == {}
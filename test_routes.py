@@ -1,6 +1,8 @@
 import pytest
 from starlette.testclient import TestClient
-from app import app
+from app import app, SUBDIRECTORY
+from clone_jobs import checkout_path
+from repo_registry import repo_id
 
 def test_home_route_no_repo(client, mocker):
     mocker.patch('app.get_current_repo', return_value=None)
@@ -14,13 +16,13 @@ def test_home_route_with_repo(client, mock_current_repo):
     assert 'File Type Exclusions' in response.text
     assert 'Total: 5 files, 520 bytes, 260 tokens' in response.text
 
-def test_clone_route(client, mocker):
-    mocker.patch('subprocess.run')
+def test_clone_route(client, mocker, opened_repo):
+    mocker.patch('app.git_clone', return_value=0)
     mocker.patch('os.path.exists', return_value=False)
     response = client.post('/clone', data={'url': 'https://github.com/user/repo.git'})
     assert response.status_code == 200
-    assert app.state.current_repo is not None
-    assert app.state.current_repo.name == 'repo'
+    assert response.url.params['repo_id'] == repo_id(checkout_path(SUBDIRECTORY, 'https://github.com/user/repo.git', 'repo'))
+    assert opened_repo(response.url.params['repo_id']).name == 'repo'
 
 def test_update_totals_route(client, mock_repo_structure, mock_current_repo):
     response = client.post('/update-totals', data={'selected_files': ['file1.py', 'subdir/file3.js'], 'file_types': ['.txt']})
@@ -38,19 +40,19 @@ def test_combine_route(client, mock_current_repo, mocker):
 def test_select_all_route(client, mock_current_repo):
     response = client.post('/select-all')
     assert response.status_code == 200
-    assert 'checked' in response.text
-    assert 'file1.py' in response.text
-    assert 'file2.txt' in response.text
-    assert 'file3.js' in response.text
+    assert 'Total: 5 files, 520 bytes, 260 tokens' in response.text
 
-def test_unselect_all_route(client, mock_current_repo):
-    response = client.post('/unselect-all')
+def test_unselect_all_route(client, mock_current_repo, mocker):
+    remember = mocker.spy(app.state.repos, 'remember')
+    response = client.post('/unselect-all', data={'file_types': ['.txt']})
     assert response.status_code == 200
-    assert 'checked' not in response.text
+    assert 'Total: 0 files, 0 bytes, 0 tokens' in response.text
+    assert remember.call_args.args[2:] == ([], ['.txt'])
 
-def test_delete_route(client, mock_current_repo, mocker):
-    mocker.patch('os.path.exists', return_value=True)
-    mocker.patch('subprocess.run')
-    response = client.post('/delete')
+def test_delete_route(client, mock_current_repo, mocker, opened_repo):
+    mocker.patch('os.path.isdir', return_value=True)
+    rmtree = mocker.patch('shutil.rmtree')
+    response = client.post('/delete', data={'repo_id': repo_id(mock_current_repo.path)})
     assert response.status_code == 200
-    assert app.state.current_repo is None
\ No newline at end of file
+    rmtree.assert_called_once_with(mock_current_repo.path)
+    assert opened_repo(repo_id(mock_current_repo.path)) is None
\ No newline at end of file
@@ -0,0 +1,143 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import pytest
+import utils
+from utils import blob_sha, get_file_types
+from scan_index import ScanIndex, TokenCache
+
+@pytest.fixture
+def temp_repo():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        repo_path = os.path.join(tmpdirname, "repo")
+        os.makedirs(os.path.join(repo_path, "subdir"))
+        with open(os.path.join(repo_path, "file1.py"), "w") as f:
+            f.write("print('Hello')")
+        with open(os.path.join(repo_path, "subdir", "file2.txt"), "w") as f:
+            f.write("Hello, world!")
+        with open(os.path.join(repo_path, "binary_file"), "wb") as f:
+            f.write(b'\x00\x01\x02\x03')
+        yield repo_path, os.path.join(tmpdirname, "index.db")
+
+def test_index_matches_plain_scan(temp_repo):
+    repo_path, index_path = temp_repo
+    assert get_file_types(repo_path, index_path=index_path) == get_file_types(repo_path)
+    assert get_file_types(repo_path, index_path=index_path) == get_file_types(repo_path)
+
+def test_rescan_only_tokenizes_changed_files(temp_repo, mocker):
+    repo_path, index_path = temp_repo
+    get_file_types(repo_path, index_path=index_path)
+
+    read_text = mocker.spy(utils, 'read_text')
+    get_file_types(repo_path, index_path=index_path)
+    assert read_text.call_count == 0
+
+    with open(os.path.join(repo_path, "file1.py"), "w") as f:
+        f.write("print('Hello, again')")
+    _, file_data, _ = get_file_types(repo_path, index_path=index_path)
+    assert read_text.call_count == 1
+    assert file_data["file1.py"]['size'] == 21
+
+def test_skipped_files_are_indexed(temp_repo):
+    repo_path, index_path = temp_repo
+    get_file_types(repo_path, index_path=index_path)
+    with ScanIndex(index_path) as index:
+        rows = index.load('cl100k_base')
+    assert rows["binary_file"][5] == 1
+    assert rows[os.path.join("subdir", "file2.txt")][4] == 4
+
+def test_removed_files_are_dropped(temp_repo):
+    repo_path, index_path = temp_repo
+    get_file_types(repo_path, index_path=index_path)
+    os.remove(os.path.join(repo_path, "file1.py"))
+    _, file_data, _ = get_file_types(repo_path, index_path=index_path)
+    assert len(file_data) == 1
+    with ScanIndex(index_path) as index:
+        assert "file1.py" not in index.load('cl100k_base')
+
+def test_index_is_kept_per_encoding(temp_repo, mocker):
+    repo_path, index_path = temp_repo
+    cl100k = get_file_types(repo_path, index_path=index_path)
+    o200k = get_file_types(repo_path, index_path=index_path, encoding='o200k_base')
+    assert o200k == get_file_types(repo_path, encoding='o200k_base')
+
+    read_text = mocker.spy(utils, 'read_text')
+    assert get_file_types(repo_path, index_path=index_path) == cl100k
+    assert get_file_types(repo_path, index_path=index_path, encoding='o200k_base') == o200k
+    assert read_text.call_count == 0
+
+def test_estimate_mode_does_not_read_files(temp_repo, mocker):
+    repo_path, index_path = temp_repo
+    read_text = mocker.spy(utils, 'read_text')
+    _, file_data, skipped_files = get_file_types(repo_path, index_path=index_path, mode='estimate')
+    assert read_text.call_count == 0
+    assert all(info['estimated'] for info in file_data.values())
+    assert file_data["file1.py"]['tokens'] == round(14 * 0.25)
+    with ScanIndex(index_path) as index:
+        assert index.load('cl100k_base') == {}
+
+def test_estimate_mode_uses_index_and_calibration(temp_repo):
+    repo_path, index_path = temp_repo
+    calibration_path = os.path.join(os.path.dirname(index_path), "calibration.db")
+    exact = get_file_types(repo_path, index_path=index_path, calibration_path=calibration_path)
+    assert get_file_types(repo_path, index_path=index_path, mode='estimate') == exact
+
+    with open(os.path.join(repo_path, "file3.py"), "w") as f:
+        f.write("print('Hello')" * 10)
+    with open(os.path.join(repo_path, "binary_file2"), "wb") as f:
+        f.write(b'\x00' * 100)
+    _, file_data, skipped_files = get_file_types(repo_path, index_path=index_path, mode='estimate',
+                                                 calibration_path=calibration_path)
+    # file1.py was 14 bytes and 4 tokens, so .py is calibrated at 4/14 tokens per byte
+    assert file_data["file3.py"] == {'count': 1, 'size': 140, 'tokens': 40, 'estimated': True}
+    assert 'estimated' not in file_data["file1.py"]
+    assert "binary_file2" in skipped_files
+
+def test_token_cache_evicts_least_recently_used(tmp_path):
+    with TokenCache(str(tmp_path / "tokens.db"), max_entries=3) as cache:
+        cache.update('o200k_base', {'a': 1, 'b': None})
+        cache.update('o200k_base', {'c': 3})
+        assert cache.load('o200k_base', ['a', 'b', 'x']) == {'a': 1, 'b': None}
+        assert cache.load('cl100k_base', ['a']) == {}
+        cache.update('o200k_base', {'d': 4})
+        assert cache.load('o200k_base', ['a', 'b', 'c', 'd']) == {'a': 1, 'b': None, 'd': 4}
+        cache.update('o200k_base', {'d': 5})
+    with TokenCache(str(tmp_path / "tokens.db"), max_entries=3) as cache:
+        assert cache.db.execute("select n from blob_count").fetchone()[0] == 3
+        cache.update('o200k_base', {'e': 6})
+        assert cache.load('o200k_base', ['a', 'b', 'd', 'e']) == {'b': None, 'd': 5, 'e': 6}
+
+def test_forks_share_token_cache(temp_repo, tmp_path, mocker):
+    repo_path, _ = temp_repo
+    cache_path = str(tmp_path / "tokens.db")
+    fork_path = str(tmp_path / "fork")
+    shutil.copytree(repo_path, fork_path)
+    with open(os.path.join(fork_path, "new.py"), "w") as f:
+        f.write("print('new')")
+
+    original = get_file_types(repo_path, cache_path=cache_path)
+    assert original == get_file_types(repo_path)
+    read = mocker.spy(utils, 'read_file_bytes')
+    count_texts = mocker.spy(utils, 'count_texts')
+    file_types, file_data, skipped_files = get_file_types(fork_path, cache_path=cache_path)
+    read_paths = [call.args[0] for call in read.call_args_list]
+    assert len(read_paths) == len(set(read_paths))  # hashed and decoded in one read
+    assert [call.args[0] for call in count_texts.call_args_list if call.args[0]] == [["print('new')"]]
+    assert file_data["subdir/file2.txt"] == original[1]["subdir/file2.txt"]
+    assert skipped_files == ["binary_file"]
+
+def test_tree_scan_reuses_working_tree_counts(temp_repo, tmp_path, mocker):
+    repo_path, _ = temp_repo
+    cache_path = str(tmp_path / "tokens.db")
+    subprocess.run(['git', 'init', '-q', repo_path], check=True)
+    subprocess.run(['git', '-C', repo_path, 'add', '-A'], check=True)
+    subprocess.run(['git', '-C', repo_path, '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-qm', 'init'],
+                   check=True)
+    expected = get_file_types(repo_path, cache_path=cache_path)
+    scan_blobs = mocker.spy(utils, 'scan_blobs')
+    assert get_file_types(repo_path, revision='HEAD', cache_path=cache_path) == expected
+    assert scan_blobs.call_count == 0
+    with open(os.path.join(repo_path, "file1.py"), "rb") as f:
+        assert blob_sha(f.read()) == subprocess.run(['git', '-C', repo_path, 'rev-parse', 'HEAD:file1.py'],
+                                                    check=True, capture_output=True, text=True).stdout.strip()
@@ -0,0 +1,110 @@
+import threading
+import time
+import pytest
+from shared_scans import SharedScans
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "state.db")
+
+
+@pytest.fixture
+def workers(db_path):
+    workers = [SharedScans(db_path), SharedScans(db_path)]
+    yield workers
+    for worker in workers:
+        worker.close()
+
+
+def test_stored_scan_is_shared(workers):
+    first, second = workers
+    key = ('repo', None, 'cl100k_base')
+    version, scan = first.scan_once(key, 'repo', lambda: {'files': 3})
+    assert scan == {'files': 3}
+    assert second.version(key) == version
+    assert second.scan_once(key, 'repo', lambda: pytest.fail("scanned twice")) == (version, {'files': 3})
+
+    fresh_version, _ = second.scan_once(key, 'repo', lambda: {'files': 4}, fresh=True)
+    assert fresh_version != version
+    assert first.load(key) == (fresh_version, {'files': 4})
+
+    first.forget('repo')
+    assert second.version(key) is None
+
+
+def test_unchanged_scan_is_not_stored_again(workers, db_path):
+    first, second = workers
+    key = ('repo', None, 'cl100k_base')
+    version = first.store(key, 'repo', {'files': 3})
+    changes = second.scans_db().conn.total_changes
+    assert second.store(key, 'repo', {'files': 3}) == version
+    assert second.scans_db().conn.total_changes - changes == 1  # only the small scans row
+    assert first.load(key) == (version, {'files': 3})
+    assert first.scans_path != db_path
+    assert first.db().execute("select name from sqlite_master where name like 'scan%'").fetchall() == []
+    assert second.store(key, 'repo', {'files': 4}) != version
+    assert first.scans_db().execute("select count(*) from scan_data").fetchone()[0] == 1
+
+
+def test_one_worker_scans_while_others_wait(workers):
+    key = ('repo', None, 'cl100k_base')
+    started = threading.Event()
+    calls = []
+    results = []
+
+    def scan():
+        calls.append(threading.current_thread().name)
+        started.set()
+        time.sleep(0.3)
+        return 'scanned'
+
+    def run(worker):
+        results.append(worker.scan_once(key, 'repo', scan, fresh=True))
+
+    threads = [threading.Thread(target=run, args=(worker,)) for worker in workers]
+    threads[0].start()
+    assert started.wait(5)
+    threads[1].start()
+    for thread in threads:
+        thread.join(10)
+    assert len(calls) == 1
+    assert results[0] == results[1]
+
+
+def test_waiter_scans_when_holder_stores_nothing(workers):
+    first, second = workers
+    key = ('repo', None, 'cl100k_base')
+    lease = first.acquire(key)
+    assert lease is not None and first.acquire(key) is None and second.held(key)
+    threading.Timer(0.2, lease.release).start()
+    version, scan = second.scan_once(key, 'repo', lambda: 'scanned here', fresh=True)
+    assert scan == 'scanned here' and not first.held(key)
+
+
+def test_lease_renewal_closes_its_connection(db_path):
+    scans = SharedScans(db_path, lease_seconds=0.3)
+    try:
+        lease = scans.acquire('key')
+        time.sleep(0.4)
+        assert scans.held('key')  # renewed past its first expiry
+        lease.release()
+        lease.renewer.join(5)
+        assert not lease.renewer.is_alive()
+        assert len(scans.connections) == 2  # this thread's state and scans databases
+    finally:
+        scans.close()
+
+
+def test_expired_lease_can_be_taken(db_path):
+    first, second = SharedScans(db_path, lease_seconds=0.2), SharedScans(db_path)
+    try:
+        lease = first.acquire('key')
+        lease.released.set()  # the holder died: no renewal and no release
+        assert second.acquire('key') is None
+        time.sleep(0.3)
+        assert not second.held('key')
+        assert second.acquire('key') is not None
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,71 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from single_flight import SingleFlight
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        yield executor
+
+
+def test_concurrent_callers_share_one_call(executor):
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def scan(name):
+        calls.append(name)
+        release.wait(5)
+        return f"scanned {name}"
+
+    futures = [flights.submit('repo', executor, scan, 'repo') for _ in range(5)]
+    other = flights.submit('other', executor, scan, 'other')
+    release.set()
+    assert {future.result() for future in futures} == {"scanned repo"}
+    assert other.result() == "scanned other"
+    assert sorted(calls) == ['other', 'repo']
+
+    assert flights.submit('repo', executor, scan, 'repo').result() == "scanned repo"
+    assert len(calls) == 2
+    assert flights.submit('repo', executor, scan, 'again', fresh=True).result() == "scanned again"
+    assert flights.get('repo') == "scanned again"
+
+
+def test_failed_calls_are_not_kept(executor):
+    flights = SingleFlight()
+
+    def fail():
+        raise ValueError("scan failed")
+
+    with pytest.raises(ValueError):
+        flights.submit('repo', executor, fail).result()
+    assert flights.get('repo') is None
+    assert flights.submit('repo', executor, lambda: 'ok').result() == 'ok'
+
+
+def test_forgotten_call_result_is_dropped(executor):
+    flights = SingleFlight()
+    release = threading.Event()
+    stale = flights.submit(('repo', 'HEAD'), executor, lambda: release.wait(5) and 'stale')
+    flights.set(('repo', None), 'kept')
+    flights.set(('other', None), 'other')
+
+    flights.forget(lambda key: key[0] == 'repo')
+    fresh = flights.submit(('repo', 'HEAD'), executor, lambda: 'fresh')
+    release.set()
+    assert stale.result() == 'stale'
+    assert fresh.result() == 'fresh'
+    assert flights.get(('repo', 'HEAD')) == 'fresh'
+    assert flights.get(('repo', None)) is None
+    assert flights.get(('other', None)) == 'other'
+
+
+def test_only_recent_results_are_kept(executor):
+    flights = SingleFlight(max_results=2)
+    for key in ('a', 'b'):
+        flights.submit(key, executor, str.upper, key).result()
+    assert flights.get('a') == 'A'  # now more recently used than 'b'
+    flights.set('c', 'C')
+    assert (flights.get('a'), flights.get('b'), flights.get('c')) == ('A', None, 'C')
@@ -0,0 +1,29 @@
+from tokenizer import get_tokenizer, resolve_encoding, DEFAULT_ENCODING
+from utils import count_tokens
+
+def test_tokenizer_is_cached_per_encoding():
+    assert get_tokenizer('cl100k_base') is get_tokenizer('cl100k_base')
+    assert get_tokenizer('cl100k_base') is not get_tokenizer('o200k_base')
+
+def test_count_batch_matches_count():
+    texts = ["Hello, world!", "", "print('Hello')", "<|endoftext|> is ordinary text here"]
+    tokenizer = get_tokenizer('cl100k_base')
+    assert tokenizer.count_batch(texts) == [tokenizer.count(text) for text in texts]
+
+def test_cut_keeps_every_character():
+    tokenizer = get_tokenizer('cl100k_base')
+    text = "naïve café 日本語のテキスト"
+    total = tokenizer.count(text)
+    for offset in range(1, total):
+        head, tail = tokenizer.cut(text, [offset])
+        assert head + tail == text
+    pieces = tokenizer.cut(text, [1, 3])
+    assert len(pieces) == 3 and ''.join(pieces) == text
+
+def test_count_tokens_with_encoding():
+    assert count_tokens("Hello, world!", encoding='o200k_base') == get_tokenizer('o200k_base').count("Hello, world!")
+
+def test_resolve_encoding():
+    assert resolve_encoding('o200k_base') == 'o200k_base'
+    assert resolve_encoding(None, 'p50k_base') == 'p50k_base'
+    assert resolve_encoding('not-an-encoding') == DEFAULT_ENCODING
@@ -1,7 +1,11 @@
 import pytest
 import os
 import tempfile
-from utils import count_tokens, get_file_types, get_directory_structure, is_binary
+import utils
+import subprocess
+import tarfile
+from file_table import FileTable
+from utils import count_tokens, directory_children, get_file_types, get_directory_structure, is_binary, batch_files, read_text, scan_archive, scan_repo, scan_tree
 
 def test_count_tokens():
     assert count_tokens("Hello, world!") == 4
@@ -59,15 +63,15 @@ def test_get_file_types(temp_repo):
     assert len(skipped_files) == 1  # binary_file should be skipped
 
 def test_get_directory_structure(temp_repo):
-    _, file_data, skipped_files = get_file_types(temp_repo)
-    structure = get_directory_structure(temp_repo, file_data, skipped_files)
+    scan = scan_repo(temp_repo)
+    structure = scan.structure
     
     assert isinstance(structure, dict)
     assert structure['name'] == os.path.basename(temp_repo)
     assert structure['type'] == 'directory'
     assert 'children' in structure
     
-    children = structure['children']
+    children = directory_children(scan.file_data, structure)
     assert len(children) == 8  # file1.txt, file2.py, dir1, dir2, .hidden_dir, .gitignore, LICENSE, binary_file
     
     file_names = [child['name'] for child in children]
@@ -90,9 +94,9 @@ def test_get_directory_structure(temp_repo):
     
     dir1 = next(child for child in children if child['name'] == 'dir1')
     assert dir1['type'] == 'directory'
-    assert len(dir1['children']) == 2  # file3.js and subdir1
+    assert len(directory_children(scan.file_data, dir1)) == 2  # file3.js and subdir1
     
-    file3 = dir1['children'][0]
+    file3 = directory_children(scan.file_data, dir1)[0]
     assert file3['name'] == 'file3.js'
     assert file3['type'] == 'file'
     assert file3['size'] == 29
@@ -100,30 +104,31 @@ def test_get_directory_structure(temp_repo):
     
     dir2 = next(child for child in children if child['name'] == 'dir2')
     assert dir2['type'] == 'directory'
-    assert len(dir2['children']) == 0
+    assert len(directory_children(scan.file_data, dir2)) == 0
 import json
 def test_deeply_nested_structure(temp_repo):
-    _, file_data, skipped_files = get_file_types(temp_repo)
-    structure = get_directory_structure(temp_repo, file_data, skipped_files)
+    scan = scan_repo(temp_repo)
+    structure = scan.structure
     print(json.dumps(structure, indent=2))
     
     # Navigate to the deepest directory
-    deepest_dir = structure['children'][-1]['children'][1]['children'][0]
+    def child(directory, name):
+        return next(child for child in directory_children(scan.file_data, directory) if child['name'] == name)
+
+    deepest_dir = child(child(child(structure, 'dir1'), 'subdir1'), 'subsubdir1')
     assert deepest_dir['name'] == 'subsubdir1'
     assert deepest_dir['type'] == 'directory'
-    assert len(deepest_dir['children']) == 1
-    assert deepest_dir['children'][0]['name'] == 'file5.py'
+    assert [child['name'] for child in directory_children(scan.file_data, deepest_dir)] == ['file5.py']
 
 def test_hidden_directory(temp_repo):
-    file_types, file_data, skipped_files = get_file_types(temp_repo)
-    structure = get_directory_structure(temp_repo, file_data, skipped_files)
+    scan = scan_repo(temp_repo)
+    file_types, structure = scan.file_types, scan.structure
     
     # Check if hidden directory is included
     hidden_dir = next((child for child in structure['children'] if child['name'] == '.hidden_dir'), None)
     assert hidden_dir is not None
     assert hidden_dir['type'] == 'directory'
-    assert len(hidden_dir['children']) == 1
-    assert hidden_dir['children'][0]['name'] == 'hidden_file.txt'
+    assert [child['name'] for child in directory_children(scan.file_data, hidden_dir)] == ['hidden_file.txt']
 
     # Check if hidden files are counted in file_types
     assert '.txt' in file_types
@@ -142,4 +147,116 @@ def test_no_extension_handling(temp_repo):
 def test_binary_file_skipping(temp_repo):
     _, _, skipped_files = get_file_types(temp_repo)
     assert len(skipped_files) == 1
-    assert any('binary_file' in file for file in skipped_files)
\ No newline at end of file
+    assert any('binary_file' in file for file in skipped_files)
+
+
+@pytest.mark.parametrize("executor", ["process", "thread"])
+def test_get_file_types_parallel_matches_serial(temp_repo, executor):
+    serial = get_file_types(temp_repo)
+    parallel = get_file_types(temp_repo, workers=4, executor=executor)
+    assert parallel == serial
+    assert list(parallel[0]) == list(serial[0])
+    assert list(parallel[1]) == list(serial[1])
+
+def test_batch_files():
+    batches = list(batch_files(['a', 'b', 'c', 'd'], [10, 10, 30, 5], batch_bytes=20))
+    assert batches == [['a', 'b'], ['c'], ['d']]
+
+def test_read_text_matches_text_mode_read(temp_repo):
+    crlf_path = os.path.join(temp_repo, "crlf.txt")
+    with open(crlf_path, "wb") as f:
+        f.write("line one\r\nline two\rline thrée\n".encode("utf-8"))
+    with open(crlf_path, "r", encoding="utf-8") as f:
+        assert read_text(crlf_path) == f.read()
+    assert read_text(os.path.join(temp_repo, "binary_file")) is None
+
+def test_read_text_memory_maps_large_files(temp_repo, mocker):
+    mocker.patch('utils.MMAP_THRESHOLD', 16)
+    mmap_spy = mocker.spy(utils.mmap, 'mmap')
+    assert read_text(os.path.join(temp_repo, "file2.py")) == "print('Hello, world!')"
+    assert mmap_spy.call_count == 1
+
+def test_empty_file_is_scanned(temp_repo):
+    open(os.path.join(temp_repo, "empty.py"), "w").close()
+    file_types, _, _ = get_file_types(temp_repo)
+    assert file_types[".py"]["count"] == 3
+
+def test_directory_structure_is_built_from_scan_data():
+    file_data = {
+        'a.py': {'count': 1, 'size': 10, 'tokens': 3},
+        os.path.join('pkg', 'b.py'): {'count': 1, 'size': 20, 'tokens': 5},
+        os.path.join('pkg', 'sub', 'c.py'): {'count': 1, 'size': 30, 'tokens': 7},
+    }
+    skipped_files = [os.path.join('pkg', 'image.png')]
+    table = FileTable.from_file_data(file_data)
+    structure = get_directory_structure('/does/not/exist/repo', table, skipped_files, ['pkg', os.path.join('pkg', 'sub'), 'empty'])
+
+    assert structure['name'] == 'repo'
+    assert (structure['files'], structure['size'], structure['tokens']) == (3, 60, 15)
+    assert [child['name'] for child in directory_children(table, structure)] == ['a.py', 'empty', 'pkg']
+    pkg = directory_children(table, structure)[2]
+    assert (pkg['files'], pkg['size'], pkg['tokens']) == (2, 50, 12)
+    assert [child['name'] for child in directory_children(table, pkg)] == ['b.py', 'image.png', 'sub']
+    assert directory_children(table, pkg)[1]['skipped'] is True
+    assert structure['children'][0]['files'] == 0
+    # The tree keeps no per-file entries: files are FileTable id ranges
+    b_id = table.ids[os.path.join('pkg', 'b.py')]
+    assert pkg['file_ids'] == (b_id, b_id + 1)
+    assert all(child['type'] == 'directory' for child in pkg['children'])
+
+def test_scan_repo_reports_progress(temp_repo):
+    calls = []
+    scan = scan_repo(temp_repo, progress=lambda *args: calls.append(args))
+    total = len(scan.file_data) + len(scan.skipped_files)
+    assert calls[0] == (0, total, 0)
+    assert calls[-1] == (total, total, sum(info['tokens'] for info in scan.file_data.values()))
+
+def commit_all(repo_path):
+    subprocess.run(['git', 'init', '-q', repo_path], check=True)
+    subprocess.run(['git', '-C', repo_path, 'add', '-A'], check=True)
+    subprocess.run(['git', '-C', repo_path, '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-qm', 'init'],
+                   check=True)
+
+def test_scan_tree_matches_working_tree_scan(temp_repo, tmp_path):
+    commit_all(temp_repo)
+    cache_path = str(tmp_path / 'blobs.db')
+    assert get_file_types(temp_repo, revision='HEAD', cache_path=cache_path) == get_file_types(temp_repo)
+    scan = scan_tree(temp_repo, cache_path=cache_path)
+    assert list(scan.file_data) == list(get_file_types(temp_repo)[1])
+    assert set(scan.blobs) == set(scan.file_data) | set(scan.skipped_files)
+
+def test_scan_tree_reuses_blob_counts(temp_repo, tmp_path, mocker):
+    commit_all(temp_repo)
+    cache_path = str(tmp_path / 'blobs.db')
+    first = scan_tree(temp_repo, cache_path=cache_path)
+    scan_blobs = mocker.spy(utils, 'scan_blobs')
+    calls = []
+    second = scan_tree(temp_repo, cache_path=cache_path, progress=lambda *args: calls.append(args))
+    assert scan_blobs.call_count == 0
+    assert second.file_types == first.file_types
+    assert calls == [(len(second.blobs), len(second.blobs), sum(info['tokens'] for info in second.file_types.values()))]
+
+def test_scan_tree_applies_default_ignores(tmp_path):
+    repo_path = str(tmp_path / 'repo')
+    os.makedirs(os.path.join(repo_path, 'node_modules', 'lib'))
+    with open(os.path.join(repo_path, 'node_modules', 'lib', 'index.js'), 'w') as f:
+        f.write("module.exports = 1;")
+    with open(os.path.join(repo_path, 'main.py'), 'w') as f:
+        f.write("print('main')")
+    commit_all(repo_path)
+    assert list(scan_tree(repo_path).file_data) == ['main.py']
+
+def test_scan_archive_matches_working_tree_scan(temp_repo, tmp_path):
+    archive_path = str(tmp_path / 'repo.tar.gz')
+    with tarfile.open(archive_path, 'w:gz') as archive:
+        archive.add(temp_repo, arcname='repo-main')
+    cache_path = str(tmp_path / 'tokens.db')
+    expected = get_file_types(temp_repo)
+    assert get_file_types(archive_path, cache_path=cache_path) == expected
+    calls = []
+    scan = scan_archive(archive_path, cache_path=cache_path, batch_bytes=16,
+                        progress=lambda *args: calls.append(args))
+    assert scan.member_prefix == 'repo-main/'
+    assert list(scan.file_data) == list(expected[1])
+    assert len(calls) > 2
+    assert calls[-1] == (len(scan.blobs), len(scan.blobs), sum(info['tokens'] for info in expected[0].values()))
@@ -0,0 +1,47 @@
+import codecs
+import os
+from functools import lru_cache
+import tiktoken
+
+ENCODINGS = ('cl100k_base', 'o200k_base', 'p50k_base', 'r50k_base')
+DEFAULT_ENCODING = os.environ.get('TOKEN_ENCODING', 'cl100k_base')
+
+
+class TiktokenBackend:
+    """
+    Counts tokens with a single tiktoken encoding. Special tokens are
+    treated as ordinary text, so counting never raises on file content.
+    """
+
+    def __init__(self, encoding_name):
+        self.name = encoding_name
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def count(self, text):
+        return len(self.encoding.encode_ordinary(text))
+
+    def count_batch(self, texts):
+        return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(texts)]
+
+    def cut(self, text, offsets):
+        """
+        Split text before each of the given increasing token offsets. A cut
+        inside a multi-byte character moves to the end of that character,
+        so the pieces always join back to text.
+        """
+        tokens = self.encoding.encode_ordinary(text)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        bounds = [0, *offsets, len(tokens)]
+        pieces = [decoder.decode(self.encoding.decode_bytes(tokens[start:end]))
+                  for start, end in zip(bounds[:-1], bounds[1:], strict=True)]
+        pieces[-1] += decoder.decode(b'', final=True)
+        return pieces
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(encoding_name=DEFAULT_ENCODING):
+    return TiktokenBackend(encoding_name)
+
+
+def resolve_encoding(requested, default=DEFAULT_ENCODING):
+    return requested if requested in ENCODINGS else default
@@ -1,92 +1,588 @@
+import hashlib
+import mmap
 import os
-import tiktoken
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cached_property, partial
+from collections import Counter
+from file_table import FileTable, get_extension, tree_order_key
+from archives import archive_suffix, iter_members, member_prefix
+from git_objects import CatFile, ls_tree
+from ignore_rules import DEFAULT_IGNORES, IgnoreEngine, RuleSet
+from scan_index import Calibration, ScanIndex, TokenCache, stat_key
+from tokenizer import DEFAULT_ENCODING, get_tokenizer
 
-def count_tokens(text):
-    enc = tiktoken.encoding_for_model("gpt-4")
-    return len(enc.encode(text, disallowed_special=()))
+DEFAULT_TOKENS_PER_BYTE = 0.25
+TEXT_CHARACTERS = bytearray({7,8,9,10,12,13,27} | set(range(0x20, 0x100)) - {0x7f})
+BINARY_PROBE_SIZE = 8192
+MMAP_THRESHOLD = 1 << 20
 
-def is_binary(file_path, chunk_size=8192):
+def count_tokens(text, encoding=DEFAULT_ENCODING):
+    return get_tokenizer(encoding).count(text)
+
+def is_binary_chunk(chunk):
+    if not chunk:
+        return False
+    if b'\x00' in chunk:  # Check for null bytes
+        return True
+    # Check for a high percentage of non-text characters
+    return float(len(chunk.translate(None, TEXT_CHARACTERS))) / len(chunk) > 0.30
+
+def is_binary(file_path, chunk_size=BINARY_PROBE_SIZE):
     """
     Check if a file is binary by reading a chunk and looking for null bytes
     and other non-text characters.
     """
     try:
         with open(file_path, 'rb') as file:
-            chunk = file.read(chunk_size)
-            if b'\x00' in chunk:  # Check for null bytes
-                return True
-            # Check for a high percentage of non-text characters
-            text_characters = bytearray({7,8,9,10,12,13,27} | set(range(0x20, 0x100)) - {0x7f})
-            return float(len(chunk.translate(None, text_characters))) / len(chunk) > 0.30
+            return is_binary_chunk(file.read(chunk_size))
     except IOError:
         return False
     
-def get_file_types(repo_path):
+def decode_text(data):
+    """
+    Decode a file's bytes the way a text-mode read would, or return None
+    if they look binary or are not valid UTF-8.
+    """
+    if is_binary_chunk(data[:BINARY_PROBE_SIZE]):
+        return None
+    try:
+        text = str(data, 'utf-8')
+    except UnicodeDecodeError:
+        return None
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+def read_file_bytes(file_path, parse):
+    """
+    Return parse(contents) for a file, or None if it cannot be read. Large
+    files are memory-mapped, so parse must not keep the buffer.
+    """
+    try:
+        with open(file_path, 'rb', buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < MMAP_THRESHOLD:
+                return parse(f.readall())
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return parse(data)
+    except (OSError, ValueError):
+        return None
+
+def read_text(file_path):
+    """
+    Return the contents of a text file, or None if the file is binary
+    or cannot be decoded. The file is opened once: large files are
+    memory-mapped and both the binary probe and the UTF-8 decode run on
+    the same buffer.
+    """
+    return read_file_bytes(file_path, decode_text)
+
+def blob_sha(data):
+    """The git blob SHA of some content, as `git hash-object` computes it."""
+    digest = hashlib.sha1(b'blob %d\0' % len(data))
+    digest.update(data)
+    return digest.hexdigest()
+
+def count_texts(texts, encoding=DEFAULT_ENCODING):
+    """Token count of each text, or None where the text is None, in one batch call."""
+    counts = iter(get_tokenizer(encoding).count_batch([text for text in texts if text is not None]))
+    return [None if text is None else next(counts) for text in texts]
+
+def hash_and_decode(data):
+    return blob_sha(data), decode_text(data)
+
+def scan_files(file_paths, encoding=DEFAULT_ENCODING, cache_path=None):
+    """
+    Return the token count of each file, or None for skipped files. All
+    readable files in the batch are encoded with one batch call. With a
+    cache_path, files are hashed first and only content missing from the
+    TokenCache there is tokenized. Each file is read once: it is hashed and
+    decoded from the same buffer.
+    """
+    if cache_path is None:
+        return count_texts([read_text(file_path) for file_path in file_paths], encoding)
+
+    contents = [read_file_bytes(file_path, hash_and_decode) or (None, None) for file_path in file_paths]
+    shas = [sha for sha, _ in contents]
+    with TokenCache(cache_path) as cache:
+        cached = cache.load(encoding, {sha for sha in shas if sha})
+    missing = {sha: text for sha, text in contents if sha and sha not in cached}
+    counted = dict(zip(missing, count_texts(list(missing.values()), encoding), strict=True))
+    if counted:
+        with TokenCache(cache_path) as cache:
+            cache.update(encoding, counted)
+    cached.update(counted)
+    return [cached.get(sha) for sha in shas]
+
+def batch_files(file_paths, sizes, batch_bytes=1 << 20, max_files=256):
+    """
+    Group files into batches of roughly batch_bytes so each tokenizer call
+    (and each pool task) carries enough work to amortize its overhead.
+    """
+    batch = []
+    batch_size = 0
+    for file_path, size in zip(file_paths, sizes, strict=True):
+        batch.append(file_path)
+        batch_size += size
+        if batch_size >= batch_bytes or len(batch) >= max_files:
+            yield batch
+            batch = []
+            batch_size = 0
+    if batch:
+        yield batch
+
+def scan_files_batched(file_paths, sizes, encoding=DEFAULT_ENCODING, workers=None, executor='process',
+                       progress=None, cache_path=None):
+    """
+    Scan files in batches, optionally across a pool. progress, if given,
+    is called with the number of files and tokens of each finished batch.
+    """
+    scan = partial(scan_files, encoding=encoding, cache_path=cache_path)
+    batches = batch_files(file_paths, sizes)
+
+    def collect(results):
+        tokens = []
+        for batch in results:
+            tokens.extend(batch)
+            if progress:
+                progress(len(batch), sum(count for count in batch if count))
+        return tokens
+
+    if workers and workers > 1 and len(file_paths) > 1:
+        pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+        with pool_class(max_workers=workers) as pool:
+            return collect(pool.map(scan, batches))
+    return collect(map(scan, batches))
+
+def estimate_tokens(size, ratio):
+    return round(size * ratio)
+
+@dataclass
+class RepoScan:
+    """
+    Result of one walk over a repo. Every path is relative to repo_path;
+    file_data is a FileTable in tree order and directories lists the
+    directories that survived ignore pruning, in walk order. Scans of a
+    git revision or an archive map each path to its blob SHA in blobs;
+    member_prefix is the top-level directory dropped from archive paths.
+    """
+    repo_path: str
+    file_types: dict
+    file_data: FileTable
+    skipped_files: list
+    directories: list = field(default_factory=list)
+    blobs: dict = None
+    member_prefix: str = ''
+
+    def __post_init__(self):
+        if not isinstance(self.file_data, FileTable):
+            self.file_data = FileTable.from_file_data(self.file_data)
+
+    @cached_property
+    def structure(self):
+        return get_directory_structure(self.repo_path, self.file_data, self.skipped_files, self.directories)
+
+    @cached_property
+    def directory_index(self):
+        return get_directory_index(self.structure)
+
+    @cached_property
+    def directory_nodes(self):
+        """Directory nodes indexed by their id."""
+        return sorted(self.directory_index.values(), key=lambda node: node['id'])
+
+def scan_repo(repo_path, index_path=None, workers=None, executor='process',
+              encoding=DEFAULT_ENCODING, mode='exact', calibration_path=None,
+              ignore_patterns=DEFAULT_IGNORES, progress=None, cache_path=None):
+    """
+    Files missing from the index are hashed and looked up in the global
+    TokenCache at cache_path, if given, before they are tokenized, so
+    content already counted in another repo or fork costs only a read.
+
+    In 'estimate' mode, files missing from the index are not read at all:
+    their token counts are derived from their size using per-extension
+    ratios learned from earlier exact scans, and their file_data entries
+    are flagged with 'estimated'.
+
+    progress, if given, is called as progress(files_scanned, files_total,
+    tokens_counted) while files are read; files reused from the index
+    count as scanned from the start.
+    """
     file_types = {}
-    file_data = {}
+    file_data = FileTable()
     skipped_files = []
-    for root, _, files in os.walk(repo_path):
-        if root.endswith('.git'):
-            continue
-        for file in files:
-            file_path = os.path.join(root, file)
-            
-            if is_binary(file_path):
-                skipped_files.append(file_path)
-                continue
+    directories = []
 
-            if file.startswith('.'):
-                ext = file
-            else:
-                _, ext = os.path.splitext(file)
-                if not ext:
-                    ext = "(no extension)"
-            
+    cached = {}
+    if index_path:
+        with ScanIndex(index_path) as index:
+            cached = index.load(encoding)
+
+    entries = []
+    for root, rel_root, _, files in IgnoreEngine(repo_path, ignore_patterns).walk():
+        if rel_root:
+            directories.append(rel_root)
+        for file in files:
+            rel_path = os.path.join(rel_root, file)
             try:
-                size = os.path.getsize(file_path)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                tokens = count_tokens(content)
-            except (UnicodeDecodeError, IOError):
-                skipped_files.append(file_path)
+                st = os.stat(os.path.join(root, file))
+            except OSError:
+                entries.append((rel_path, None, None))
                 continue
+            entries.append((rel_path, get_extension(file), st))
 
-            if ext in file_types:
-                file_types[ext]['count'] += 1
-                file_types[ext]['size'] += size
-                file_types[ext]['tokens'] += tokens
-            else:
-                file_types[ext] = {'count': 1, 'size': size, 'tokens': tokens}
-            file_data[file_path] = {'count': 1, 'size': size, 'tokens': tokens}
-    
-    return file_types, file_data, skipped_files
-
-def get_directory_structure(path, file_data, skipped_files):
-    name = os.path.basename(path)
-    if os.path.isfile(path):
-        if path in skipped_files:
-            return {
-                'type': 'file',
-                'name': name,
-                'path': path,
-                'skipped': True
-            }
-        info = file_data.get(path, {})
-        return {
-            'type': 'file',
-            'name': name,
-            'path': path,
-            'size': info.get('size', 0),
-            'tokens': info.get('tokens', 0),
-            'skipped': False
-        }
+    tokens_by_path = {}
+    to_scan = []
+    for rel_path, ext, st in entries:
+        if st is None:
+            continue
+        row = cached.get(rel_path)
+        if row and row[:3] == stat_key(st):
+            tokens_by_path[rel_path] = None if row[5] else row[4]
+        else:
+            to_scan.append((rel_path, ext, st.st_size))
+
+    scan_paths = [rel_path for rel_path, _, _ in to_scan]
+    estimated = set()
+    if mode == 'estimate':
+        ratios = {}
+        if calibration_path:
+            with Calibration(calibration_path) as calibration:
+                ratios = calibration.ratios(encoding)
+        for rel_path, ext, size in to_scan:
+            ratio, skip_rate = ratios.get(ext, (None, 0))
+            tokens_by_path[rel_path] = None if skip_rate > 0.5 else estimate_tokens(size, ratio or DEFAULT_TOKENS_PER_BYTE)
+        estimated.update(scan_paths)
+        scan_paths = []
+    else:
+        batch_progress = None
+        if progress:
+            counted = [len(tokens_by_path), sum(tokens or 0 for tokens in tokens_by_path.values())]
+            total = len(tokens_by_path) + len(scan_paths)
+            progress(counted[0], total, counted[1])
+
+            def batch_progress(files, tokens):
+                counted[0] += files
+                counted[1] += tokens
+                progress(counted[0], total, counted[1])
+        results = scan_files_batched(
+            [os.path.join(repo_path, rel_path) for rel_path in scan_paths],
+            [size for _, _, size in to_scan], encoding, workers, executor, batch_progress, cache_path)
+        tokens_by_path.update(zip(scan_paths, results, strict=True))
+
+    changed = []
+    seen = set()
+    scanned = set(scan_paths)
+    stats = {}
+    for rel_path, ext, st in entries:
+        if st is None:
+            skipped_files.append(rel_path)
+            continue
+        seen.add(rel_path)
+        tokens = tokens_by_path[rel_path]
+        if rel_path in scanned:
+            changed.append((rel_path, encoding, *stat_key(st), ext, tokens or 0, tokens is None))
+
+        size = st.st_size
+        ext_stats = stats.setdefault(ext, [0, 0, 0, 0])
+        ext_stats[0] += 1
+        if tokens is None:
+            ext_stats[3] += 1
+            skipped_files.append(rel_path)
+            continue
+        ext_stats[1] += size
+        ext_stats[2] += tokens
+
+        add_totals(file_types.setdefault(ext, {'count': 0, 'size': 0, 'tokens': 0}), 1, size, tokens)
+        file_data.add(rel_path, ext, size, tokens, rel_path in estimated)
+
+    if index_path and mode != 'estimate':
+        with ScanIndex(index_path) as index:
+            index.update(changed, cached.keys() - seen)
+    if calibration_path and mode != 'estimate':
+        with Calibration(calibration_path) as calibration:
+            calibration.learn(os.path.abspath(repo_path), encoding, stats)
+
+    return RepoScan(repo_path, file_types, file_data, skipped_files, directories)
+
+def scan_blobs(cat_file, shas, encoding=DEFAULT_ENCODING):
+    """Like scan_files, for blobs read through a CatFile."""
+    texts = []
+    for sha in shas:
+        try:
+            texts.append(decode_text(cat_file.read(sha)))
+        except KeyError:
+            texts.append(None)
+    return count_texts(texts, encoding)
+
+def ignore_filter(ignore_patterns):
+    """
+    Return is_ignored(rel_path) for file listings that are not walked, such
+    as git trees and archives. A file is ignored if it or any directory
+    above it matches.
+    """
+    rules = RuleSet(ignore_patterns)
+    ignored_dirs = {'': False}
+
+    def is_ignored_dir(rel_dir):
+        if rel_dir not in ignored_dirs:
+            ignored_dirs[rel_dir] = is_ignored_dir(os.path.dirname(rel_dir)) or bool(rules.match(rel_dir, True))
+        return ignored_dirs[rel_dir]
+
+    def is_ignored(rel_path):
+        return is_ignored_dir(os.path.dirname(rel_path)) or bool(rules.match(rel_path, False))
+    return is_ignored
+
+def blob_scan(repo_path, entries, tokens_by_sha, **fields):
+    """
+    Build a RepoScan from (rel_path, sha, size) entries in tree order and
+    the token count of each sha (None for skipped content).
+    """
+    file_types = {}
+    file_data = FileTable()
+    skipped_files = []
+    directories = set()
+    for rel_path, sha, size in entries:
+        rel_dir = os.path.dirname(rel_path)
+        while rel_dir and rel_dir not in directories:
+            directories.add(rel_dir)
+            rel_dir = os.path.dirname(rel_dir)
+        tokens = tokens_by_sha[sha]
+        if tokens is None:
+            skipped_files.append(rel_path)
+            continue
+        ext = get_extension(os.path.basename(rel_path))
+        add_totals(file_types.setdefault(ext, {'count': 0, 'size': 0, 'tokens': 0}), 1, size, tokens)
+        file_data.add(rel_path, ext, size, tokens)
+
+    blobs = {rel_path: sha for rel_path, sha, _ in entries}
+    return RepoScan(repo_path, file_types, file_data, skipped_files, sorted(directories, key=tree_order_key),
+                    blobs, **fields)
+
+def scan_tree(git_dir, revision='HEAD', encoding=DEFAULT_ENCODING, cache_path=None,
+              ignore_patterns=DEFAULT_IGNORES, progress=None, cat_file=None):
+    """
+    Scan a revision straight from the git object database, without a
+    checkout. The tree is listed with ls-tree and blobs are read through
+    one cat-file process. Token counts come from the TokenCache at
+    cache_path, so a blob counted in any earlier scan, of a revision or of
+    a working tree, is not read again.
+    Only ignore_patterns apply: .gitignore files do not affect files that
+    are committed.
+
+    progress is called as in scan_repo.
+    """
+    is_ignored = ignore_filter(ignore_patterns)
+    entries = sorted(
+        [(rel_path, sha, size) for rel_path, sha, size in ls_tree(git_dir, revision) if not is_ignored(rel_path)],
+        key=lambda entry: tree_order_key(entry[0]))
+
+    sizes = {sha: size for _, sha, size in entries}
+    tokens_by_sha = {}
+    if cache_path:
+        with TokenCache(cache_path) as cache:
+            tokens_by_sha = cache.load(encoding, sizes)
+    to_scan = [sha for sha in sizes if sha not in tokens_by_sha]
+
+    files_per_sha = Counter(sha for _, sha, _ in entries)
+    counted = [sum(files_per_sha[sha] for sha in tokens_by_sha),
+               sum((tokens or 0) * files_per_sha[sha] for sha, tokens in tokens_by_sha.items())]
+    if progress:
+        progress(counted[0], len(entries), counted[1])
+    scanned = {}
+    own_cat_file = cat_file is None
+    if own_cat_file:
+        cat_file = CatFile(git_dir)
+    try:
+        for batch in batch_files(to_scan, [sizes[sha] for sha in to_scan]):
+            results = scan_blobs(cat_file, batch, encoding)
+            scanned.update(zip(batch, results, strict=True))
+            if progress:
+                counted[0] += sum(files_per_sha[sha] for sha in batch)
+                counted[1] += sum((tokens or 0) * files_per_sha[sha] for sha, tokens in zip(batch, results, strict=True))
+                progress(counted[0], len(entries), counted[1])
+    finally:
+        if own_cat_file:
+            cat_file.close()
+    if cache_path and scanned:
+        with TokenCache(cache_path) as cache:
+            cache.update(encoding, scanned)
+    tokens_by_sha.update(scanned)
+    return blob_scan(git_dir, entries, tokens_by_sha)
+
+def scan_archive(archive_path, encoding=DEFAULT_ENCODING, cache_path=None, ignore_patterns=DEFAULT_IGNORES,
+                 progress=None, batch_bytes=1 << 20, max_files=256, max_member_bytes=None):
+    """
+    Scan a zip or tar archive in one streaming pass, without extracting it.
+    Members are hashed like git blobs and collected in batches of about
+    batch_bytes; content the TokenCache at cache_path already knows is not
+    decoded, the rest of each batch is tokenized with one call, and the
+    batch is then dropped, so memory stays bounded by one batch. A single
+    top-level directory shared by all members is dropped from paths.
+    The scan fails with ArchiveTooLarge if the members add up to more than
+    max_member_bytes.
+
+    progress is called as progress(files_scanned, files_scanned, tokens)
+    after each batch, since the number of members is only known at the end.
+    """
+    is_ignored = ignore_filter(ignore_patterns)
+    entries = []
+    tokens_by_sha = {}
+    batch = {}
+    pending_bytes = [0]
+    counted = [0, 0]
+
+    def flush():
+        cached = {}
+        if cache_path:
+            with TokenCache(cache_path) as cache:
+                cached = cache.load(encoding, batch)
+        missing = [sha for sha in batch if sha not in cached]
+        scanned = dict(zip(missing, count_texts([decode_text(batch[sha]) for sha in missing], encoding), strict=True))
+        if cache_path and scanned:
+            with TokenCache(cache_path) as cache:
+                cache.update(encoding, scanned)
+        tokens_by_sha.update(cached)
+        tokens_by_sha.update(scanned)
+        batch.clear()
+        pending_bytes[0] = 0
+        if progress:
+            counted[1] += sum(tokens_by_sha[sha] or 0 for _, sha, _ in entries[counted[0]:])
+            counted[0] = len(entries)
+            progress(counted[0], counted[0], counted[1])
+
+    for name, data in iter_members(archive_path, max_member_bytes):
+        if is_ignored(name):
+            continue
+        sha = blob_sha(data)
+        entries.append((name, sha, len(data)))
+        if sha not in tokens_by_sha and sha not in batch:
+            batch[sha] = data
+            pending_bytes[0] += len(data)
+            if pending_bytes[0] >= batch_bytes or len(batch) >= max_files:
+                flush()
+    flush()
+
+    prefix = member_prefix([name for name, _, _ in entries])
+    entries = sorted(((name[len(prefix):], sha, size) for name, sha, size in entries),
+                     key=lambda entry: tree_order_key(entry[0]))
+    return blob_scan(archive_path, entries, tokens_by_sha, member_prefix=prefix)
+
+def get_file_types(repo_path, revision=None, **options):
+    """
+    Scan the working tree, or with a revision, that revision's tree in the
+    object database. An archive file is scanned without extracting it.
+    """
+    if revision:
+        scan = scan_tree(repo_path, revision, **options)
+    elif os.path.isfile(repo_path) and archive_suffix(repo_path):
+        scan = scan_archive(repo_path, **options)
     else:
-        return {
-            'type': 'directory',
-            'name': name,
-            'path': path,
-            'children': [
-                get_directory_structure(os.path.join(path, child), file_data, skipped_files)
-                for child in os.listdir(path)
-            ]
-        }
\ No newline at end of file
+        scan = scan_repo(repo_path, **options)
+    return scan.file_types, scan.file_data, scan.skipped_files
+
+def add_totals(totals, count, size, tokens):
+    totals['count'] += count
+    totals['size'] += size
+    totals['tokens'] += tokens
+
+def get_directory_structure(path, file_data, skipped_files, directories=()):
+    """
+    Build the directory tree from scan results without touching the
+    filesystem. Node paths are relative to the repo ('.' for the root).
+    Only directories get nodes: a directory's own files are the FileTable
+    ids in file_ids, and directory_children builds their entries when the
+    tree is rendered, so the tree does not duplicate the table per file.
+    Skipped files, which are not in the table, are listed in 'skipped'.
+    Directory nodes carry their own id (numbered in tree order from 0 for
+    the root) and the id range [first_id, end_id) of the files below
+    them, plus their file count, size and tokens in total.
+    """
+    if not isinstance(file_data, FileTable):
+        file_data = FileTable.from_file_data(file_data)
+
+    def new_directory(name, rel_dir):
+        return {'type': 'directory', 'name': name, 'path': rel_dir, 'children': [], 'skipped': [],
+                'files': 0, 'size': 0, 'tokens': 0,
+                'file_ids': (0, 0), 'first_id': None, 'end_id': None}
+
+    root = new_directory(os.path.basename(os.path.normpath(path)), '.')
+    nodes = {'': root}
+
+    def directory_node(rel_dir):
+        node = nodes.get(rel_dir)
+        if node is None:
+            node = new_directory(os.path.basename(rel_dir), rel_dir)
+            nodes[rel_dir] = node
+            directory_node(os.path.dirname(rel_dir))['children'].append(node)
+        return node
+
+    for rel_dir in directories:
+        directory_node(rel_dir)
+
+    for rel_path in skipped_files:
+        directory_node(os.path.dirname(rel_path))['skipped'].append(
+            {'type': 'file', 'name': os.path.basename(rel_path), 'path': rel_path, 'skipped': True})
+
+    sizes, tokens = file_data.sizes, file_data.tokens
+    for file_id, rel_path in enumerate(file_data.paths):
+        node = directory_node(os.path.dirname(rel_path))
+        node['files'] += 1
+        node['size'] += sizes[file_id]
+        node['tokens'] += tokens[file_id]
+        if node['first_id'] is None:
+            node['first_id'] = file_id
+        node['end_id'] = file_id + 1
+
+    # Files come before subdirectories in tree order, so until the roll-up
+    # a directory's id range holds exactly its own files
+    for node in nodes.values():
+        if node['first_id'] is not None:
+            node['file_ids'] = (node['first_id'], node['end_id'])
+
+    # Roll totals up one level at a time, deepest directories first
+    for rel_dir in sorted(nodes, key=lambda rel_dir: rel_dir.count(os.sep) if rel_dir else -1, reverse=True):
+        node = nodes[rel_dir]
+        node['children'].sort(key=lambda child: child['name'])
+        if rel_dir:
+            parent = nodes[os.path.dirname(rel_dir)]
+            parent['files'] += node['files']
+            parent['size'] += node['size']
+            parent['tokens'] += node['tokens']
+            if node['first_id'] is not None:
+                if parent['first_id'] is None or node['first_id'] < parent['first_id']:
+                    parent['first_id'] = node['first_id']
+                if parent['end_id'] is None or node['end_id'] > parent['end_id']:
+                    parent['end_id'] = node['end_id']
+
+    stack = [root]
+    directory_id = 0
+    while stack:
+        node = stack.pop()
+        node['id'] = directory_id
+        directory_id += 1
+        stack.extend(reversed(node['children']))
+    return root
+
+def directory_children(file_data, node):
+    """
+    The children of a directory node as the tree shows them: its files,
+    built from the FileTable, and skipped files, by name, then its
+    subdirectories.
+    """
+    paths, sizes, tokens = file_data.paths, file_data.sizes, file_data.tokens
+    files = [{'type': 'file', 'name': os.path.basename(paths[file_id]), 'path': paths[file_id], 'id': file_id,
+              'size': sizes[file_id], 'tokens': tokens[file_id], 'skipped': False}
+             for file_id in range(*node['file_ids'])]
+    return sorted(files + node['skipped'], key=lambda child: child['name']) + node['children']
+
+def get_directory_index(structure):
+    """Map each directory node's path to the node."""
+    index = {}
+    stack = [structure]
+    while stack:
+        node = stack.pop()
+        index[node['path']] = node
+        stack.extend(node['children'])
+    return index